@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+
+class ActivityBuffer:
+    """
+    Отложенная запись активности: user_id -> время последнего действия.
+    Повторные клики одного пользователя между сбросами схлопываются в одну
+    запись, а сбрасывается буфер одним executemany (см.
+    repo.flush_user_activity) раз в несколько секунд и при остановке бота.
+    """
+
+    def __init__(self) -> None:
+        self._pending: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def touch(self, user_id: int, ts: int) -> None:
+        if self._pending.get(user_id, 0) < ts:
+            self._pending[user_id] = ts
+
+    def drain(self) -> list[tuple[int, int]]:
+        """Забирает накопленное: [(user_id, ts)]; буфер становится пустым."""
+        items = list(self._pending.items())
+        self._pending = {}
+        return items
+
+    def restore(self, items: list[tuple[int, int]]) -> None:
+        """Возвращает несохранённое (запись упала) — более свежие касания не затираются."""
+        for user_id, ts in items:
+            self.touch(user_id, ts)
+
+
+activity_buffer = ActivityBuffer()
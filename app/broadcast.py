@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .db import Database, spawn_detached
+from .outbound import Priority, is_unreachable_error, send_priority
+from .repo import (
+    count_broadcast_recipients,
+    create_broadcast,
+    finish_broadcast,
+    get_broadcast,
+    list_broadcast_recipients,
+    list_running_broadcasts,
+    record_broadcast_deliveries,
+    set_broadcast_cursor,
+    set_broadcast_progress_message,
+)
+
+log = logging.getLogger(__name__)
+
+# Параллельных отправителей на рассылку; общий темп всё равно задаёт OutboundScheduler
+BROADCAST_SENDERS = 8
+# Получателей на страницу (курсор сохраняется после каждой страницы)
+BROADCAST_PAGE_SIZE = 500
+# Как часто обновлять сообщение с прогрессом у админа (сек)
+BROADCAST_PROGRESS_EVERY = 5.0
+# Попыток на получателя при сетевых ошибках / 429
+BROADCAST_MAX_ATTEMPTS = 5
+
+# broadcast_id -> событие отмены для запущенных в этом процессе рассылок
+_jobs: dict[int, asyncio.Event] = {}
+
+
+def _recipient_markup() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="✖ Закрыть", callback_data="admin:close_notice")]
+        ]
+    )
+
+
+def _progress_markup(broadcast_id: int, running: bool) -> InlineKeyboardMarkup:
+    if running:
+        button = InlineKeyboardButton(text="⏹ Остановить", callback_data=f"admin:broadcast_stop:{broadcast_id}")
+    else:
+        button = InlineKeyboardButton(text="✖ Закрыть", callback_data="admin:close_notice")
+    return InlineKeyboardMarkup(inline_keyboard=[[button]])
+
+
+def _progress_text(status: str, sent: int, failed: int, total: int) -> str:
+    done = sent + failed
+    title = {
+        "running": "📨 Рассылка идёт…",
+        "done": "✅ Рассылка завершена.",
+        "cancelled": "⏹ Рассылка остановлена.",
+    }.get(status, status)
+    return (
+        f"{title}\n\n"
+        f"Обработано: <b>{done}</b> из <b>{total}</b>\n"
+        f"Успешно отправлено: <b>{sent}</b>\n"
+        f"Ошибок: <b>{failed}</b>"
+    )
+
+
+async def start_broadcast(bot: Bot, conn: Database, *, admin_id: int, chat_id: int, text: str) -> int:
+    """Создаёт задание рассылки, сообщение с прогрессом и запускает отправку в фоне."""
+    total = await count_broadcast_recipients(conn)
+    broadcast_id = await create_broadcast(conn, admin_id, chat_id, text, total)
+    msg = await bot.send_message(
+        chat_id=chat_id,
+        text=_progress_text("running", 0, 0, total),
+        reply_markup=_progress_markup(broadcast_id, running=True),
+    )
+    await set_broadcast_progress_message(conn, broadcast_id, msg.message_id)
+    # задание читает строку из БД — она должна быть закоммичена до его старта
+    uow = conn.current_uow
+    if uow is not None:
+        await uow.flush()
+    _spawn(bot, conn, broadcast_id)
+    return broadcast_id
+
+
+async def resume_broadcasts(bot: Bot, conn: Database) -> None:
+    """При старте продолжает рассылки, прерванные перезапуском, с сохранённого курсора."""
+    for row in await list_running_broadcasts(conn):
+        log.info("Resuming broadcast %s from user_id > %s", row["id"], row["cursor_user_id"])
+        _spawn(bot, conn, int(row["id"]))
+
+
+async def stop_broadcast(conn: Database, broadcast_id: int) -> None:
+    event = _jobs.get(broadcast_id)
+    if event is not None:
+        # финальный статус запишет сама рассылка, дождавшись отправок в полёте
+        event.set()
+    else:
+        await finish_broadcast(conn, broadcast_id, "cancelled")
+
+
+def _spawn(bot: Bot, conn: Database, broadcast_id: int) -> None:
+    if broadcast_id in _jobs:
+        return
+    _jobs[broadcast_id] = asyncio.Event()
+    spawn_detached(_run(bot, conn, broadcast_id))
+
+
+async def _send_one(bot: Bot, user_id: int, text: str) -> tuple[str, str | None]:
+    error: str | None = None
+    for attempt in range(BROADCAST_MAX_ATTEMPTS):
+        try:
+            await bot.send_message(
+                chat_id=user_id,
+                text=text,
+                disable_web_page_preview=True,
+                reply_markup=_recipient_markup(),
+            )
+            return "sent", None
+        except TelegramRetryAfter as e:
+            # flood control: ждём ровно столько, сколько просит Telegram
+            error = str(e)
+            await asyncio.sleep(e.retry_after)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # бот заблокирован / чат не найден / плохой запрос — повтор не поможет
+            return ("unreachable" if is_unreachable_error(e) else "failed"), str(e)[:200]
+        except Exception as e:
+            error = str(e)
+            await asyncio.sleep(min(30, 2 ** attempt))
+    return "failed", (error or "")[:200]
+
+
+class _Progress:
+    def __init__(self, bot: Bot, row) -> None:
+        self.bot = bot
+        self.broadcast_id = int(row["id"])
+        self.chat_id = int(row["chat_id"])
+        self.message_id = row["progress_message_id"]
+        self.total = int(row["total"])
+        self.sent = int(row["sent"])
+        self.failed = int(row["failed"])
+        self._shown_at = 0.0
+
+    def add(self, results: list[tuple[int, str, str | None]]) -> None:
+        for _, status, _ in results:
+            if status == "sent":
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    async def show(self, status: str = "running", *, force: bool = False) -> None:
+        now = time.monotonic()
+        if self.message_id is None or (not force and now - self._shown_at < BROADCAST_PROGRESS_EVERY):
+            return
+        self._shown_at = now
+        try:
+            # сообщение админу — интерактивная полоса, а не полоса рассылки
+            with send_priority(Priority.INTERACTIVE):
+                await self.bot.edit_message_text(
+                    chat_id=self.chat_id,
+                    message_id=int(self.message_id),
+                    text=_progress_text(status, self.sent, self.failed, self.total),
+                    reply_markup=_progress_markup(self.broadcast_id, running=status == "running"),
+                )
+        except Exception:
+            pass
+
+
+async def _run(bot: Bot, conn: Database, broadcast_id: int) -> None:
+    stop = _jobs[broadcast_id]
+    try:
+        row = await get_broadcast(conn, broadcast_id)
+        if row is None or row["status"] != "running":
+            return
+        with send_priority(Priority.BROADCAST):
+            status = await _deliver(bot, conn, row, stop)
+        await finish_broadcast(conn, broadcast_id, status)
+    except Exception:
+        # курсор сохранён — рассылка продолжится при следующем запуске
+        log.exception("Broadcast %s failed", broadcast_id)
+    finally:
+        _jobs.pop(broadcast_id, None)
+
+
+async def _deliver(bot: Bot, conn: Database, row, stop: asyncio.Event) -> str:
+    """
+    Отправляет рассылку с сохранённого курсора. Отправитель берёт следующего
+    получателя только после того, как результат предыдущего закоммичен, так
+    что после падения повторно сообщение получат не больше BROADCAST_SENDERS
+    человек — те, чья отправка была в полёте.
+    """
+    broadcast_id = int(row["id"])
+    text = str(row["text"])
+    cursor = int(row["cursor_user_id"])
+    progress = _Progress(bot, row)
+    pending: list[tuple[int, str, str | None]] = []
+    sem = asyncio.Semaphore(BROADCAST_SENDERS)
+    record_lock = asyncio.Lock()
+
+    async def record() -> None:
+        # групповой коммит: пока пишется одна пачка, следующие результаты копятся
+        nonlocal pending
+        async with record_lock:
+            if not pending:
+                # наш результат уже записан чужой пачкой
+                return
+            batch, pending = pending, []
+            await record_broadcast_deliveries(conn, broadcast_id, batch)
+            progress.add(batch)
+        await progress.show()
+
+    async def send(user_id: int) -> None:
+        async with sem:
+            if stop.is_set():
+                return
+            status, error = await _send_one(bot, user_id, text)
+            pending.append((user_id, status, error))
+            await record()
+
+    while not stop.is_set():
+        page = await list_broadcast_recipients(conn, broadcast_id, cursor, BROADCAST_PAGE_SIZE)
+        if not page:
+            break
+        await asyncio.gather(*(send(uid) for uid in page))
+        if stop.is_set():
+            break
+        cursor = page[-1]
+        await set_broadcast_cursor(conn, broadcast_id, cursor)
+
+    status = "cancelled" if stop.is_set() else "done"
+    await progress.show(status, force=True)
+    return status
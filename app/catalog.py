@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import zlib
+from dataclasses import dataclass
+from typing import Mapping
+
+import aiosqlite
+
+from .db import Database
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """
+    Снимок редко меняющихся таблиц: активные подарки, старт- и таск-спонсоры,
+    настройки. Меняются они только из админки, поэтому горячие пути читают
+    их из памяти, а не из SQLite на каждый апдейт.
+
+    ``version`` растёт при каждой инвалидации — по нему можно кэшировать
+    производные данные (клавиатуры, выборки), построенные из снимка.
+    """
+
+    version: int
+    gifts: tuple[aiosqlite.Row, ...]
+    start_sponsors: tuple[aiosqlite.Row, ...]
+    task_sponsors: tuple[aiosqlite.Row, ...]
+    settings: Mapping[str, str]
+    # channel_id старт-спонсоров типа "channel" (для chat_join_request и т.п.)
+    start_channel_ids: frozenset[int]
+    # channel_id всех спонсоров-каналов (старт + задания)
+    sponsor_channel_ids: frozenset[int]
+    # активные подарки по id (названия/эмодзи при отрисовке доски)
+    gifts_by_id: Mapping[int, aiosqlite.Row]
+
+    @property
+    def start_channels_version(self) -> int:
+        """
+        Стабильная между перезапусками версия набора проверяемых каналов
+        старт-спонсоров (в отличие от version, который живёт в процессе).
+        """
+        return zlib.crc32(",".join(map(str, sorted(self.start_channel_ids))).encode())
+
+
+_snapshot: Catalog | None = None
+_version = 0
+_lock = asyncio.Lock()
+
+
+def sponsor_type(row: aiosqlite.Row) -> str:
+    return (row["type"] or "channel").lower() if "type" in row.keys() else "channel"
+
+
+def _channel_ids(rows: tuple[aiosqlite.Row, ...]) -> frozenset[int]:
+    return frozenset(
+        int(s["channel_id"])
+        for s in rows
+        if sponsor_type(s) == "channel" and int(s["channel_id"]) != 0
+    )
+
+
+async def _load(conn: Database, version: int) -> Catalog:
+    async with conn.reader() as r:
+        cur = await r.execute("SELECT * FROM gifts WHERE is_active=1 ORDER BY sort_order ASC, id ASC")
+        gifts = tuple(await cur.fetchall())
+        cur = await r.execute("SELECT * FROM start_sponsors WHERE is_active=1 ORDER BY sort_order ASC, id ASC")
+        start_sponsors = tuple(await cur.fetchall())
+        cur = await r.execute("SELECT * FROM sponsors WHERE is_active=1 ORDER BY sort_order ASC, id ASC")
+        task_sponsors = tuple(await cur.fetchall())
+        cur = await r.execute("SELECT key, value FROM settings")
+        settings = {str(row["key"]): str(row["value"]) for row in await cur.fetchall()}
+    return Catalog(
+        version=version,
+        gifts=gifts,
+        start_sponsors=start_sponsors,
+        task_sponsors=task_sponsors,
+        settings=settings,
+        start_channel_ids=_channel_ids(start_sponsors),
+        sponsor_channel_ids=_channel_ids(start_sponsors) | _channel_ids(task_sponsors),
+        gifts_by_id={int(g["id"]): g for g in gifts},
+    )
+
+
+async def get_catalog(conn: Database) -> Catalog:
+    """
+    Текущий снимок каталога; после инвалидации перечитывается один раз
+    (конкурентные апдейты ждут одну загрузку, а не идут в БД каждый).
+    """
+    snap = _snapshot
+    if snap is not None:
+        return snap
+    return await load_catalog(conn)
+
+
+async def load_catalog(conn: Database) -> Catalog:
+    global _snapshot
+    uow = conn.current_uow
+    if uow is not None and (uow.pending or uow.in_transaction):
+        # чтение увидит незакоммиченные записи этой единицы работы: снимок
+        # отдаём только ей — при откате он не должен пережить транзакцию
+        return await _load(conn, _version)
+    async with _lock:
+        if _snapshot is not None:
+            return _snapshot
+        version = _version
+        snap = await _load(conn, version)
+        # если во время чтения каталог инвалидировали, снимок мог устареть —
+        # отдаём его текущему вызову, но не публикуем
+        if version == _version:
+            _snapshot = snap
+        return snap
+
+
+def _drop() -> None:
+    global _snapshot, _version
+    _version += 1
+    _snapshot = None
+
+
+def invalidate_catalog(conn: Database) -> None:
+    """
+    Сбрасывает снимок после изменения подарков/спонсоров/настроек.
+
+    Сброс делается сразу (чтения в этой же единице работы увидят новые
+    данные, но не опубликуют их — см. load_catalog) и ещё раз после коммита:
+    иначе параллельный апдейт мог успеть закэшировать состояние БД до коммита.
+    """
+    _drop()
+    conn.after_commit(_drop)
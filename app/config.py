@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import re
 from dataclasses import dataclass
 from os import getenv
 
@@ -11,6 +12,23 @@ class Config:
     bot_token: str
     admin_ids: set[int]
     withdraw_review_chat_id: int | None
+    db_path: str = "bot.sqlite3"
+    db_readers: int = 4
+    # "polling" или "webhook"
+    bot_mode: str = "polling"
+    # Публичный адрес (https://bot.example.com); пусто — вебхук не регистрируется
+    # (задан снаружи или локальная отладка POST-запросами)
+    webhook_url: str = ""
+    webhook_path: str = "/webhook"
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_secret: str = ""
+    # max_connections для Telegram (не больше 100)
+    webhook_max_connections: int = 40
+    # Апдейтов разных пользователей в обработке одновременно
+    update_concurrency: int = 32
+    # Принятых, но не обработанных апдейтов; дальше приём ждёт
+    update_queue_size: int = 1000
 
 
 def load_config() -> Config:
@@ -30,10 +48,41 @@ def load_config() -> Config:
     withdraw_chat_raw = getenv("WITHDRAW_REVIEW_CHAT_ID", "").strip()
     withdraw_review_chat_id = int(withdraw_chat_raw) if withdraw_chat_raw else None
 
+    db_path = getenv("DB_PATH", "").strip() or "bot.sqlite3"
+    db_readers_raw = getenv("DB_READERS", "").strip()
+    db_readers = max(1, int(db_readers_raw)) if db_readers_raw else 4
+
+    bot_mode = (getenv("BOT_MODE", "").strip() or "polling").lower()
+    if bot_mode not in ("polling", "webhook"):
+        raise RuntimeError("BOT_MODE must be 'polling' or 'webhook'.")
+    webhook_path = getenv("WEBHOOK_PATH", "").strip() or "/webhook"
+    if not webhook_path.startswith("/"):
+        webhook_path = "/" + webhook_path
+    webhook_port_raw = getenv("WEBHOOK_PORT", "").strip()
+    webhook_secret = getenv("WEBHOOK_SECRET", "").strip()
+    if bot_mode == "webhook" and not webhook_secret:
+        raise RuntimeError("WEBHOOK_SECRET is required when BOT_MODE=webhook.")
+    if webhook_secret and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", webhook_secret):
+        raise RuntimeError("WEBHOOK_SECRET may contain only A-Z, a-z, 0-9, _ and - (up to 256 chars).")
+    webhook_connections_raw = getenv("WEBHOOK_MAX_CONNECTIONS", "").strip()
+    update_concurrency_raw = getenv("UPDATE_CONCURRENCY", "").strip()
+    update_queue_raw = getenv("UPDATE_QUEUE_SIZE", "").strip()
+
     return Config(
         bot_token=bot_token,
         admin_ids=admin_ids,
         withdraw_review_chat_id=withdraw_review_chat_id,
+        db_path=db_path,
+        db_readers=db_readers,
+        bot_mode=bot_mode,
+        webhook_url=getenv("WEBHOOK_URL", "").strip(),
+        webhook_path=webhook_path,
+        webhook_host=getenv("WEBHOOK_HOST", "").strip() or "0.0.0.0",
+        webhook_port=int(webhook_port_raw) if webhook_port_raw else 8080,
+        webhook_secret=webhook_secret,
+        webhook_max_connections=min(100, max(1, int(webhook_connections_raw))) if webhook_connections_raw else 40,
+        update_concurrency=max(1, int(update_concurrency_raw)) if update_concurrency_raw else 32,
+        update_queue_size=max(1, int(update_queue_raw)) if update_queue_raw else 1000,
     )
 
 
@@ -1,5 +1,12 @@
 from __future__ import annotations
 
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, Hashable, Iterable, Sequence
+
 import aiosqlite
 
 
@@ -12,7 +19,302 @@ async def connect(db_path: str) -> aiosqlite.Connection:
     return conn
 
 
-async def init_db(conn: aiosqlite.Connection) -> None:
+async def connect_reader(db_path: str) -> aiosqlite.Connection:
+    """
+    Read-only подключение к той же БД. В режиме WAL читатели не блокируются
+    писателем и видят последнее закоммиченное состояние.
+    """
+    uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+    conn = await aiosqlite.connect(uri, uri=True)
+    await conn.execute("PRAGMA query_only = ON;")
+    conn.row_factory = aiosqlite.Row
+    return conn
+
+
+# (sql, params, executemany?)
+_Op = tuple[str, Any, bool]
+
+
+class UnitOfWork:
+    """
+    Отложенные записи одного апдейта (или любой другой единицы работы).
+
+    Мутаторы ``repo`` внутри ``Database.unit_of_work()`` не коммитят сами,
+    а складывают statements сюда; при выходе из контекста всё применяется
+    одной транзакцией. ``staged`` — последние записанные значения по ключу
+    (например, ui_state пользователя), чтобы чтение «своей» записи не
+    требовало сброса в БД. ``after_commit`` — колбэки, которые нужно вызвать
+    только после того, как записи реально закоммичены (сброс кэшей).
+
+    Чтения не коммитят отложенные записи (см. ``Database.reader``). Раньше
+    конца единицы работы коммит случается только в ``transaction()`` /
+    ``write_returning`` и при явном ``flush()`` (user_lock, start_broadcast):
+    исключение после такого коммита оставляет уже закоммиченную часть,
+    откатываются лишь записи после него.
+    """
+
+    def __init__(self, db: Database) -> None:
+        self._db = db
+        self._ops: list[_Op] = []
+        self._after_commit: list[Callable[[], None]] = []
+        self.staged: dict[Hashable, Any] = {}
+        # открыта Database.transaction(): записи выполняются сразу, без коммита
+        self.in_transaction = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._ops)
+
+    def add(self, sql: str, params: Sequence[Any] = ()) -> None:
+        self._ops.append((sql, params, False))
+
+    def add_many(self, sql: str, seq_of_params: Iterable[Sequence[Any]]) -> None:
+        self._ops.append((sql, list(seq_of_params), True))
+
+    async def flush(self) -> None:
+        # внутри transaction() коммит — при её закрытии
+        if not self._ops or self.in_transaction:
+            return
+        ops, self._ops = self._ops, []
+        callbacks, self._after_commit = self._after_commit, []
+        await self._db._apply(ops)
+        for cb in callbacks:
+            cb()
+
+    def discard(self) -> None:
+        self._ops.clear()
+        self._after_commit.clear()
+        self.staged.clear()
+
+
+# staged(): ключ не помещён в текущую единицу работы
+MISSING: Any = object()
+
+_current_uow: ContextVar[UnitOfWork | None] = ContextVar("current_uow", default=None)
+
+_background_tasks: set[asyncio.Task[Any]] = set()
+
+
+def spawn_detached(coro: Coroutine[Any, Any, Any]) -> asyncio.Task[Any]:
+    """
+    Запускает фоновую задачу с чистым контекстом: она не наследует единицу
+    работы апдейта (та к моменту записи задачи может быть уже закоммичена),
+    её записи коммитятся сами. Ссылка на задачу держится до её завершения.
+    """
+    task = asyncio.create_task(coro, context=contextvars.Context())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+class Database:
+    """
+    Менеджер подключений к SQLite: один писатель + пул read-only читателей.
+
+    Все изменения идут через единственное подключение-писатель под
+    ``_write_lock`` (``write``/``unit_of_work``), а чтения из ``repo``
+    берут свободного читателя через ``reader()``, поэтому не ждут в очереди
+    за записями фоновых задач (напоминания, рассылка).
+    """
+
+    def __init__(self, path: str, writer: aiosqlite.Connection, readers: list[aiosqlite.Connection]) -> None:
+        self.path = path
+        self.writer = writer
+        self._write_lock = asyncio.Lock()
+        self._readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._all_readers = list(readers)
+        for r in readers:
+            self._readers.put_nowait(r)
+
+    @classmethod
+    async def open(cls, path: str, *, readers: int = 4) -> Database:
+        # писатель создаёт файл БД и включает WAL до открытия read-only подключений
+        writer = await connect(path)
+        pool = [await connect_reader(path) for _ in range(max(1, readers))]
+        return cls(path, writer, pool)
+
+    # Прямой доступ к писателю — только для init_db / миграций до старта бота.
+    def execute(self, sql: str, parameters: Iterable[Any] | None = None):
+        return self.writer.execute(sql, parameters)
+
+    def executescript(self, sql_script: str):
+        return self.writer.executescript(sql_script)
+
+    async def commit(self) -> None:
+        await self.writer.commit()
+
+    async def _execute(self, ops: list[_Op]) -> None:
+        # вызывается под _write_lock; коммит/откат — на вызывающем
+        for sql, params, many in ops:
+            if many:
+                await self.writer.executemany(sql, params)
+            else:
+                await self.writer.execute(sql, params)
+
+    async def _apply(self, ops: list[_Op]) -> None:
+        async with self._write_lock:
+            try:
+                await self._execute(ops)
+                await self.writer.commit()
+            except BaseException:
+                await self.writer.rollback()
+                raise
+
+    @property
+    def current_uow(self) -> UnitOfWork | None:
+        uow = _current_uow.get()
+        return uow if uow is not None and uow._db is self else None
+
+    async def write(self, sql: str, params: Sequence[Any] = ()) -> None:
+        """
+        Выполняет изменяющий statement. Внутри unit_of_work() запись
+        откладывается до общего коммита, иначе коммитится сразу.
+        """
+        uow = self.current_uow
+        if uow is not None and uow.in_transaction:
+            await self.writer.execute(sql, params)
+            return
+        if uow is not None:
+            uow.add(sql, params)
+            return
+        await self._apply([(sql, params, False)])
+
+    async def write_many(self, sql: str, seq_of_params: Iterable[Sequence[Any]]) -> None:
+        """write() для пачки параметров одним executemany."""
+        uow = self.current_uow
+        if uow is not None and uow.in_transaction:
+            await self.writer.executemany(sql, seq_of_params)
+            return
+        if uow is not None:
+            uow.add_many(sql, seq_of_params)
+            return
+        await self._apply([(sql, list(seq_of_params), True)])
+
+    async def write_returning(self, sql: str, params: Sequence[Any] = ()) -> aiosqlite.Row | None:
+        """
+        Выполняет statement с RETURNING (нужен результат — id вставки,
+        новое значение счётчика). Внутри transaction() — в её транзакции,
+        иначе коммитится сразу одной транзакцией вместе с отложенными
+        записями текущей единицы работы.
+        """
+        async with self.transaction():
+            cur = await self.writer.execute(sql, params)
+            rows = await cur.fetchall()
+        return rows[0] if rows else None
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        """
+        Явная транзакция на писателе: отложенные записи единицы работы и всё,
+        что записано внутри (write, write_returning), коммитятся одним
+        коммитом при выходе; при исключении откатывается всё вместе.
+        Чтения внутри идут через писателя и видят незакоммиченное. Писатель
+        занят до выхода — внутри только работа с БД, без запросов в Telegram.
+        """
+        async with self.unit_of_work() as uow:
+            if uow.in_transaction:
+                yield
+                return
+            async with self._write_lock:
+                ops, uow._ops = uow._ops, []
+                uow.in_transaction = True
+                try:
+                    await self._execute(ops)
+                    yield
+                    await self.writer.commit()
+                except BaseException:
+                    await self.writer.rollback()
+                    raise
+                finally:
+                    uow.in_transaction = False
+            callbacks, uow._after_commit = uow._after_commit, []
+            for cb in callbacks:
+                cb()
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """
+        Вызывает callback после коммита уже сделанных записей: внутри
+        unit_of_work() — при его сбросе, иначе сразу (write() уже закоммитил).
+        """
+        uow = self.current_uow
+        if uow is not None and (uow.pending or uow.in_transaction):
+            uow._after_commit.append(callback)
+            return
+        callback()
+
+    @asynccontextmanager
+    async def unit_of_work(self) -> AsyncIterator[UnitOfWork]:
+        """
+        Открывает (или присоединяется к уже открытой) единицу работы:
+        все записи внутри коммитятся один раз при выходе. При исключении
+        несброшенные записи отбрасываются.
+        """
+        outer = self.current_uow
+        if outer is not None:
+            yield outer
+            return
+        uow = UnitOfWork(self)
+        token = _current_uow.set(uow)
+        try:
+            yield uow
+        except BaseException:
+            uow.discard()
+            raise
+        else:
+            await uow.flush()
+        finally:
+            _current_uow.reset(token)
+
+    def staged(self, key: Hashable) -> Any:
+        uow = self.current_uow
+        return uow.staged.get(key, MISSING) if uow is not None else MISSING
+
+    def stage(self, key: Hashable, value: Any) -> None:
+        uow = self.current_uow
+        if uow is not None:
+            uow.staged[key] = value
+
+    @asynccontextmanager
+    async def reader(self, *, own_writes: bool = True) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Берёт читателя из пула. Если в текущей единице работы есть отложенные
+        записи, чтение идёт на писателе: записи выполняются в транзакции без
+        коммита, чтение видит их, затем транзакция откатывается, а записи
+        остаются отложенными до общего коммита (read-your-writes без
+        промежуточного коммита). own_writes=False — для чтений, которые
+        заведомо не зависят от отложенных записей.
+        """
+        uow = self.current_uow
+        if uow is not None and uow.in_transaction:
+            # писатель уже наш (transaction() держит _write_lock)
+            yield self.writer
+            return
+        if own_writes and uow is not None and uow.pending:
+            async with self._write_lock:
+                try:
+                    await self._execute(uow._ops)
+                    yield self.writer
+                finally:
+                    await self.writer.rollback()
+            return
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def close(self) -> None:
+        for r in self._all_readers:
+            await r.close()
+        await self.writer.close()
+
+
+# ---------- Schema migrations ----------
+# Каждый шаг идемпотентен и применяется один раз; номер последнего
+# применённого шага хранится в PRAGMA user_version.
+
+
+async def _m0001_base_schema(conn: aiosqlite.Connection) -> None:
     # Users + single-message UI state
     await conn.executescript(
         """
@@ -144,7 +446,7 @@ async def init_db(conn: aiosqlite.Connection) -> None:
         """
     )
 
-    # Soft-migrations for existing DBs
+    # Soft-migrations for DBs created before the migration engine
     cur = await conn.execute("PRAGMA table_info(users)")
     cols = {row["name"] for row in await cur.fetchall()}
     if "start_message_id" not in cols:
@@ -176,6 +478,176 @@ async def init_db(conn: aiosqlite.Connection) -> None:
     await conn.execute(
         "INSERT OR IGNORE INTO settings(key, value) VALUES('stars_price_per_attempt', '1');"
     )
-    await conn.commit()
+
+
+async def _m0002_hot_path_indexes(conn: aiosqlite.Connection) -> None:
+    await conn.executescript(
+        """
+        -- list_inventory / has-gifts checks: WHERE user_id=? ORDER BY id
+        CREATE INDEX IF NOT EXISTS idx_inventory_user ON inventory(user_id);
+        -- FK RESTRICT check при удалении подарка
+        CREATE INDEX IF NOT EXISTS idx_inventory_gift ON inventory(gift_id);
+        -- get_due_reminders: next_reminder_ts IS NOT NULL AND next_reminder_ts <= ?
+        CREATE INDEX IF NOT EXISTS idx_user_reminders_next
+          ON user_reminders(next_reminder_ts) WHERE next_reminder_ts IS NOT NULL;
+        -- очередь заявок на вывод по статусу
+        CREATE INDEX IF NOT EXISTS idx_withdraw_requests_status ON withdraw_requests(status);
+        -- list_users: ORDER BY created_at DESC
+        CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at);
+        """
+    )
+
+
+async def _m0003_sponsor_verification(conn: aiosqlite.Connection) -> None:
+    # Последняя успешная проверка подписки на старт-спонсоров: до какого
+    # времени ей доверяем и для какой версии набора каналов она сделана
+    cur = await conn.execute("PRAGMA table_info(users)")
+    cols = {row["name"] for row in await cur.fetchall()}
+    if "sponsors_verified_until" not in cols:
+        await conn.execute("ALTER TABLE users ADD COLUMN sponsors_verified_until INTEGER;")
+    if "sponsors_verified_version" not in cols:
+        await conn.execute("ALTER TABLE users ADD COLUMN sponsors_verified_version INTEGER;")
+
+
+async def _m0004_channel_membership(conn: aiosqlite.Connection) -> None:
+    # Статус участника канала-спонсора из chat_member апдейтов (и первичных
+    # опросов get_chat_member) — для каналов, где бот админ
+    await conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS channel_membership (
+          user_id  INTEGER NOT NULL,
+          chat_id  INTEGER NOT NULL,
+          status   TEXT NOT NULL,
+          ts       INTEGER NOT NULL,
+          PRIMARY KEY(user_id, chat_id)
+        ) WITHOUT ROWID;
+        """
+    )
+
+
+async def _m0005_broadcasts(conn: aiosqlite.Connection) -> None:
+    # Рассылки как задания: курсор по user_id переживает перезапуск,
+    # broadcast_deliveries не даёт отправить одному пользователю дважды
+    await conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+          id                   INTEGER PRIMARY KEY AUTOINCREMENT,
+          admin_id             INTEGER NOT NULL,
+          chat_id              INTEGER NOT NULL,
+          progress_message_id  INTEGER,
+          text                 TEXT NOT NULL,
+          status               TEXT NOT NULL DEFAULT 'running', -- running / done / cancelled
+          cursor_user_id       INTEGER NOT NULL DEFAULT 0,      -- все user_id <= курсора обработаны
+          total                INTEGER NOT NULL DEFAULT 0,
+          sent                 INTEGER NOT NULL DEFAULT 0,
+          failed               INTEGER NOT NULL DEFAULT 0,
+          created_at           INTEGER NOT NULL,
+          finished_at          INTEGER
+        );
+
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+          broadcast_id  INTEGER NOT NULL,
+          user_id       INTEGER NOT NULL,
+          status        TEXT NOT NULL, -- sent / failed
+          error         TEXT,
+          ts            INTEGER NOT NULL,
+          PRIMARY KEY(broadcast_id, user_id),
+          FOREIGN KEY(broadcast_id) REFERENCES broadcasts(id) ON DELETE CASCADE
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status);
+        """
+    )
+
+
+async def _m0006_user_reachability(conn: aiosqlite.Connection) -> None:
+    # 0 — бот заблокирован / чат не найден: не шлём напоминания и рассылки,
+    # пока пользователь сам не напишет боту
+    cur = await conn.execute("PRAGMA table_info(users)")
+    cols = {row["name"] for row in await cur.fetchall()}
+    if "is_reachable" not in cols:
+        await conn.execute("ALTER TABLE users ADD COLUMN is_reachable INTEGER NOT NULL DEFAULT 1;")
+
+
+async def _m0007_ui_state_blob(conn: aiosqlite.Connection) -> None:
+    # Бинарное состояние экрана (доска игры, см. game_state) вместо JSON
+    cur = await conn.execute("PRAGMA table_info(ui_state)")
+    cols = {row["name"] for row in await cur.fetchall()}
+    if "payload_blob" not in cols:
+        await conn.execute("ALTER TABLE ui_state ADD COLUMN payload_blob BLOB;")
+
+
+async def _m0008_game_sessions(conn: aiosqlite.Connection) -> None:
+    # Игры отдельно от навигации: переходы по меню пишут только ui_state,
+    # ход в игре — только свою сессию. Завершённые сессии переносит в архив
+    # фоновый компактор (game_sessions.run_game_sessions_compactor)
+    await conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS game_sessions (
+          id           INTEGER PRIMARY KEY AUTOINCREMENT,
+          user_id      INTEGER NOT NULL,
+          state        BLOB NOT NULL,   -- game_state.encode()
+          created_at   INTEGER NOT NULL,
+          finished_at  INTEGER,         -- NULL — игра идёт
+          FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_game_sessions_user_finished ON game_sessions(user_id, finished_at);
+        CREATE INDEX IF NOT EXISTS idx_game_sessions_finished ON game_sessions(finished_at);
+
+        CREATE TABLE IF NOT EXISTS game_sessions_archive (
+          id           INTEGER PRIMARY KEY,
+          user_id      INTEGER NOT NULL,
+          state        BLOB NOT NULL,
+          created_at   INTEGER NOT NULL,
+          finished_at  INTEGER NOT NULL
+        );
+        """
+    )
+
+
+async def _m0009_ui_render_hash(conn: aiosqlite.Connection) -> None:
+    # Хэш последнего отрисованного текста+клавиатуры: одинаковую правку
+    # edit_or_recreate не отправляет в Telegram
+    cur = await conn.execute("PRAGMA table_info(ui_state)")
+    cols = {row["name"] for row in await cur.fetchall()}
+    if "render_hash" not in cols:
+        await conn.execute("ALTER TABLE ui_state ADD COLUMN render_hash INTEGER;")
+
+
+MIGRATIONS: list[Callable[[aiosqlite.Connection], Awaitable[None]]] = [
+    _m0001_base_schema,
+    _m0002_hot_path_indexes,
+    _m0003_sponsor_verification,
+    _m0004_channel_membership,
+    _m0005_broadcasts,
+    _m0006_user_reachability,
+    _m0007_ui_state_blob,
+    _m0008_game_sessions,
+    _m0009_ui_render_hash,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def get_schema_version(conn: Database) -> int:
+    cur = await conn.execute("PRAGMA user_version;")
+    row = await cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+async def init_db(conn: Database) -> None:
+    """
+    Доводит схему до SCHEMA_VERSION. Если БД уже актуальна, DDL не выполняется
+    вовсе — только чтение PRAGMA user_version.
+    """
+    version = await get_schema_version(conn)
+    for number, step in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        await step(conn.writer)
+        # PRAGMA не принимает параметры; number — наш собственный int
+        await conn.execute(f"PRAGMA user_version = {number};")
+        await conn.commit()
 
 
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from .db import Database
+from .game_state import GameState, decode, encode, from_ui_state
+from .repo import (
+    archive_game_sessions,
+    create_game_session,
+    get_last_game_session,
+    get_ui_state,
+    save_game_session,
+)
+from .timeutil import now_ts
+
+log = logging.getLogger(__name__)
+
+# Завершённые игры старше этого срока уходят в архив (сек)
+GAME_SESSION_ARCHIVE_AFTER = 24 * 60 * 60
+# Как часто запускать компактор (сек)
+GAME_SESSION_COMPACT_INTERVAL = 10 * 60
+# Сессий за одну транзакцию: писатель не занимается надолго
+GAME_SESSION_COMPACT_BATCH = 1000
+
+
+async def load_game(conn: Database, user_id: int) -> tuple[int | None, GameState | None]:
+    """
+    (session_id, доска) последней игры пользователя; доска None — играть
+    нечего (игр не было или они уже в архиве).
+    """
+    row = await get_last_game_session(conn, user_id)
+    if row is None:
+        # доска, начатая до появления game_sessions, лежит в ui_state
+        return None, from_ui_state(await get_ui_state(conn, user_id))
+    try:
+        state = decode(row["state"])
+    except ValueError:
+        log.warning("Corrupted game session %s", row["id"])
+        return int(row["id"]), None
+    state.finished = state.finished or row["finished_at"] is not None
+    return int(row["id"]), state
+
+
+async def start_game(conn: Database, user_id: int, state: GameState) -> int:
+    return await create_game_session(conn, user_id, encode(state), finished=state.finished)
+
+
+async def save_game(conn: Database, user_id: int, session_id: int | None, state: GameState) -> int:
+    """Сохраняет ход; доску из ui_state (session_id None) переносит в новую сессию."""
+    if session_id is None:
+        return await start_game(conn, user_id, state)
+    await save_game_session(conn, session_id, encode(state), finished=state.finished)
+    return session_id
+
+
+async def compact_game_sessions(conn: Database) -> int:
+    """Переносит старые завершённые игры в game_sessions_archive пачками."""
+    before = now_ts() - GAME_SESSION_ARCHIVE_AFTER
+    total = 0
+    while True:
+        moved = await archive_game_sessions(conn, before, GAME_SESSION_COMPACT_BATCH)
+        total += moved
+        if moved < GAME_SESSION_COMPACT_BATCH:
+            return total
+        # между пачками отдаём писателя апдейтам
+        await asyncio.sleep(0)
+
+
+async def run_game_sessions_compactor(conn: Database) -> None:
+    """Фоновая задача: держит game_sessions маленькой (только идущие и свежие игры)."""
+    while True:
+        try:
+            moved = await compact_game_sessions(conn)
+            if moved:
+                log.info("Archived %s finished game sessions", moved)
+        except Exception:
+            log.exception("Game sessions compaction failed")
+        await asyncio.sleep(GAME_SESSION_COMPACT_INTERVAL)
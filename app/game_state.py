@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import json
+import struct
+from dataclasses import dataclass, field
+from typing import Any
+
+GRID_SIZE = 6
+CELL_COUNT = GRID_SIZE * GRID_SIZE
+
+# Версия бинарного формата; decode() отвергает незнакомые версии
+GAME_STATE_VERSION = 1
+
+# version, flags, маска открытых клеток, размер таблицы подарков, число выигрышей
+_HEADER = struct.Struct("<BBQBB")
+_FLAG_FINISHED = 0x01
+
+
+@dataclass
+class GameState:
+    """
+    Состояние доски. Названия и эмодзи подарков не хранятся — при отрисовке
+    они берутся из каталога по gift_id.
+
+    ``slots[i]`` — 0 (пустая клетка) или k: в клетке подарок ``gift_ids[k - 1]``.
+    """
+
+    opened: int = 0
+    slots: bytes = bytes(CELL_COUNT)
+    gift_ids: tuple[int, ...] = ()
+    pending_wins: list[int] = field(default_factory=list)
+    finished: bool = False
+
+    @classmethod
+    def new(cls, cell_gifts: list[int | None]) -> GameState:
+        """Доска из gift_id по клеткам (None — пусто)."""
+        table: dict[int, int] = {}
+        slots = bytearray(CELL_COUNT)
+        for i, gift_id in enumerate(cell_gifts):
+            if gift_id is not None:
+                slots[i] = table.setdefault(int(gift_id), len(table) + 1)
+        return cls(slots=bytes(slots), gift_ids=tuple(table))
+
+    def is_open(self, idx: int) -> bool:
+        return bool(self.opened >> idx & 1)
+
+    def open(self, idx: int) -> None:
+        self.opened |= 1 << idx
+
+    def gift_at(self, idx: int) -> int | None:
+        k = self.slots[idx]
+        return self.gift_ids[k - 1] if k else None
+
+    def reveal_gifts(self) -> None:
+        """Открывает все клетки с подарками."""
+        for i, k in enumerate(self.slots):
+            if k:
+                self.opened |= 1 << i
+
+
+def encode(state: GameState) -> bytes:
+    flags = _FLAG_FINISHED if state.finished else 0
+    n_gifts = len(state.gift_ids)
+    n_pending = len(state.pending_wins)
+    return b"".join(
+        (
+            _HEADER.pack(GAME_STATE_VERSION, flags, state.opened, n_gifts, n_pending),
+            struct.pack(f"<{n_gifts}I", *state.gift_ids),
+            state.slots,
+            struct.pack(f"<{n_pending}I", *state.pending_wins),
+        )
+    )
+
+
+def decode(data: bytes) -> GameState:
+    """Обратное к encode(); ValueError — повреждённые данные или чужая версия."""
+    try:
+        version, flags, opened, n_gifts, n_pending = _HEADER.unpack_from(data)
+        if version != GAME_STATE_VERSION:
+            raise ValueError(f"unsupported game state version {version}")
+        pos = _HEADER.size
+        gift_ids = struct.unpack_from(f"<{n_gifts}I", data, pos)
+        pos += 4 * n_gifts
+        slots = bytes(data[pos:pos + CELL_COUNT])
+        pos += CELL_COUNT
+        pending = struct.unpack_from(f"<{n_pending}I", data, pos)
+        pos += 4 * n_pending
+    except struct.error as e:
+        raise ValueError(str(e)) from e
+    if len(slots) != CELL_COUNT or pos != len(data) or max(slots) > n_gifts:
+        raise ValueError("malformed game state")
+    return GameState(
+        opened=opened & ((1 << CELL_COUNT) - 1),
+        slots=slots,
+        gift_ids=gift_ids,
+        pending_wins=list(pending),
+        finished=bool(flags & _FLAG_FINISHED),
+    )
+
+
+def from_legacy_json(payload_json: str) -> GameState:
+    """
+    Доска в старом JSON-формате ({"cells", "cell_gifts", "pending_wins",
+    "finished"}) — чтобы игры, начатые до обновления, не сбрасывались.
+    """
+    payload: dict[str, Any] = json.loads(payload_json)
+    cells = payload["cells"]
+    cell_gifts = payload["cell_gifts"]
+    if len(cells) != CELL_COUNT or len(cell_gifts) != CELL_COUNT:
+        raise ValueError("malformed legacy game payload")
+    state = GameState.new([int(g["gift_id"]) if g else None for g in cell_gifts])
+    for i, opened in enumerate(cells):
+        if opened == 1:
+            state.open(i)
+    state.pending_wins = [int(w["gift_id"]) for w in payload["pending_wins"]]
+    state.finished = bool(payload.get("finished", False))
+    return state
+
+
+def from_ui_state(state: dict[str, Any] | None) -> GameState | None:
+    """Доска из строки ui_state (payload_blob или старый JSON); None — доски нет."""
+    if not state:
+        return None
+    try:
+        if state.get("payload_blob"):
+            return decode(state["payload_blob"])
+        if state.get("payload_json"):
+            return from_legacy_json(state["payload_json"])
+    except (ValueError, KeyError, TypeError):
+        pass
+    return None
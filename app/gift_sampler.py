@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import random
+from itertools import accumulate
+from typing import Mapping, Sequence
+
+from .catalog import Catalog
+from .game_state import CELL_COUNT
+
+
+class GiftSampler:
+    """
+    Взвешенный выбор подарка по drop_chance: накопленные веса считаются один
+    раз на версию каталога, выбор — bisect внутри random.choices (O(log n)),
+    а не пересборка весов и линейный проход на каждую клетку.
+    """
+
+    def __init__(self, gifts: Sequence[Mapping]) -> None:
+        self.gift_ids = [int(g["id"]) for g in gifts]
+        self.cum_weights = list(accumulate(max(0.0, float(g["drop_chance"])) for g in gifts))
+        # все веса нулевые — выбираем равновероятно, как раньше
+        self._uniform = not self.cum_weights or self.cum_weights[-1] <= 0
+
+    def __bool__(self) -> bool:
+        return bool(self.gift_ids)
+
+    def sample(self, k: int) -> list[int]:
+        """k независимых gift_id."""
+        if self._uniform:
+            return random.choices(self.gift_ids, k=k)
+        return random.choices(self.gift_ids, cum_weights=self.cum_weights, k=k)
+
+    def board(self, cell_chance: float) -> list[int | None]:
+        """Подарки по клеткам доски: в каждой с вероятностью cell_chance, иначе None."""
+        if not self.gift_ids:
+            return [None] * CELL_COUNT
+        rnd = random.random
+        hits = [i for i in range(CELL_COUNT) if rnd() < cell_chance]
+        cells: list[int | None] = [None] * CELL_COUNT
+        for i, gift_id in zip(hits, self.sample(len(hits))):
+            cells[i] = gift_id
+        return cells
+
+
+_sampler: GiftSampler | None = None
+_sampler_version: int | None = None
+
+
+def get_gift_sampler(catalog: Catalog) -> GiftSampler:
+    """Сэмплер для текущего снимка каталога; пересобирается при смене его версии."""
+    global _sampler, _sampler_version
+    if _sampler is None or _sampler_version != catalog.version:
+        _sampler = GiftSampler(catalog.gifts)
+        _sampler_version = catalog.version
+    return _sampler
+
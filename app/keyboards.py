@@ -1,9 +1,21 @@
 from __future__ import annotations
 
+from functools import cache, lru_cache
+
+import aiosqlite
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from .catalog import Catalog, sponsor_type
+
+# Статические клавиатуры строятся один раз (@cache) и переиспользуются всеми
+# апдейтами; клавиатуры спонсоров — один раз на версию каталога. Модели
+# aiogram изменяемы, а экземпляр общий: не правьте возвращённую разметку на
+# месте — нужна другая, соберите новую. Ряды — обычные списки: aiogram
+# вычищает None-поля кнопок только внутри list/dict.
 
+
+@cache
 def kb_start() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.button(text="🎁 Выбрать подарок", callback_data="start:choose_gift")
@@ -11,12 +23,14 @@ def kb_start() -> InlineKeyboardMarkup:
     return b.as_markup()
 
 
+@cache
 def kb_back_to_menu() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.button(text="⟵ Меню", callback_data="menu:home")
     return b.as_markup()
 
 
+@cache
 def kb_menu() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.button(text="🎮 Играть", callback_data="menu:play")
@@ -28,6 +42,7 @@ def kb_menu() -> InlineKeyboardMarkup:
     return b.as_markup()
 
 
+@cache
 def kb_check_subscriptions() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.button(text="✅ Я подписался(лась)", callback_data="start:check_subs")
@@ -66,6 +81,7 @@ def kb_task_sponsors_list(rows: list[dict]) -> InlineKeyboardMarkup:
     return b.as_markup()
 
 
+@cache
 def kb_game_controls(can_take: bool) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     if can_take:
@@ -75,22 +91,38 @@ def kb_game_controls(can_take: bool) -> InlineKeyboardMarkup:
     return b.as_markup()
 
 
+@lru_cache(maxsize=4096)
+def _game_cell_button(i: int, text: str) -> InlineKeyboardButton:
+    cb = f"game:cell:{i}" if text == "⬜" else "game:noop"
+    return InlineKeyboardButton(text=text, callback_data=cb)
+
+
+@lru_cache(maxsize=4096)
+def _game_board_row(r: int, symbols: tuple[str, ...]) -> tuple[InlineKeyboardButton, ...]:
+    return tuple(_game_cell_button(r * 6 + c, text) for c, text in enumerate(symbols))
+
+
+def _game_board_rows(symbols: list[str]) -> list[list[InlineKeyboardButton]]:
+    return [list(_game_board_row(r, tuple(symbols[r * 6:r * 6 + 6]))) for r in range(6)]
+
+
 def kb_game_board(symbols: list[str]) -> InlineKeyboardMarkup:
     """
-    symbols: тексты для 36 клеток (6×6).
+    symbols: тексты для 36 клеток (6×6). Ряды кнопок берутся из кэша, а
+    разметка собирается без валидации (model_construct) — на клик не
+    создаётся ни одной модели кнопки.
     """
-    b = InlineKeyboardBuilder()
-    for r in range(6):
-        row_buttons = []
-        for c in range(6):
-            i = r * 6 + c
-            text = symbols[i]
-            cb = f"game:cell:{i}" if text == "⬜" else "game:noop"
-            row_buttons.append(InlineKeyboardButton(text=text, callback_data=cb))
-        b.row(*row_buttons)
-    return b.as_markup()
+    return InlineKeyboardMarkup.model_construct(inline_keyboard=_game_board_rows(symbols))
+
 
+def kb_game_screen(symbols: list[str], can_take: bool) -> InlineKeyboardMarkup:
+    """Доска и кнопки управления одной клавиатурой."""
+    return InlineKeyboardMarkup.model_construct(
+        inline_keyboard=_game_board_rows(symbols) + kb_game_controls(can_take).inline_keyboard
+    )
 
+
+@cache
 def kb_admin_menu() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     # Спонсоры
@@ -109,12 +141,14 @@ def kb_admin_menu() -> InlineKeyboardMarkup:
     return b.as_markup()
 
 
+@cache
 def kb_admin_back() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.button(text="⟵ Админ-меню", callback_data="admin:menu")
     return b.as_markup()
 
 
+@cache
 def kb_profile_menu() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.button(text="🎁 Инвентарь", callback_data="profile:inventory")
@@ -124,4 +158,60 @@ def kb_profile_menu() -> InlineKeyboardMarkup:
     return b.as_markup()
 
 
+# ---- Спонсоры: клавиатуры на версию каталога ----
+
+
+def sponsor_link(row: aiosqlite.Row) -> str | None:
+    if row["invite_link"]:
+        return str(row["invite_link"])
+    if row["channel_username"]:
+        u = str(row["channel_username"]).lstrip("@")
+        return f"https://t.me/{u}"
+    return None
+
+
+def sponsor_rows(sponsors: tuple[aiosqlite.Row, ...]) -> list[dict]:
+    """
+    Спонсоры для показа: каналы, боты и сайты; если нет ни одного канала —
+    боты/сайты не показываются вовсе.
+    """
+    has_channels = any(
+        sponsor_type(s) == "channel" and int(s["channel_id"]) != 0 for s in sponsors
+    )
+    return [
+        {"title": str(s["title"]), "link": sponsor_link(s) or ""}
+        for s in sponsors
+        if has_channels or sponsor_type(s) not in ("bot", "link")
+    ]
+
+
+_sponsor_kb_cache: dict[str, tuple[int, InlineKeyboardMarkup]] = {}
+
+
+def _per_catalog(key: str, catalog: Catalog, build) -> InlineKeyboardMarkup:
+    cached = _sponsor_kb_cache.get(key)
+    if cached is not None and cached[0] == catalog.version:
+        return cached[1]
+    markup = build()
+    _sponsor_kb_cache[key] = (catalog.version, markup)
+    return markup
+
+
+def kb_start_sponsors(catalog: Catalog) -> InlineKeyboardMarkup:
+    """Экран подписки на старт-спонсоров (или только «Проверить», если ссылок нет)."""
+
+    def build() -> InlineKeyboardMarkup:
+        rows = [r for r in sponsor_rows(catalog.start_sponsors) if r["link"]]
+        return kb_sponsors_list(rows) if rows else kb_check_subscriptions()
+
+    return _per_catalog("start", catalog, build)
+
+
+def kb_task_sponsors(catalog: Catalog) -> InlineKeyboardMarkup:
+    """Экран «Задания» (или «Меню», если показывать нечего)."""
+
+    def build() -> InlineKeyboardMarkup:
+        rows = sponsor_rows(catalog.task_sponsors)
+        return kb_task_sponsors_list(rows) if rows else kb_back_to_menu()
 
+    return _per_catalog("tasks", catalog, build)
@@ -8,18 +8,28 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 
+from .broadcast import resume_broadcasts
+from .catalog import load_catalog
 from .config import load_config
-from .db import connect, init_db
+from .db import Database, init_db
+from .game_sessions import run_game_sessions_compactor
+from .middlewares.outbound_limit import OutboundLimitMiddleware
 from .middlewares.user_message_cleanup import UserMessageCleanupMiddleware
 from .middlewares.activity import ActivityMiddleware
 from .middlewares.sponsor_check import SponsorCheckMiddleware
 from .middlewares.subscription_check import SubscriptionCheckMiddleware
+from .middlewares.unit_of_work import UnitOfWorkMiddleware
+from .middlewares.user_context import UserContextMiddleware
+from .outbound import OutboundScheduler
 from .reminders import run_reminders_loop
 from .routers.admin import router as admin_router
 from .routers.game import router as game_router
 from .routers.menu import router as menu_router
 from .routers.start import router as start_router
 from .routers.profile import router as profile_router
+from .update_executor import UpdateExecutor, run_polling
+from .webhook import run_webhook
+from .write_behind import flush_write_behind, run_write_behind_loop
 
 
 async def _run() -> None:
@@ -34,16 +44,33 @@ async def _run() -> None:
         token=cfg.bot_token,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
+    # Все исходящие запросы проходят через общий лимитер (глобальный + по чатам,
+    # с приоритетом UI > напоминания > рассылка)
+    outbound = OutboundScheduler()
+    bot.session.middleware(OutboundLimitMiddleware(outbound))
 
-    conn = await connect("bot.sqlite3")
+    conn = await Database.open(cfg.db_path, readers=cfg.db_readers)
     await init_db(conn)
+    # Подарки/спонсоры/настройки держим в памяти; админка сбрасывает снимок
+    await load_catalog(conn)
 
     dp = Dispatcher(storage=MemoryStorage())
 
-    # Inject db connection as dependency
+    # Inject db (writer + reader pool) as dependency
     dp["conn"] = conn
     dp["config"] = cfg
+    dp["outbound"] = outbound
+    # Разные пользователи — параллельно, апдейты одного — строго по порядку
+    executor = UpdateExecutor(
+        dp, bot, concurrency=cfg.update_concurrency, queue_size=cfg.update_queue_size
+    )
+    dp["executor"] = executor
 
+    # Все записи в БД за один апдейт коммитятся одной транзакцией
+    dp.update.outer_middleware(UnitOfWorkMiddleware())
+    # Один запрос на апдейт: бан, попытки, ui_state и т.д. -> data["user_ctx"]
+    dp.message.outer_middleware(UserContextMiddleware())
+    dp.callback_query.outer_middleware(UserContextMiddleware())
     # Проверяем подписку на старт-спонсоры при любом взаимодействии (должен быть первым)
     dp.message.middleware(SponsorCheckMiddleware())
     dp.callback_query.middleware(SponsorCheckMiddleware())
@@ -61,9 +88,24 @@ async def _run() -> None:
 
     # Запускаем фоновый цикл напоминаний
     asyncio.create_task(run_reminders_loop(bot, conn))
-
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot, conn=conn, config=cfg)
+    # Активность и ui_state пишутся в БД пачками раз в пару секунд
+    write_behind = asyncio.create_task(run_write_behind_loop(conn))
+    # Завершённые игры переносятся в архив, game_sessions остаётся маленькой
+    asyncio.create_task(run_game_sessions_compactor(conn))
+    # Продолжаем рассылки, прерванные перезапуском
+    await resume_broadcasts(bot, conn)
+
+    try:
+        if cfg.bot_mode == "webhook":
+            await run_webhook(dp, bot, cfg, executor, conn=conn, config=cfg)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await run_polling(dp, bot, executor, conn=conn, config=cfg)
+    finally:
+        # дописываем отложенные записи до закрытия БД
+        write_behind.cancel()
+        await flush_write_behind(conn)
+        await conn.close()
 
 
 def main() -> None:
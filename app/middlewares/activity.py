@@ -2,11 +2,11 @@ from __future__ import annotations
 
 from typing import Any, Awaitable, Callable, Dict
 
-import aiosqlite
 from aiogram import BaseMiddleware
 
 from ..config import Config
-from ..repo import touch_user_activity
+from ..db import Database
+from ..repo import UserContext, set_user_reachable, touch_user_activity
 
 
 class ActivityMiddleware(BaseMiddleware):
@@ -22,15 +22,26 @@ class ActivityMiddleware(BaseMiddleware):
         event: Any,
         data: Dict[str, Any],
     ) -> Any:
-        conn: aiosqlite.Connection | None = data.get("conn")
+        conn: Database | None = data.get("conn")
         config: Config | None = data.get("config")
+        user_ctx: UserContext | None = data.get("user_ctx")
 
+        result = await handler(event, data)
+
+        # Пишем после хендлера: запись уходит в общий коммит апдейта и не
+        # заставляет чтения хендлера сбрасывать единицу работы раньше времени.
         from_user = getattr(event, "from_user", None)
+        # пользователя ещё нет в users — обновлять нечего
+        if user_ctx is not None and not user_ctx.exists:
+            return result
         if conn and from_user:
+            # написал сам — снова получает рассылки и напоминания
+            if user_ctx is not None and not user_ctx.is_reachable:
+                await set_user_reachable(conn, from_user.id)
             is_admin = bool(config and from_user.id in config.admin_ids)
             if not is_admin:
                 await touch_user_activity(conn, from_user.id)
 
-        return await handler(event, data)
+        return result
 
 
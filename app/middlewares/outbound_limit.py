@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from ..outbound import OutboundScheduler
+
+# Методы, на которые действуют лимиты Telegram на отправку сообщений
+_LIMITED_PREFIXES = ("Send", "Copy", "Forward", "Edit")
+
+
+class OutboundLimitMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: каждый отправляющий/редактирующий запрос сначала
+    получает разрешение у OutboundScheduler (глобальный лимит, лимит чата,
+    полоса приоритета из outbound.send_priority). На 429 чат «замораживается»
+    на retry_after, фоновые полосы — тоже (см. OutboundScheduler.penalize),
+    исключение пробрасывается вызывающему.
+    """
+
+    def __init__(self, scheduler: OutboundScheduler) -> None:
+        self.scheduler = scheduler
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not type(method).__name__.startswith(_LIMITED_PREFIXES):
+            return await make_request(bot, method)
+
+        chat_id = _chat_id(method)
+        await self.scheduler.acquire(chat_id)
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            self.scheduler.penalize(chat_id, e.retry_after)
+            raise
+
+
+def _chat_id(method: TelegramMethod[Any]) -> int | None:
+    chat_id = getattr(method, "chat_id", None)
+    # @username каналов и inline-сообщения считаем только по глобальному лимиту
+    return chat_id if isinstance(chat_id, int) else None
@@ -1,22 +1,54 @@
 from __future__ import annotations
 
+import logging
 from typing import Any, Awaitable, Callable, Dict
 
-import aiosqlite
 from aiogram import BaseMiddleware, Bot
 from aiogram.types import CallbackQuery, Message
 
+from ..catalog import get_catalog
 from ..config import Config
-from ..routers.start import ensure_start_sponsors_subscribed, sponsor_link
-from ..keyboards import kb_sponsors_list, kb_check_subscriptions
+from ..db import Database, spawn_detached
+from ..repo import UserContext, set_sponsors_verified
+from ..routers.start import SPONSORS_VERIFIED_TTL, ensure_start_sponsors_subscribed
+from ..keyboards import kb_start_sponsors
+from ..timeutil import now_ts
 from ..ui import edit_or_recreate
 
+log = logging.getLogger(__name__)
+
+# пользователи, для которых уже идёт фоновая перепроверка
+_reverify_inflight: set[int] = set()
+
+
+async def _reverify(bot: Bot, conn: Database, user_id: int) -> None:
+    try:
+        ok, _, _ = await ensure_start_sponsors_subscribed(bot, conn, user_id)
+        if not ok:
+            # отписался — следующий апдейт пойдёт через блокирующую проверку
+            await set_sponsors_verified(conn, user_id, 0, None)
+    except Exception:
+        log.exception("Background sponsor re-verification failed for %s", user_id)
+    finally:
+        _reverify_inflight.discard(user_id)
+
+
+def _schedule_reverify(bot: Bot, conn: Database, user_id: int) -> None:
+    if user_id in _reverify_inflight:
+        return
+    _reverify_inflight.add(user_id)
+    spawn_detached(_reverify(bot, conn, user_id))
+
 
 class SponsorCheckMiddleware(BaseMiddleware):
     """
     Проверяет подписку на старт-спонсоры при любом взаимодействии с ботом.
     Если пользователь не подписан и нет заявки - показывает экран с требованием подписки.
     Админы игнорируются.
+
+    Успешная проверка хранится в users.sponsors_verified_* вместе с версией
+    набора каналов: пока она не истекла и каналы не менялись, в Telegram не
+    ходим. Недавно истёкшая проверка пропускает апдейт и перепроверяется в фоне.
     """
 
     async def __call__(
@@ -26,7 +58,7 @@ class SponsorCheckMiddleware(BaseMiddleware):
         data: Dict[str, Any],
     ) -> Any:
         bot: Bot | None = data.get("bot")
-        conn: aiosqlite.Connection | None = data.get("conn")
+        conn: Database | None = data.get("conn")
         config: Config | None = data.get("config")
 
         from_user = getattr(event, "from_user", None)
@@ -38,23 +70,29 @@ class SponsorCheckMiddleware(BaseMiddleware):
         if is_admin:
             return await handler(event, data)
 
+        # Если нет каналов для проверки, пропускаем
+        catalog = await get_catalog(conn)
+        if not catalog.start_channel_ids:
+            return await handler(event, data)
+
+        # Доверяем сохранённой проверке, если она сделана для текущего набора каналов
+        user_ctx: UserContext | None = data.get("user_ctx")
+        if (
+            user_ctx is not None
+            and user_ctx.sponsors_verified_version == catalog.start_channels_version
+        ):
+            now = now_ts()
+            if user_ctx.sponsors_verified_until > now:
+                return await handler(event, data)
+            if user_ctx.sponsors_verified_until + SPONSORS_VERIFIED_TTL > now:
+                _schedule_reverify(bot, conn, from_user.id)
+                return await handler(event, data)
+
         # Проверяем подписку на старт-спонсоры
         ok, sponsors, missing_channels = await ensure_start_sponsors_subscribed(bot, conn, from_user.id)
-        
-        # Если нет старт-спонсоров, пропускаем проверку
-        if not sponsors or len(sponsors) == 0:
-            return await handler(event, data)
-        
-        # Если пользователь не подписан на все каналы - блокируем доступ
-        # Проверяем есть ли каналы для подписки
-        has_channels_to_check = any(
-            ((s["type"] or "channel").lower() if "type" in s.keys() else "channel") == "channel"
-            and int(s["channel_id"]) != 0
-            for s in sponsors
-        )
-        
-        # Если есть каналы для проверки и пользователь не подписан - блокируем
-        if has_channels_to_check and not ok:
+
+        # Если пользователь не подписан на все каналы - блокируем
+        if not ok:
             # Пользователь не подписан - показываем экран с требованием подписки
             # Но не блокируем команду /start и callback'и проверки подписок
             if isinstance(event, Message):
@@ -81,21 +119,8 @@ class SponsorCheckMiddleware(BaseMiddleware):
                 chat_id = event.message.chat.id
             
             if chat_id:
-                # Строим список спонсоров для отображения
-                has_channels = any(
-                    ((s["type"] or "channel").lower() if "type" in s.keys() else "channel") == "channel"
-                    and int(s["channel_id"]) != 0
-                    for s in sponsors
-                )
-                rows: list[dict] = []
-                for s in sponsors:
-                    type_ = (s["type"] or "channel").lower() if "type" in s.keys() else "channel"
-                    if type_ in ("bot", "link") and not has_channels:
-                        continue
-                    link = sponsor_link(s) or ""
-                    if link:
-                        rows.append({"title": str(s["title"]), "link": link})
-
+                # Клавиатура спонсоров собирается один раз на версию каталога
+                markup = kb_start_sponsors(catalog)
                 text = (
                     "🎁 Выберите свой подарок!\n\n"
                     "Ниже список спонсоров. Подпишитесь на все каналы (или отправьте заявку на вступление), "
@@ -111,7 +136,7 @@ class SponsorCheckMiddleware(BaseMiddleware):
                         user_id=from_user.id,
                         chat_id=chat_id,
                         text=text,
-                        reply_markup=kb_sponsors_list(rows) if rows else kb_check_subscriptions(),
+                        reply_markup=markup,
                         screen="start:subs",
                         payload=None,
                     )
@@ -124,7 +149,7 @@ class SponsorCheckMiddleware(BaseMiddleware):
                         user_id=from_user.id,
                         chat_id=chat_id,
                         text=text,
-                        reply_markup=kb_sponsors_list(rows) if rows else kb_check_subscriptions(),
+                        reply_markup=markup,
                         screen="start:subs",
                         payload=None,
                     )
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+
+from ..db import Database
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """
+    Открывает единицу работы на весь апдейт: записи repo из middleware и
+    хендлеров не коммитятся по одной, а применяются одной транзакцией после
+    обработки. Регистрируется как outer-middleware на dp.update.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        conn: Database | None = data.get("conn")
+        if conn is None:
+            return await handler(event, data)
+        async with conn.unit_of_work():
+            return await handler(event, data)
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+
+from ..db import Database
+from ..repo import load_user_context
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Загружает UserContext (бан, попытки, start_message_id, ui_state, стадия
+    напоминаний) одним запросом и кладёт его в data["user_ctx"].
+    Должен быть outer-middleware, чтобы остальные middleware уже видели контекст.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        conn: Database | None = data.get("conn")
+        from_user = getattr(event, "from_user", None)
+        data["user_ctx"] = (
+            await load_user_context(conn, from_user.id) if conn and from_user else None
+        )
+        return await handler(event, data)
@@ -2,11 +2,10 @@ from __future__ import annotations
 
 from typing import Any, Awaitable, Callable
 
-import aiosqlite
 from aiogram import BaseMiddleware
 from aiogram.types import Message
 
-from ..repo import get_start_message_id
+from ..repo import UserContext
 
 
 class UserMessageCleanupMiddleware(BaseMiddleware):
@@ -21,10 +20,9 @@ class UserMessageCleanupMiddleware(BaseMiddleware):
         event: Message,
         data: dict[str, Any],
     ) -> Any:
-        conn: aiosqlite.Connection | None = data.get("conn")
-        user = event.from_user
-        if conn and user:
-            start_msg_id = await get_start_message_id(conn, user.id)
+        user_ctx: UserContext | None = data.get("user_ctx")
+        if user_ctx is not None:
+            start_msg_id = user_ctx.start_message_id
 
             # Если первый раз и это /start — ничего не трогаем.
             if start_msg_id is None and (event.text or "").startswith("/start"):
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Iterator
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+# Лимиты Bot API: ~30 сообщений/с на бота, ~1/с в личный чат, ~20/мин в группу
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+PRIVATE_CHAT_RATE = 1.0
+PRIVATE_CHAT_BURST = 3
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 3
+
+# Сколько корзин чатов держим, прежде чем выбросить простаивающие
+_CHAT_BUCKETS_PRUNE_AT = 10_000
+
+
+class Priority(IntEnum):
+    """Полосы исходящих запросов: меньше — важнее."""
+
+    INTERACTIVE = 0  # ответы и правки UI в ответ на действия пользователя
+    REMINDER = 1
+    BROADCAST = 2
+
+
+_priority: ContextVar[Priority] = ContextVar("outbound_priority", default=Priority.INTERACTIVE)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+@contextmanager
+def send_priority(priority: Priority) -> Iterator[None]:
+    """
+    Все запросы к Bot API внутри блока идут в указанной полосе, например
+    ``with send_priority(Priority.BROADCAST): await bot.send_message(...)``.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_unreachable_error(exc: BaseException) -> bool:
+    """Пользователь заблокировал бота / чат не существует — повтор не поможет."""
+    if isinstance(exc, TelegramForbiddenError):
+        return True
+    return isinstance(exc, TelegramBadRequest) and "chat not found" in str(exc).lower()
+
+
+class _ChatBucket:
+    """
+    Token bucket одного чата с резервированием: токен берётся сразу (баланс
+    может уйти в минус), а вызывающий спит, пока долг не погасится — так
+    конкурентные отправки в один чат выстраиваются по очереди без блокировок.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Забирает токен; возвращает, сколько секунд ждать перед запросом."""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst and self.blocked_until <= now
+
+
+class OutboundScheduler:
+    """
+    Общий планировщик исходящих запросов: глобальный token bucket + корзины
+    по чатам. Когда глобальных токенов не хватает, их получают ожидающие из
+    более важной полосы (см. Priority), внутри полосы — по очереди.
+    """
+
+    def __init__(
+        self,
+        *,
+        rate: float = GLOBAL_RATE,
+        burst: int = GLOBAL_BURST,
+        private_rate: float = PRIVATE_CHAT_RATE,
+        private_burst: int = PRIVATE_CHAT_BURST,
+        group_rate: float = GROUP_CHAT_RATE,
+        group_burst: int = GROUP_CHAT_BURST,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        # до какого момента полоса не получает глобальных токенов (после 429)
+        self._paused_until: dict[Priority, float] = {p: 0.0 for p in Priority}
+        self._waiters: dict[Priority, deque[asyncio.Future[None]]] = {p: deque() for p in Priority}
+        self._dispatcher: asyncio.Task[None] | None = None
+        # будит диспетчер, спящий до снятия паузы, когда пришёл новый ожидающий
+        self._wakeup = asyncio.Event()
+        self._chats: dict[int, _ChatBucket] = {}
+
+    def queue_depth(self) -> dict[str, int]:
+        return {p.name.lower(): len(q) for p, q in self._waiters.items()}
+
+    async def acquire(self, chat_id: int | None, priority: Priority | None = None) -> None:
+        """Ждёт разрешения на один запрос в chat_id (None — только глобальный лимит)."""
+        if chat_id is not None:
+            wait = self._chat_bucket(chat_id).reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        await self._acquire_global(current_priority() if priority is None else priority)
+
+    def penalize(self, chat_id: int | None, retry_after: float) -> None:
+        """
+        Telegram ответил 429: не шлём в этот чат retry_after секунд. По 429
+        не понять, чатовый это лимит или общий на бота, поэтому фоновые
+        полосы (напоминания, рассылка) встают на паузу целиком — иначе при
+        общем flood wait они продолжали бы упираться в лимит. Ответы
+        пользователям в другие чаты идут дальше. Для запросов без чата
+        притормаживаем все полосы.
+        """
+        until = time.monotonic() + retry_after
+        lanes = list(Priority) if chat_id is None else [p for p in Priority if p > Priority.INTERACTIVE]
+        for p in lanes:
+            self._paused_until[p] = max(self._paused_until[p], until)
+        if chat_id is not None:
+            bucket = self._chat_bucket(chat_id)
+            bucket.blocked_until = max(bucket.blocked_until, until)
+
+    # ---- internals ----
+
+    def _chat_bucket(self, chat_id: int) -> _ChatBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _CHAT_BUCKETS_PRUNE_AT:
+                self._prune()
+            if chat_id < 0:
+                bucket = _ChatBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = _ChatBucket(self.private_rate, self.private_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for chat_id in [c for c, b in self._chats.items() if b.idle(now)]:
+            del self._chats[chat_id]
+
+    def _refill(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    def _has_waiters(self) -> bool:
+        return any(self._waiters.values())
+
+    async def _acquire_global(self, priority: Priority) -> None:
+        now = self._refill()
+        if not self._has_waiters() and self._tokens >= 1 and now >= self._paused_until[priority]:
+            self._tokens -= 1
+            return
+        fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(fut)
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # токен уже выдан, но не использован — возвращаем
+                self._tokens = min(self.burst, self._tokens + 1)
+            else:
+                try:
+                    self._waiters[priority].remove(fut)
+                except ValueError:
+                    pass
+            raise
+
+    def _next_lane(self, now: float) -> Priority | None:
+        """Самая важная полоса с ожидающими и без паузы."""
+        for p in Priority:
+            q = self._waiters[p]
+            while q and q[0].done():
+                q.popleft()
+            if q and now >= self._paused_until[p]:
+                return p
+        return None
+
+    async def _dispatch(self) -> None:
+        while self._has_waiters():
+            now = self._refill()
+            lane = self._next_lane(now)
+            if lane is None:
+                # все ожидающие — в полосах на паузе; спим до её конца или
+                # до прихода ожидающего из другой полосы
+                paused = [self._paused_until[p] for p in Priority if self._waiters[p]]
+                if paused:
+                    self._wakeup.clear()
+                    with suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self._wakeup.wait(), min(paused) - now)
+                continue
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            self._tokens -= 1
+            self._waiters[lane].popleft().set_result(None)
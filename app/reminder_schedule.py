@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import time
+
+
+class ReminderSchedule:
+    """
+    Мин-куча (next_reminder_ts, user_id) в памяти — зеркало
+    user_reminders.next_reminder_ts. Цикл напоминаний спит ровно до
+    ближайшего срока вместо периодического опроса таблицы.
+
+    Устаревшие записи кучи не удаляются, а пропускаются при извлечении:
+    актуальный срок пользователя хранится в ``_due``. Срок в куче может быть
+    раньше, чем в БД (тогда строка просто перепроверится), но не позже.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[int, int]] = []
+        self._due: dict[int, int] = {}
+        self._changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._due
+
+    def load(self, rows: list[tuple[int, int]]) -> None:
+        """rows: (user_id, next_reminder_ts) — начальное состояние из БД."""
+        self._due = {int(uid): int(ts) for uid, ts in rows}
+        self._heap = [(ts, uid) for uid, ts in self._due.items()]
+        heapq.heapify(self._heap)
+        self._changed.set()
+
+    def set(self, user_id: int, ts: int | None) -> None:
+        """Новый срок пользователя; None — напоминания отключены."""
+        if ts is None:
+            self._due.pop(user_id, None)
+            return
+        if self._due.get(user_id) == ts:
+            return
+        self._due[user_id] = ts
+        head = self.next_ts()
+        heapq.heappush(self._heap, (ts, user_id))
+        # цикл спит до прежнего ближайшего срока — будим, если новый раньше
+        if head is None or ts < head:
+            self._changed.set()
+        # слишком много устаревших записей — пересобираем кучу
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(t, u) for u, t in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def next_ts(self) -> int | None:
+        while self._heap:
+            ts, uid = self._heap[0]
+            if self._due.get(uid) == ts:
+                return ts
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: int, limit: int) -> list[int]:
+        """Извлекает до limit пользователей со сроком <= now."""
+        out: list[int] = []
+        while len(out) < limit:
+            ts = self.next_ts()
+            if ts is None or ts > now:
+                break
+            _, uid = heapq.heappop(self._heap)
+            del self._due[uid]
+            out.append(uid)
+        return out
+
+    async def wait(self, timeout: float | None) -> None:
+        """Спит timeout секунд (None — без ограничения) или пока не появится более ранний срок."""
+        self._changed.clear()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def seconds_until_next(self) -> float | None:
+        ts = self.next_ts()
+        return None if ts is None else max(0.0, ts - time.time())
+
+
+reminder_schedule = ReminderSchedule()
@@ -1,19 +1,34 @@
 from __future__ import annotations
 
+import asyncio
+import logging
 import random
 from typing import Sequence
 
-import aiosqlite
 from aiogram import Bot
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
+from .db import Database
+from .outbound import Priority, is_unreachable_error, send_priority
 from .repo import (
-    advance_reminder_stage,
+    advance_reminder_stages,
+    flush_user_activity,
     get_due_reminders,
-    stop_reminders,
+    list_reminder_schedule,
+    mark_users_unreachable,
+    stop_reminders_many,
 )
+from .reminder_schedule import reminder_schedule
 from .timeutil import now_ts
 
+log = logging.getLogger(__name__)
+
+# Пользователей за один проход (после простоя просроченных может быть много)
+REMINDER_BATCH_SIZE = 500
+# Параллельных отправок напоминаний
+REMINDER_SENDERS = 8
+# Пауза перед повтором, если пачка упала с ошибкой (сек)
+REMINDER_RETRY_DELAY = 60
 
 REMINDER_MESSAGES: Sequence[str] = (
     "Твой подарок всё ещё ждёт тебя 🎁",
@@ -50,66 +65,96 @@ def _build_reminder_markup() -> InlineKeyboardMarkup:
     )
 
 
-async def process_due_reminders(bot: Bot, conn: aiosqlite.Connection) -> None:
+async def process_due_reminders(bot: Bot, conn: Database) -> int:
     """
-    Отправляет напоминания всем пользователям, у которых наступило время next_reminder_ts.
-    Напоминания отправляются только если пользователь не забанен и ещё не выигрывал подарков.
+    Отправляет напоминания пользователям, чей срок в ReminderSchedule наступил
+    (не больше REMINDER_BATCH_SIZE за вызов). Напоминания отправляются только
+    если пользователь не забанен и ещё не выигрывал подарков.
+    Возвращает, сколько пользователей извлечено из расписания.
     """
     now = now_ts()
-    rows = await get_due_reminders(conn, now)
-    if not rows:
-        return
-
+    user_ids = reminder_schedule.pop_due(now, REMINDER_BATCH_SIZE)
+    if not user_ids:
+        return 0
+    try:
+        # свежая активность должна попасть в БД до проверки сроков по ней
+        await flush_user_activity(conn)
+        await _process_batch(bot, conn, now, user_ids)
+    except Exception:
+        # не потерять извлечённых и ещё не обработанных: вернём их в расписание
+        # чуть позже (лишние просто не пройдут проверку срока по БД)
+        for uid in user_ids:
+            if uid not in reminder_schedule:
+                reminder_schedule.set(uid, now + REMINDER_RETRY_DELAY)
+        raise
+    return len(user_ids)
+
+
+async def _process_batch(bot: Bot, conn: Database, now: int, user_ids: list[int]) -> None:
+    # Один запрос на пачку: стадия, бан и наличие подарков сразу
+    rows = await get_due_reminders(conn, user_ids)
+
+    to_stop: list[int] = []
+    to_send: list[tuple[int, int, bool]] = []
     for r in rows:
         user_id = int(r["user_id"])
-        stage = int(r["stage"])
-        first_done = bool(r["first_sequence_done"])
-        is_banned = int(r["is_banned"] or 0)
-
-        if is_banned:
-            # Отключаем напоминания забаненным пользователям
-            await stop_reminders(conn, user_id)
-            continue
-
-        # Проверяем, выигрывал ли пользователь подарки
-        cur = await conn.execute(
-            "SELECT COUNT(1) AS c FROM inventory WHERE user_id=?", (user_id,)
-        )
-        inv_row = await cur.fetchone()
-        has_gifts = bool(inv_row and int(inv_row["c"]) > 0)
-        if has_gifts:
-            # Если уже есть подарки, отключаем напоминания
-            await stop_reminders(conn, user_id)
-            continue
-
-        # Отправляем напоминание
-        text = random.choice(REMINDER_MESSAGES)
-        try:
-            await bot.send_message(
-                chat_id=user_id,
-                text=text,
-                reply_markup=_build_reminder_markup(),
-            )
-        except Exception:
-            # Игнорируем любые ошибки отправки (например, бот заблокирован)
-            pass
-
-        # Переводим пользователя на следующую стадию напоминаний
-        await advance_reminder_stage(conn, user_id, stage, first_done)
-
-
-async def run_reminders_loop(bot: Bot, conn: aiosqlite.Connection) -> None:
-    """
-    Фоновая задача, периодически проверяющая напоминания.
-    """
-    import asyncio
+        next_ts = int(r["next_reminder_ts"])
+        if next_ts > now:
+            # активность сдвинула срок — запись в куче была ранней
+            reminder_schedule.set(user_id, next_ts)
+        elif int(r["is_banned"] or 0) or r["has_gifts"]:
+            # Забаненным и уже выигравшим подарки напоминания отключаем
+            to_stop.append(user_id)
+        else:
+            to_send.append((user_id, int(r["stage"]), bool(r["first_sequence_done"])))
+
+    await stop_reminders_many(conn, to_stop)
+
+    # Отправляем параллельно; общий темп задаёт OutboundScheduler
+    sem = asyncio.Semaphore(REMINDER_SENDERS)
+    markup = _build_reminder_markup()
+
+    async def send(user_id: int) -> bool:
+        async with sem:
+            try:
+                await bot.send_message(
+                    chat_id=user_id,
+                    text=random.choice(REMINDER_MESSAGES),
+                    reply_markup=markup,
+                )
+            except Exception as e:
+                if is_unreachable_error(e):
+                    return False
+                # прочие ошибки (сеть, 429) — стадия всё равно сдвигается
+                log.debug("Reminder to %s failed: %s", user_id, e)
+            return True
 
-    while True:
-        try:
-            await process_due_reminders(bot, conn)
-        except Exception:
-            # Логировать можно при желании
-            pass
-        await asyncio.sleep(30)
+    reachable = await asyncio.gather(*(send(uid) for uid, _, _ in to_send))
 
+    # Заблокировавших бота убираем из напоминаний и рассылок до их возвращения,
+    # остальных переводим на следующую стадию одним executemany
+    await mark_users_unreachable(conn, [item[0] for item, ok in zip(to_send, reachable) if not ok])
+    await advance_reminder_stages(conn, [item for item, ok in zip(to_send, reachable) if ok])
+
+
+async def run_reminders_loop(bot: Bot, conn: Database) -> None:
+    """
+    Фоновая задача напоминаний: загружает расписание из user_reminders и спит
+    до ближайшего срока (или пока активность не поставит более ранний).
+    """
+    reminder_schedule.load(await list_reminder_schedule(conn))
+
+    # отправки напоминаний уступают интерактивным ответам в OutboundScheduler
+    with send_priority(Priority.REMINDER):
+        while True:
+            delay = reminder_schedule.seconds_until_next()
+            if delay is None or delay > 0:
+                # None — расписание пусто, ждём первой записи
+                await reminder_schedule.wait(delay)
+                continue
+            try:
+                await process_due_reminders(bot, conn)
+            except Exception:
+                log.exception("Reminder batch failed")
+                await asyncio.sleep(REMINDER_RETRY_DELAY)
 
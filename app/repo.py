@@ -1,16 +1,116 @@
 from __future__ import annotations
 
 import json
-from typing import Any
+from dataclasses import dataclass
+from typing import Any, Sequence
 
 import aiosqlite
 
+from .activity_buffer import activity_buffer
+from .catalog import get_catalog, invalidate_catalog
+from .db import MISSING, Database
+from .reminder_schedule import reminder_schedule
 from .timeutil import now_ts
+from .ui_state_cache import ui_state_cache
 
 
-async def upsert_user(conn: aiosqlite.Connection, user_id: int, username: str | None, first_name: str | None, last_name: str | None) -> None:
+async def _fetchone(conn: Database, sql: str, params: Sequence[Any] = (), *, own_writes: bool = True) -> aiosqlite.Row | None:
+    async with conn.reader(own_writes=own_writes) as r:
+        cur = await r.execute(sql, params)
+        return await cur.fetchone()
+
+
+async def _fetchall(conn: Database, sql: str, params: Sequence[Any] = (), *, own_writes: bool = True) -> list[aiosqlite.Row]:
+    async with conn.reader(own_writes=own_writes) as r:
+        cur = await r.execute(sql, params)
+        return list(await cur.fetchall())
+
+
+# ---- Per-update user context ----
+
+
+@dataclass
+class UserContext:
+    """
+    Состояние пользователя для одного апдейта, загруженное одним запросом
+    (users + ui_state + user_reminders). Кладётся в data["user_ctx"] и в
+    единицу работы; repo-хелперы читают его вместо повторных SELECT и
+    держат в актуальном состоянии при своих записях.
+    """
+
+    user_id: int
+    exists: bool = False
+    is_banned: bool = False
+    attempts: int = 0
+    start_message_id: int | None = None
+    ui_state: dict[str, Any] | None = None
+    reminder_stage: int | None = None
+    first_sequence_done: bool = False
+    sponsors_verified_until: int = 0
+    sponsors_verified_version: int | None = None
+    is_reachable: bool = True
+
+
+def _staged_ctx(conn: Database, user_id: int) -> UserContext | None:
+    ctx = conn.staged(("user_ctx", user_id))
+    return None if ctx is MISSING else ctx
+
+
+async def load_user_context(conn: Database, user_id: int) -> UserContext:
+    row = await _fetchone(
+        conn,
+        """
+        SELECT u.is_banned, u.attempts, u.start_message_id,
+               u.sponsors_verified_until, u.sponsors_verified_version, u.is_reachable,
+               s.chat_id AS ui_chat_id, s.message_id AS ui_message_id, s.screen AS ui_screen,
+               s.payload_json AS ui_payload_json, s.payload_blob AS ui_payload_blob,
+               s.render_hash AS ui_render_hash, s.updated_at AS ui_updated_at,
+               r.stage AS reminder_stage, r.first_sequence_done
+        FROM users u
+        LEFT JOIN ui_state s ON s.user_id = u.user_id
+        LEFT JOIN user_reminders r ON r.user_id = u.user_id
+        WHERE u.user_id = ?
+        """,
+        (user_id,),
+    )
+    ctx = UserContext(user_id=user_id)
+    if row:
+        ctx.exists = True
+        ctx.is_banned = int(row["is_banned"] or 0) == 1
+        ctx.attempts = int(row["attempts"])
+        ctx.start_message_id = int(row["start_message_id"]) if row["start_message_id"] is not None else None
+        ctx.sponsors_verified_until = int(row["sponsors_verified_until"] or 0)
+        ctx.is_reachable = bool(row["is_reachable"])
+        if row["sponsors_verified_version"] is not None:
+            ctx.sponsors_verified_version = int(row["sponsors_verified_version"])
+        cached = ui_state_cache.get(user_id)
+        if cached is not MISSING:
+            # кэш актуальнее БД: там может ещё не быть отложенной записи
+            ctx.ui_state = cached
+        elif row["ui_message_id"] is not None:
+            ctx.ui_state = {
+                "user_id": user_id,
+                "chat_id": int(row["ui_chat_id"]),
+                "message_id": int(row["ui_message_id"]),
+                "screen": row["ui_screen"],
+                "payload_json": row["ui_payload_json"],
+                "payload_blob": row["ui_payload_blob"],
+                "render_hash": row["ui_render_hash"],
+                "updated_at": row["ui_updated_at"],
+            }
+        if row["reminder_stage"] is not None:
+            ctx.reminder_stage = int(row["reminder_stage"])
+            ctx.first_sequence_done = bool(row["first_sequence_done"])
+        if cached is MISSING:
+            ui_state_cache.put(user_id, ctx.ui_state)
+    conn.stage(("user_ctx", user_id), ctx)
+    conn.stage(("ui_state", user_id), ctx.ui_state)
+    return ctx
+
+
+async def upsert_user(conn: Database, user_id: int, username: str | None, first_name: str | None, last_name: str | None) -> None:
     ts = now_ts()
-    await conn.execute(
+    await conn.write(
         """
         INSERT INTO users(user_id, username, first_name, last_name, created_at, updated_at)
         VALUES(?, ?, ?, ?, ?, ?)
@@ -22,38 +122,28 @@ async def upsert_user(conn: aiosqlite.Connection, user_id: int, username: str |
         """,
         (user_id, username, first_name, last_name, ts, ts),
     )
-    await conn.commit()
+    ctx = _staged_ctx(conn, user_id)
+    if ctx is not None:
+        ctx.exists = True
 
 
-async def set_start_message_id(conn: aiosqlite.Connection, user_id: int, message_id: int) -> None:
-    await conn.execute(
+async def set_start_message_id(conn: Database, user_id: int, message_id: int) -> None:
+    await conn.write(
         "UPDATE users SET start_message_id=?, updated_at=? WHERE user_id=?",
         (message_id, now_ts(), user_id),
     )
-    await conn.commit()
-
+    ctx = _staged_ctx(conn, user_id)
+    if ctx is not None:
+        ctx.start_message_id = message_id
 
-async def get_start_message_id(conn: aiosqlite.Connection, user_id: int) -> int | None:
-    cur = await conn.execute("SELECT start_message_id FROM users WHERE user_id=?", (user_id,))
-    row = await cur.fetchone()
-    if not row or row["start_message_id"] is None:
-        return None
-    return int(row["start_message_id"])
 
+async def get_user(conn: Database, user_id: int) -> aiosqlite.Row | None:
+    return await _fetchone(conn, "SELECT * FROM users WHERE user_id=?", (user_id,))
 
-async def get_user(conn: aiosqlite.Connection, user_id: int) -> aiosqlite.Row | None:
-    cur = await conn.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-    return await cur.fetchone()
 
-
-async def is_user_banned(conn: aiosqlite.Connection, user_id: int) -> bool:
-    cur = await conn.execute("SELECT is_banned FROM users WHERE user_id=?", (user_id,))
-    row = await cur.fetchone()
-    return bool(row and int(row["is_banned"]) == 1)
-
-
-async def list_users(conn: aiosqlite.Connection, limit: int = 50, offset: int = 0) -> list[aiosqlite.Row]:
-    cur = await conn.execute(
+async def list_users(conn: Database, limit: int = 50, offset: int = 0) -> list[aiosqlite.Row]:
+    return await _fetchall(
+        conn,
         """
         SELECT *
         FROM users
@@ -62,116 +152,222 @@ async def list_users(conn: aiosqlite.Connection, limit: int = 50, offset: int =
         """,
         (limit, offset),
     )
-    return list(await cur.fetchall())
 
 
-async def set_user_ban(conn: aiosqlite.Connection, user_id: int, banned: bool) -> None:
-    await conn.execute(
+async def get_stats(conn: Database) -> dict[str, int]:
+    """Агрегированная статистика по основным таблицам (для админки)."""
+    row = await _fetchone(
+        conn,
+        """
+        SELECT
+          (SELECT COUNT(1) FROM users) AS users_total,
+          (SELECT COUNT(1) FROM users WHERE is_banned=1) AS users_banned,
+          (SELECT COALESCE(SUM(attempts), 0) FROM users) AS attempts_sum,
+          (SELECT COUNT(1) FROM gifts) AS gifts_total,
+          (SELECT COUNT(1) FROM gifts WHERE is_active=1) AS gifts_active,
+          (SELECT COUNT(1) FROM start_sponsors) AS ss_total,
+          (SELECT COUNT(1) FROM start_sponsors WHERE is_active=1) AS ss_active,
+          (SELECT COUNT(1) FROM sponsors) AS ts_total,
+          (SELECT COUNT(1) FROM sponsors WHERE is_active=1) AS ts_active,
+          (SELECT COUNT(1) FROM inventory) AS inv_total,
+          (SELECT COUNT(1) FROM inventory WHERE status='withdrawn') AS inv_withdrawn
+        """,
+    )
+    return {k: int(row[k] or 0) for k in row.keys()} if row else {}
+
+
+async def set_user_ban(conn: Database, user_id: int, banned: bool) -> None:
+    await conn.write(
         "UPDATE users SET is_banned=?, updated_at=? WHERE user_id=?",
         (1 if banned else 0, now_ts(), user_id),
     )
-    await conn.commit()
+    ctx = _staged_ctx(conn, user_id)
+    if ctx is not None:
+        ctx.is_banned = banned
+
+
+async def set_sponsors_verified(conn: Database, user_id: int, until: int, version: int | None) -> None:
+    """until=0 — проверка больше не действительна (например, отписался)."""
+    await conn.write(
+        "UPDATE users SET sponsors_verified_until=?, sponsors_verified_version=? WHERE user_id=?",
+        (until, version, user_id),
+    )
+    ctx = _staged_ctx(conn, user_id)
+    if ctx is not None:
+        ctx.sponsors_verified_until = until
+        ctx.sponsors_verified_version = version
 
 
-async def get_user_attempts(conn: aiosqlite.Connection, user_id: int) -> int:
-    cur = await conn.execute("SELECT attempts FROM users WHERE user_id=?", (user_id,))
-    row = await cur.fetchone()
+async def mark_users_unreachable(conn: Database, user_ids: Sequence[int]) -> None:
+    """
+    Бот заблокирован / чат не найден: убираем из рассылок и напоминаний
+    (next_reminder_ts=NULL, стадия сохраняется) до следующего взаимодействия.
+    """
+    if not user_ids:
+        return
+    marks = ",".join("?" * len(user_ids))
+    async with conn.unit_of_work():
+        await conn.write(f"UPDATE users SET is_reachable=0 WHERE user_id IN ({marks})", tuple(user_ids))
+        await conn.write(
+            f"UPDATE user_reminders SET next_reminder_ts=NULL WHERE user_id IN ({marks})",
+            tuple(user_ids),
+        )
+        for user_id in user_ids:
+            _schedule_reminder(conn, user_id, None)
+
+
+async def set_user_reachable(conn: Database, user_id: int) -> None:
+    """Пользователь снова написал боту; напоминания вернёт touch_user_activity."""
+    await conn.write("UPDATE users SET is_reachable=1 WHERE user_id=?", (user_id,))
+    ctx = _staged_ctx(conn, user_id)
+    if ctx is not None:
+        ctx.is_reachable = True
+
+
+async def get_user_attempts(conn: Database, user_id: int) -> int:
+    ctx = _staged_ctx(conn, user_id)
+    if ctx is not None:
+        return ctx.attempts
+    row = await _fetchone(conn, "SELECT attempts FROM users WHERE user_id=?", (user_id,))
     return int(row["attempts"]) if row else 0
 
 
-async def add_attempts(conn: aiosqlite.Connection, user_id: int, delta: int) -> None:
-    await conn.execute(
+async def add_attempts(conn: Database, user_id: int, delta: int) -> None:
+    await conn.write(
         "UPDATE users SET attempts = MAX(0, attempts + ?), updated_at=? WHERE user_id=?",
         (delta, now_ts(), user_id),
     )
-    await conn.commit()
+    ctx = _staged_ctx(conn, user_id)
+    if ctx is not None:
+        ctx.attempts = max(0, ctx.attempts + delta)
+
+
+async def consume_attempt(conn: Database, user_id: int) -> int | None:
+    """
+    Списывает одну попытку, если она есть (проверка и списание — один
+    UPDATE). Возвращает оставшееся число попыток или None — попыток не было.
+    """
+    row = await conn.write_returning(
+        "UPDATE users SET attempts = attempts - 1, updated_at=? WHERE user_id=? AND attempts > 0 RETURNING attempts",
+        (now_ts(), user_id),
+    )
+    attempts = int(row["attempts"]) if row is not None else None
+    ctx = _staged_ctx(conn, user_id)
+    if ctx is not None:
+        ctx.attempts = attempts or 0
+    return attempts
 
 
-async def set_attempts(conn: aiosqlite.Connection, user_id: int, attempts: int) -> None:
-    await conn.execute(
+async def set_attempts(conn: Database, user_id: int, attempts: int) -> None:
+    await conn.write(
         "UPDATE users SET attempts=?, updated_at=? WHERE user_id=?",
         (max(0, attempts), now_ts(), user_id),
     )
-    await conn.commit()
+    ctx = _staged_ctx(conn, user_id)
+    if ctx is not None:
+        ctx.attempts = max(0, attempts)
 
 
-async def get_setting_float(conn: aiosqlite.Connection, key: str, default: float) -> float:
-    cur = await conn.execute("SELECT value FROM settings WHERE key=?", (key,))
-    row = await cur.fetchone()
-    if not row:
+# ---- Catalog: gifts / sponsors / settings (читаются из снимка в памяти) ----
+
+
+async def get_setting_float(conn: Database, key: str, default: float) -> float:
+    value = (await get_catalog(conn)).settings.get(key)
+    if value is None:
         return default
     try:
-        return float(row["value"])
+        return float(value)
     except Exception:
         return default
 
 
-async def get_setting_int(conn: aiosqlite.Connection, key: str, default: int) -> int:
-    cur = await conn.execute("SELECT value FROM settings WHERE key=?", (key,))
-    row = await cur.fetchone()
-    if not row:
+async def get_setting_int(conn: Database, key: str, default: int) -> int:
+    value = (await get_catalog(conn)).settings.get(key)
+    if value is None:
         return default
     try:
-        return int(row["value"])
+        return int(value)
     except Exception:
         return default
 
 
-async def set_setting(conn: aiosqlite.Connection, key: str, value: str) -> None:
-    await conn.execute(
+async def set_setting(conn: Database, key: str, value: str) -> None:
+    await conn.write(
         "INSERT INTO settings(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
         (key, value),
     )
-    await conn.commit()
+    invalidate_catalog(conn)
 
 
-async def get_active_start_sponsors(conn: aiosqlite.Connection) -> list[aiosqlite.Row]:
-    cur = await conn.execute(
-        "SELECT * FROM start_sponsors WHERE is_active=1 ORDER BY sort_order ASC, id ASC"
-    )
-    return list(await cur.fetchall())
+async def get_active_start_sponsors(conn: Database) -> list[aiosqlite.Row]:
+    return list((await get_catalog(conn)).start_sponsors)
 
 
-async def get_active_task_sponsors(conn: aiosqlite.Connection) -> list[aiosqlite.Row]:
-    cur = await conn.execute(
-        "SELECT * FROM sponsors WHERE is_active=1 ORDER BY sort_order ASC, id ASC"
-    )
-    return list(await cur.fetchall())
+async def get_active_task_sponsors(conn: Database) -> list[aiosqlite.Row]:
+    return list((await get_catalog(conn)).task_sponsors)
 
 
-async def get_active_gifts(conn: aiosqlite.Connection) -> list[aiosqlite.Row]:
-    cur = await conn.execute(
-        "SELECT * FROM gifts WHERE is_active=1 ORDER BY sort_order ASC, id ASC"
-    )
-    return list(await cur.fetchall())
+async def get_active_gifts(conn: Database) -> list[aiosqlite.Row]:
+    return list((await get_catalog(conn)).gifts)
 
 
-async def list_start_sponsors(conn: aiosqlite.Connection) -> list[aiosqlite.Row]:
-    cur = await conn.execute(
+async def list_start_sponsors(conn: Database) -> list[aiosqlite.Row]:
+    return await _fetchall(
+        conn,
         "SELECT * FROM start_sponsors ORDER BY is_active DESC, sort_order ASC, id ASC"
     )
-    return list(await cur.fetchall())
 
 
-async def list_task_sponsors(conn: aiosqlite.Connection) -> list[aiosqlite.Row]:
-    cur = await conn.execute(
+async def list_task_sponsors(conn: Database) -> list[aiosqlite.Row]:
+    return await _fetchall(
+        conn,
         "SELECT * FROM sponsors ORDER BY is_active DESC, sort_order ASC, id ASC"
     )
-    return list(await cur.fetchall())
 
 
-async def get_start_sponsor(conn: aiosqlite.Connection, sponsor_id: int) -> aiosqlite.Row | None:
-    cur = await conn.execute("SELECT * FROM start_sponsors WHERE id=?", (sponsor_id,))
-    return await cur.fetchone()
+async def get_start_sponsor(conn: Database, sponsor_id: int) -> aiosqlite.Row | None:
+    return await _fetchone(conn, "SELECT * FROM start_sponsors WHERE id=?", (sponsor_id,))
+
 
+async def get_task_sponsor(conn: Database, sponsor_id: int) -> aiosqlite.Row | None:
+    return await _fetchone(conn, "SELECT * FROM sponsors WHERE id=?", (sponsor_id,))
 
-async def get_task_sponsor(conn: aiosqlite.Connection, sponsor_id: int) -> aiosqlite.Row | None:
-    cur = await conn.execute("SELECT * FROM sponsors WHERE id=?", (sponsor_id,))
-    return await cur.fetchone()
+
+async def add_start_sponsor(
+    conn: Database,
+    *,
+    title: str,
+    type_: str,
+    channel_id: int,
+    channel_username: str | None,
+    invite_link: str | None,
+) -> None:
+    await conn.write(
+        "INSERT INTO start_sponsors(title, type, channel_id, channel_username, invite_link, is_active) VALUES(?, ?, ?, ?, ?, 1)",
+        (title, type_, channel_id, channel_username, invite_link),
+    )
+    invalidate_catalog(conn)
+
+
+async def add_task_sponsor(
+    conn: Database,
+    *,
+    title: str,
+    type_: str,
+    channel_id: int,
+    channel_username: str | None,
+    invite_link: str | None,
+    bonus_attempts: int,
+) -> None:
+    await conn.write(
+        "INSERT INTO sponsors(title, type, channel_id, bonus_attempts, channel_username, invite_link, is_active) VALUES(?, ?, ?, ?, ?, ?, 1)",
+        (title, type_, channel_id, bonus_attempts, channel_username, invite_link),
+    )
+    invalidate_catalog(conn)
 
 
 async def update_start_sponsor(
-    conn: aiosqlite.Connection,
+    conn: Database,
     sponsor_id: int,
     *,
     title: str,
@@ -181,7 +377,7 @@ async def update_start_sponsor(
     invite_link: str | None,
     is_active: int,
 ) -> None:
-    await conn.execute(
+    await conn.write(
         """
         UPDATE start_sponsors
         SET title=?, type=?, channel_id=?, channel_username=?, invite_link=?, is_active=?
@@ -189,11 +385,11 @@ async def update_start_sponsor(
         """,
         (title, type_, channel_id, channel_username, invite_link, is_active, sponsor_id),
     )
-    await conn.commit()
+    invalidate_catalog(conn)
 
 
 async def update_task_sponsor(
-    conn: aiosqlite.Connection,
+    conn: Database,
     sponsor_id: int,
     *,
     title: str,
@@ -204,7 +400,7 @@ async def update_task_sponsor(
     bonus_attempts: int,
     is_active: int,
 ) -> None:
-    await conn.execute(
+    await conn.write(
         """
         UPDATE sponsors
         SET title=?, type=?, channel_id=?, channel_username=?, invite_link=?, bonus_attempts=?, is_active=?
@@ -221,49 +417,53 @@ async def update_task_sponsor(
             sponsor_id,
         ),
     )
-    await conn.commit()
+    invalidate_catalog(conn)
 
 
-async def delete_start_sponsor(conn: aiosqlite.Connection, sponsor_id: int) -> None:
-    await conn.execute("DELETE FROM start_sponsors WHERE id=?", (sponsor_id,))
-    await conn.commit()
+async def delete_start_sponsor(conn: Database, sponsor_id: int) -> None:
+    await conn.write("DELETE FROM start_sponsors WHERE id=?", (sponsor_id,))
+    invalidate_catalog(conn)
 
 
-async def delete_task_sponsor(conn: aiosqlite.Connection, sponsor_id: int) -> None:
-    await conn.execute("DELETE FROM sponsors WHERE id=?", (sponsor_id,))
-    await conn.commit()
+async def delete_task_sponsor(conn: Database, sponsor_id: int) -> None:
+    await conn.write("DELETE FROM sponsors WHERE id=?", (sponsor_id,))
+    invalidate_catalog(conn)
 
 
-async def get_gift_count_active(conn: aiosqlite.Connection) -> int:
-    cur = await conn.execute("SELECT COUNT(1) AS c FROM gifts WHERE is_active=1")
-    row = await cur.fetchone()
-    return int(row["c"]) if row else 0
+async def get_gift_count_active(conn: Database) -> int:
+    return len((await get_catalog(conn)).gifts)
 
 
-async def get_gift(conn: aiosqlite.Connection, gift_id: int) -> aiosqlite.Row | None:
-    cur = await conn.execute("SELECT * FROM gifts WHERE id=?", (gift_id,))
-    return await cur.fetchone()
+async def get_gift(conn: Database, gift_id: int) -> aiosqlite.Row | None:
+    return await _fetchone(conn, "SELECT * FROM gifts WHERE id=?", (gift_id,))
 
 
-async def list_gifts(conn: aiosqlite.Connection) -> list[aiosqlite.Row]:
-    cur = await conn.execute(
+async def list_gifts(conn: Database) -> list[aiosqlite.Row]:
+    return await _fetchall(
+        conn,
         "SELECT * FROM gifts ORDER BY is_active DESC, sort_order ASC, id ASC"
     )
-    return list(await cur.fetchall())
 
 
-async def add_inventory_item(conn: aiosqlite.Connection, user_id: int, gift_id: int) -> int:
+async def add_gift(conn: Database, *, title: str, price: int, drop_chance: float) -> None:
+    await conn.write(
+        "INSERT INTO gifts(title, price, drop_chance, is_active) VALUES(?, ?, ?, 1)",
+        (title, price, drop_chance),
+    )
+    invalidate_catalog(conn)
+
+
+async def add_inventory_item(conn: Database, user_id: int, gift_id: int) -> None:
     ts = now_ts()
-    cur = await conn.execute(
+    await conn.write(
         "INSERT INTO inventory(user_id, gift_id, won_at, status) VALUES(?, ?, ?, 'won')",
         (user_id, gift_id, ts),
     )
-    await conn.commit()
-    return int(cur.lastrowid)
 
 
-async def list_inventory(conn: aiosqlite.Connection, user_id: int) -> list[aiosqlite.Row]:
-    cur = await conn.execute(
+async def list_inventory(conn: Database, user_id: int) -> list[aiosqlite.Row]:
+    return await _fetchall(
+        conn,
         """
         SELECT i.*, g.title AS gift_title, g.emoji AS gift_emoji
         FROM inventory i
@@ -273,11 +473,11 @@ async def list_inventory(conn: aiosqlite.Connection, user_id: int) -> list[aiosq
         """,
         (user_id,),
     )
-    return list(await cur.fetchall())
 
 
-async def get_inventory_item(conn: aiosqlite.Connection, inventory_id: int, user_id: int) -> aiosqlite.Row | None:
-    cur = await conn.execute(
+async def get_inventory_item(conn: Database, inventory_id: int, user_id: int) -> aiosqlite.Row | None:
+    return await _fetchone(
+        conn,
         """
         SELECT i.*, g.title AS gift_title, g.emoji AS gift_emoji, g.photo_file_id, g.price
         FROM inventory i
@@ -286,35 +486,117 @@ async def get_inventory_item(conn: aiosqlite.Connection, inventory_id: int, user
         """,
         (inventory_id, user_id),
     )
-    return await cur.fetchone()
 
 
-async def set_ui_state(conn: aiosqlite.Connection, user_id: int, chat_id: int, message_id: int, screen: str, payload: dict[str, Any] | None) -> None:
-    ts = now_ts()
-    payload_json = json.dumps(payload or {}, ensure_ascii=False)
-    await conn.execute(
-        """
-        INSERT INTO ui_state(user_id, chat_id, message_id, screen, payload_json, updated_at)
-        VALUES(?, ?, ?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-          chat_id=excluded.chat_id,
-          message_id=excluded.message_id,
-          screen=excluded.screen,
-          payload_json=excluded.payload_json,
-          updated_at=excluded.updated_at
-        """,
-        (user_id, chat_id, message_id, screen, payload_json, ts),
-    )
-    await conn.commit()
-
+async def set_ui_state(
+    conn: Database,
+    user_id: int,
+    chat_id: int,
+    message_id: int,
+    screen: str,
+    payload: dict[str, Any] | bytes | None,
+    *,
+    render_hash: int | None = None,
+) -> None:
+    """
+    Запоминает UI-сообщение пользователя. Пишется не сразу: состояние кладётся
+    в ui_state_cache, а в БД уходит пачкой (flush_ui_state). Повтор того же
+    состояния (перерисовка экрана без изменений) ничего не пишет.
 
-async def get_ui_state(conn: aiosqlite.Connection, user_id: int) -> aiosqlite.Row | None:
-    cur = await conn.execute("SELECT * FROM ui_state WHERE user_id=?", (user_id,))
-    return await cur.fetchone()
+    payload — dict (хранится как JSON) или уже закодированные bytes
+    (payload_blob, например доска игры). render_hash — хэш того, что сейчас
+    показано в сообщении (см. ui.render_hash); None — неизвестно.
+    """
+    if isinstance(payload, bytes):
+        payload_json, payload_blob = None, payload
+    else:
+        payload_json, payload_blob = json.dumps(payload or {}, ensure_ascii=False), None
+    current = await get_ui_state(conn, user_id)
+    if (
+        current is not None
+        and int(current["chat_id"]) == chat_id
+        and int(current["message_id"]) == message_id
+        and current["screen"] == screen
+        and current["payload_json"] == payload_json
+        and current.get("payload_blob") == payload_blob
+        and current.get("render_hash") == render_hash
+    ):
+        return
+    state = {
+        "user_id": user_id,
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "screen": screen,
+        "payload_json": payload_json,
+        "payload_blob": payload_blob,
+        "render_hash": render_hash,
+        "updated_at": now_ts(),
+    }
+    ui_state_cache.put(user_id, state)
+    # в очередь записи — после коммита апдейта: строка users нового
+    # пользователя до него ещё не видна
+    conn.after_commit(lambda: ui_state_cache.mark_dirty(user_id, state))
+    conn.stage(("ui_state", user_id), state)
+    ctx = _staged_ctx(conn, user_id)
+    if ctx is not None:
+        ctx.ui_state = state
+
+
+async def get_ui_state(conn: Database, user_id: int) -> dict[str, Any] | None:
+    # ui_state пишется только через set_ui_state, поэтому актуальное состояние
+    # видно через staged / ui_state_cache, и сбрасывать остальные записи
+    # единицы работы не нужно. None — «строки нет».
+    staged = conn.staged(("ui_state", user_id))
+    if staged is MISSING:
+        staged = ui_state_cache.get(user_id)
+    if staged is not MISSING:
+        return dict(staged) if staged is not None else None
+    row = await _fetchone(conn, "SELECT * FROM ui_state WHERE user_id=?", (user_id,), own_writes=False)
+    state = dict(row) if row else None
+    ui_state_cache.put(user_id, state)
+    return dict(state) if state is not None else None
+
+
+async def flush_ui_state(conn: Database) -> int:
+    """
+    Записывает изменённые состояния из ui_state_cache одним executemany.
+    Пользователи, которых уже нет в users, пропускаются. Возвращает число записей.
+    """
+    states = ui_state_cache.drain()
+    if not states:
+        return 0
+    try:
+        await conn.write_many(
+            """
+            INSERT INTO ui_state(user_id, chat_id, message_id, screen, payload_json, payload_blob, render_hash, updated_at)
+            SELECT ?, ?, ?, ?, ?, ?, ?, ?
+            WHERE EXISTS(SELECT 1 FROM users WHERE user_id=?)
+            ON CONFLICT(user_id) DO UPDATE SET
+              chat_id=excluded.chat_id,
+              message_id=excluded.message_id,
+              screen=excluded.screen,
+              payload_json=excluded.payload_json,
+              payload_blob=excluded.payload_blob,
+              render_hash=excluded.render_hash,
+              updated_at=excluded.updated_at
+            """,
+            [
+                (
+                    s["user_id"], s["chat_id"], s["message_id"],
+                    s["screen"], s["payload_json"], s.get("payload_blob"), s.get("render_hash"),
+                    s["updated_at"], s["user_id"],
+                )
+                for s in states
+            ],
+        )
+    except BaseException:
+        ui_state_cache.restore(states)
+        raise
+    return len(states)
 
 
 async def set_inventory_status(
-    conn: aiosqlite.Connection,
+    conn: Database,
     inventory_id: int,
     status: str,
     *,
@@ -331,18 +613,18 @@ async def set_inventory_status(
         fields.append("withdrawn_at=?")
         params.append(ts)
     params.append(inventory_id)
-    await conn.execute(
+    await conn.write(
         f"UPDATE inventory SET {', '.join(fields)} WHERE id=?",
         params,
     )
-    await conn.commit()
 
 
-async def get_unrewarded_task_sponsors(conn: aiosqlite.Connection, user_id: int) -> list[aiosqlite.Row]:
+async def get_unrewarded_task_sponsors(conn: Database, user_id: int) -> list[aiosqlite.Row]:
     """
     Список активных спонсоров-заданий, по которым ещё не был выдан бонус user_id.
     """
-    cur = await conn.execute(
+    return await _fetchall(
+        conn,
         """
         SELECT s.*
         FROM sponsors s
@@ -353,12 +635,11 @@ async def get_unrewarded_task_sponsors(conn: aiosqlite.Connection, user_id: int)
         """,
         (user_id,),
     )
-    return list(await cur.fetchall())
 
 
-async def mark_sponsor_bonus_granted(conn: aiosqlite.Connection, user_id: int, sponsor_id: int, attempts: int) -> None:
+async def mark_sponsor_bonus_granted(conn: Database, user_id: int, sponsor_id: int, attempts: int) -> None:
     ts = now_ts()
-    await conn.execute(
+    await conn.write(
         """
         INSERT INTO sponsor_bonus_grants(user_id, sponsor_id, granted_attempts, granted_at)
         VALUES(?, ?, ?, ?)
@@ -370,11 +651,10 @@ async def mark_sponsor_bonus_granted(conn: aiosqlite.Connection, user_id: int, s
         """,
         (user_id, sponsor_id, attempts, ts),
     )
-    await conn.commit()
 
 
 async def update_gift(
-    conn: aiosqlite.Connection,
+    conn: Database,
     gift_id: int,
     *,
     title: str,
@@ -383,7 +663,7 @@ async def update_gift(
     emoji: str | None,
     is_active: int,
 ) -> None:
-    await conn.execute(
+    await conn.write(
         """
         UPDATE gifts
         SET title=?, price=?, drop_chance=?, emoji=?, is_active=?
@@ -391,12 +671,12 @@ async def update_gift(
         """,
         (title, price, drop_chance, emoji, is_active, gift_id),
     )
-    await conn.commit()
+    invalidate_catalog(conn)
 
 
-async def delete_gift(conn: aiosqlite.Connection, gift_id: int) -> None:
-    await conn.execute("DELETE FROM gifts WHERE id=?", (gift_id,))
-    await conn.commit()
+async def delete_gift(conn: Database, gift_id: int) -> None:
+    await conn.write("DELETE FROM gifts WHERE id=?", (gift_id,))
+    invalidate_catalog(conn)
 
 
 # ---- Reminders / follow-ups ----
@@ -426,64 +706,109 @@ def _reminder_delay_for_stage(stage: int, first_sequence_done: bool) -> int:
     return REMINDER_STAGE_DELAYS[stage]
 
 
-async def touch_user_activity(conn: aiosqlite.Connection, user_id: int) -> None:
+def _reminder_delay_sql(stage: str, first_sequence_done: str) -> str:
+    """SQL-аналог _reminder_delay_for_stage для выражений stage / first_sequence_done."""
+    whens = " ".join(
+        f"WHEN {stage} <= {i} THEN {d}" for i, d in enumerate(REMINDER_STAGE_DELAYS[:-1])
+    )
+    return (
+        f"(CASE WHEN {first_sequence_done} THEN {72 * 60 * 60} "
+        f"{whens} ELSE {REMINDER_STAGE_DELAYS[-1]} END)"
+    )
+
+
+async def touch_user_activity(conn: Database, user_id: int) -> None:
     """
-    Обновляет last_activity_ts пользователя и пересчитывает next_reminder_ts.
-    Вызывается при любом взаимодействии с ботом.
+    Отмечает активность пользователя (любое взаимодействие с ботом).
+    last_activity_ts/next_reminder_ts пишутся не сразу, а через
+    activity_buffer — пачкой в flush_user_activity; срок в ReminderSchedule
+    сдвигается сразу (цикл напоминаний сбрасывает буфер перед чтением БД).
     """
     now = now_ts()
-    # если пользователя ещё нет в таблице users (новый /start до upsert_user) — ничего не делаем
-    cur = await conn.execute("SELECT 1 FROM users WHERE user_id=?", (user_id,))
-    if not await cur.fetchone():
+    ctx = _staged_ctx(conn, user_id)
+    if ctx is not None and not ctx.exists:
+        # строка не вставится (пользователя нет в users) — и в расписание не ставим
         return
-    cur = await conn.execute(
-        "SELECT stage, first_sequence_done FROM user_reminders WHERE user_id=?",
-        (user_id,),
-    )
-    row = await cur.fetchone()
-    if not row:
-        stage = 0
-        first_done = False
+    if ctx is not None and ctx.reminder_stage is not None:
+        next_ts = now + _reminder_delay_for_stage(ctx.reminder_stage, ctx.first_sequence_done)
     else:
-        stage = int(row["stage"])
-        first_done = bool(row["first_sequence_done"])
-    delay = _reminder_delay_for_stage(stage, first_done)
-    next_ts = now + delay
-    await conn.execute(
-        """
-        INSERT INTO user_reminders(user_id, last_activity_ts, next_reminder_ts, stage, first_sequence_done)
-        VALUES(?, ?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-          last_activity_ts=excluded.last_activity_ts,
-          next_reminder_ts=excluded.next_reminder_ts
-        """,
-        (user_id, now, next_ts, stage, 1 if first_done else 0),
+        # стадия неизвестна — ставим самый ранний возможный срок, строка перепроверится
+        next_ts = now + min(REMINDER_STAGE_DELAYS)
+    # новый пользователь появится в users только с коммитом апдейта — до него
+    # сброс буфера не нашёл бы строку
+    conn.after_commit(lambda: activity_buffer.touch(user_id, now))
+    _schedule_reminder(conn, user_id, next_ts)
+
+
+async def flush_user_activity(conn: Database) -> int:
+    """
+    Записывает накопленную в activity_buffer активность одним executemany:
+    last_activity_ts и next_reminder_ts по текущей стадии. Пользователи,
+    которых нет в users, пропускаются. Возвращает число записей.
+    """
+    items = activity_buffer.drain()
+    if not items:
+        return 0
+    delay = _reminder_delay_sql("COALESCE(ur.stage, 0)", "COALESCE(ur.first_sequence_done, 0)")
+    try:
+        await conn.write_many(
+            f"""
+            INSERT INTO user_reminders(user_id, last_activity_ts, next_reminder_ts, stage, first_sequence_done)
+            SELECT u.user_id, ?, ? + {delay}, COALESCE(ur.stage, 0), COALESCE(ur.first_sequence_done, 0)
+            FROM users u
+            LEFT JOIN user_reminders ur ON ur.user_id = u.user_id
+            WHERE u.user_id = ?
+            ON CONFLICT(user_id) DO UPDATE SET
+              last_activity_ts=excluded.last_activity_ts,
+              next_reminder_ts=excluded.next_reminder_ts
+            """,
+            [(ts, ts, user_id) for user_id, ts in items],
+        )
+    except BaseException:
+        activity_buffer.restore(items)
+        raise
+    return len(items)
+
+
+def _schedule_reminder(conn: Database, user_id: int, next_ts: int | None) -> None:
+    # в кучу — только после коммита, иначе цикл может прочитать старую строку
+    conn.after_commit(lambda: reminder_schedule.set(user_id, next_ts))
+
+
+async def list_reminder_schedule(conn: Database) -> list[tuple[int, int]]:
+    """(user_id, next_reminder_ts) всех активных напоминаний — для загрузки ReminderSchedule."""
+    rows = await _fetchall(
+        conn,
+        "SELECT user_id, next_reminder_ts FROM user_reminders WHERE next_reminder_ts IS NOT NULL",
     )
-    await conn.commit()
+    return [(int(r["user_id"]), int(r["next_reminder_ts"])) for r in rows]
 
 
-async def get_due_reminders(conn: aiosqlite.Connection, now_time: int) -> list[aiosqlite.Row]:
+async def get_due_reminders(conn: Database, user_ids: Sequence[int]) -> list[aiosqlite.Row]:
     """
-    Возвращает пользователей, для которых пора отправить напоминание.
+    Строки напоминаний для пользователей, извлечённых из ReminderSchedule.
+    Возвращаются все активные (next_reminder_ts не NULL) — срок проверяет
+    вызывающий: запись в куче могла оказаться раньше срока в БД.
     """
-    cur = await conn.execute(
-        """
-        SELECT ur.*, u.username, u.first_name, u.is_banned
+    if not user_ids:
+        return []
+    marks = ",".join("?" * len(user_ids))
+    return await _fetchall(
+        conn,
+        f"""
+        SELECT ur.*, u.username, u.first_name, u.is_banned,
+               EXISTS(SELECT 1 FROM inventory i WHERE i.user_id = ur.user_id) AS has_gifts
         FROM user_reminders ur
         JOIN users u ON u.user_id = ur.user_id
-        WHERE ur.next_reminder_ts IS NOT NULL
-          AND ur.next_reminder_ts <= ?
+        WHERE ur.user_id IN ({marks})
+          AND ur.next_reminder_ts IS NOT NULL
         """,
-        (now_time,),
+        tuple(user_ids),
     )
-    return list(await cur.fetchall())
 
 
-async def advance_reminder_stage(conn: aiosqlite.Connection, user_id: int, current_stage: int, first_sequence_done: bool) -> None:
-    """
-    Переводит пользователя на следующую стадию напоминаний и выставляет next_reminder_ts.
-    """
-    now = now_ts()
+def _next_reminder_stage(current_stage: int, first_sequence_done: bool, now: int) -> tuple[int, bool, int]:
+    """(stage, first_sequence_done, next_reminder_ts) после отправки очередного напоминания."""
     stage = current_stage
     first_done = first_sequence_done
 
@@ -494,26 +819,44 @@ async def advance_reminder_stage(conn: aiosqlite.Connection, user_id: int, curre
             first_done = True
 
     delay = _reminder_delay_for_stage(stage, first_done)
-    next_ts = now + delay
+    return stage, first_done, now + delay
 
-    await conn.execute(
+
+async def advance_reminder_stages(conn: Database, items: Sequence[tuple[int, int, bool]]) -> None:
+    """
+    Переводит пачку (user_id, current_stage, first_sequence_done) на следующую
+    стадию напоминаний и выставляет next_reminder_ts одним executemany.
+    """
+    if not items:
+        return
+    now = now_ts()
+    params: list[tuple[int, int, int, int]] = []
+    for user_id, current_stage, first_sequence_done in items:
+        stage, first_done, next_ts = _next_reminder_stage(current_stage, first_sequence_done, now)
+        params.append((stage, 1 if first_done else 0, next_ts, user_id))
+    await conn.write_many(
         """
         UPDATE user_reminders
-        SET stage=?, first_sequence_done=?, next_reminder_ts=?, last_activity_ts=last_activity_ts
+        SET stage=?, first_sequence_done=?, next_reminder_ts=?
         WHERE user_id=?
         """,
-        (stage, 1 if first_done else 0, next_ts, user_id),
+        params,
     )
-    await conn.commit()
+    for _, _, next_ts, user_id in params:
+        _schedule_reminder(conn, user_id, next_ts)
 
 
-async def stop_reminders(conn: aiosqlite.Connection, user_id: int) -> None:
-    """Отключает напоминания пользователю (например, если он выиграл подарок)."""
-    await conn.execute(
-        "UPDATE user_reminders SET next_reminder_ts=NULL, first_sequence_done=1 WHERE user_id=?",
-        (user_id,),
+async def stop_reminders_many(conn: Database, user_ids: Sequence[int]) -> None:
+    """Отключает напоминания пачке пользователей одним UPDATE (например, выигравшим подарок)."""
+    if not user_ids:
+        return
+    marks = ",".join("?" * len(user_ids))
+    await conn.write(
+        f"UPDATE user_reminders SET next_reminder_ts=NULL, first_sequence_done=1 WHERE user_id IN ({marks})",
+        tuple(user_ids),
     )
-    await conn.commit()
+    for user_id in user_ids:
+        _schedule_reminder(conn, user_id, None)
 
 
 # ---------- JOIN REQUESTS ----------
@@ -521,10 +864,10 @@ async def stop_reminders(conn: aiosqlite.Connection, user_id: int) -> None:
 REQUEST_TTL_SECONDS = 24 * 60 * 60
 
 
-async def save_join_request(conn: aiosqlite.Connection, user_id: int, chat_id: int) -> None:
+async def save_join_request(conn: Database, user_id: int, chat_id: int) -> None:
     """Сохраняет заявку на вступление в канал."""
     ts = now_ts()
-    await conn.execute(
+    await conn.write(
         """
         INSERT INTO join_requests(user_id, chat_id, ts) 
         VALUES(?, ?, ?)
@@ -532,19 +875,208 @@ async def save_join_request(conn: aiosqlite.Connection, user_id: int, chat_id: i
         """,
         (user_id, chat_id, ts),
     )
-    await conn.commit()
 
 
-async def has_fresh_join_request(conn: aiosqlite.Connection, user_id: int, chat_id: int) -> bool:
+async def has_fresh_join_request(conn: Database, user_id: int, chat_id: int) -> bool:
     """Проверяет, есть ли свежая заявка на вступление (не старше REQUEST_TTL_SECONDS)."""
-    cur = await conn.execute(
+    row = await _fetchone(
+        conn,
         "SELECT ts FROM join_requests WHERE user_id=? AND chat_id=?",
         (user_id, chat_id),
     )
-    row = await cur.fetchone()
     if not row:
         return False
     ts = int(row["ts"])
     return (now_ts() - ts) <= REQUEST_TTL_SECONDS
 
 
+# ---- Channel membership (chat_member updates) ----
+
+
+async def set_channel_membership(conn: Database, user_id: int, chat_id: int, status: str, ts: int) -> None:
+    """Сохраняет статус участника; более старое событие не перетирает новое."""
+    await conn.write(
+        """
+        INSERT INTO channel_membership(user_id, chat_id, status, ts)
+        VALUES(?, ?, ?, ?)
+        ON CONFLICT(user_id, chat_id) DO UPDATE SET status=excluded.status, ts=excluded.ts
+        WHERE excluded.ts >= channel_membership.ts
+        """,
+        (user_id, chat_id, status, ts),
+    )
+
+
+async def get_channel_membership(conn: Database, user_id: int, chat_id: int) -> str | None:
+    row = await _fetchone(
+        conn,
+        "SELECT status FROM channel_membership WHERE user_id=? AND chat_id=?",
+        (user_id, chat_id),
+    )
+    return str(row["status"]) if row else None
+
+
+# ---- Broadcasts ----
+
+
+async def count_broadcast_recipients(conn: Database) -> int:
+    row = await _fetchone(
+        conn,
+        "SELECT COUNT(1) AS c FROM users WHERE (is_banned=0 OR is_banned IS NULL) AND is_reachable=1",
+    )
+    return int(row["c"]) if row else 0
+
+
+async def create_broadcast(conn: Database, admin_id: int, chat_id: int, text: str, total: int) -> int:
+    row = await conn.write_returning(
+        """
+        INSERT INTO broadcasts(admin_id, chat_id, text, total, created_at)
+        VALUES(?, ?, ?, ?, ?)
+        RETURNING id
+        """,
+        (admin_id, chat_id, text, total, now_ts()),
+    )
+    return int(row["id"])
+
+
+async def set_broadcast_progress_message(conn: Database, broadcast_id: int, message_id: int) -> None:
+    await conn.write(
+        "UPDATE broadcasts SET progress_message_id=? WHERE id=?",
+        (message_id, broadcast_id),
+    )
+
+
+async def get_broadcast(conn: Database, broadcast_id: int) -> aiosqlite.Row | None:
+    return await _fetchone(conn, "SELECT * FROM broadcasts WHERE id=?", (broadcast_id,))
+
+
+async def list_running_broadcasts(conn: Database) -> list[aiosqlite.Row]:
+    return await _fetchall(conn, "SELECT * FROM broadcasts WHERE status='running' ORDER BY id")
+
+
+async def list_broadcast_recipients(conn: Database, broadcast_id: int, after_user_id: int, limit: int) -> list[int]:
+    """
+    Следующая страница получателей по ключу user_id > after_user_id
+    (без OFFSET); уже обработанные в этой рассылке пропускаются.
+    """
+    rows = await _fetchall(
+        conn,
+        """
+        SELECT u.user_id FROM users u
+        WHERE u.user_id > ?
+          AND (u.is_banned=0 OR u.is_banned IS NULL)
+          AND u.is_reachable=1
+          AND NOT EXISTS (
+            SELECT 1 FROM broadcast_deliveries d
+            WHERE d.broadcast_id=? AND d.user_id=u.user_id
+          )
+        ORDER BY u.user_id
+        LIMIT ?
+        """,
+        (after_user_id, broadcast_id, limit),
+    )
+    return [int(r["user_id"]) for r in rows]
+
+
+async def record_broadcast_deliveries(
+    conn: Database, broadcast_id: int, results: Sequence[tuple[int, str, str | None]]
+) -> None:
+    """
+    results: (user_id, 'sent' | 'failed' | 'unreachable', error). Пишется одной
+    транзакцией со счётчиками; 'unreachable' ещё и помечает пользователя.
+    """
+    if not results:
+        return
+    ts = now_ts()
+    sent = sum(1 for _, status, _ in results if status == "sent")
+    async with conn.unit_of_work():
+        await conn.write_many(
+            """
+            INSERT OR IGNORE INTO broadcast_deliveries(broadcast_id, user_id, status, error, ts)
+            VALUES(?, ?, ?, ?, ?)
+            """,
+            [(broadcast_id, uid, status, error, ts) for uid, status, error in results],
+        )
+        await conn.write(
+            "UPDATE broadcasts SET sent=sent+?, failed=failed+? WHERE id=?",
+            (sent, len(results) - sent, broadcast_id),
+        )
+        await mark_users_unreachable(conn, [uid for uid, status, _ in results if status == "unreachable"])
+
+
+async def set_broadcast_cursor(conn: Database, broadcast_id: int, cursor_user_id: int) -> None:
+    await conn.write(
+        "UPDATE broadcasts SET cursor_user_id=? WHERE id=? AND cursor_user_id<?",
+        (cursor_user_id, broadcast_id, cursor_user_id),
+    )
+
+
+async def finish_broadcast(conn: Database, broadcast_id: int, status: str) -> None:
+    await conn.write(
+        "UPDATE broadcasts SET status=?, finished_at=? WHERE id=? AND status='running'",
+        (status, now_ts(), broadcast_id),
+    )
+
+
+# ---- Game sessions ----
+
+
+async def get_last_game_session(conn: Database, user_id: int) -> aiosqlite.Row | None:
+    """Последняя (ещё не архивированная) игра пользователя: id, state, finished_at."""
+    return await _fetchone(
+        conn,
+        "SELECT id, state, finished_at FROM game_sessions WHERE user_id=? ORDER BY id DESC LIMIT 1",
+        (user_id,),
+    )
+
+
+async def create_game_session(conn: Database, user_id: int, state: bytes, *, finished: bool = False) -> int:
+    """Начинает новую игру; предыдущая незавершённая закрывается в той же транзакции."""
+    now = now_ts()
+    async with conn.transaction():
+        await conn.write(
+            "UPDATE game_sessions SET finished_at=? WHERE user_id=? AND finished_at IS NULL",
+            (now, user_id),
+        )
+        row = await conn.write_returning(
+            "INSERT INTO game_sessions(user_id, state, created_at, finished_at) VALUES(?, ?, ?, ?) RETURNING id",
+            (user_id, state, now, now if finished else None),
+        )
+    return int(row["id"])
+
+
+async def save_game_session(conn: Database, session_id: int, state: bytes, *, finished: bool = False) -> None:
+    await conn.write(
+        "UPDATE game_sessions SET state=?, finished_at=? WHERE id=? AND finished_at IS NULL",
+        (state, now_ts() if finished else None, session_id),
+    )
+
+
+async def archive_game_sessions(conn: Database, finished_before: int, limit: int) -> int:
+    """
+    Переносит до limit сессий, завершённых раньше finished_before, в
+    game_sessions_archive. Возвращает число перенесённых.
+    """
+    rows = await _fetchall(
+        conn,
+        """
+        SELECT id FROM game_sessions
+        WHERE finished_at IS NOT NULL AND finished_at < ?
+        ORDER BY finished_at LIMIT ?
+        """,
+        (finished_before, limit),
+    )
+    ids = [int(r["id"]) for r in rows]
+    if not ids:
+        return 0
+    placeholders = ",".join("?" * len(ids))
+    async with conn.unit_of_work():
+        await conn.write(
+            f"""
+            INSERT OR REPLACE INTO game_sessions_archive(id, user_id, state, created_at, finished_at)
+            SELECT id, user_id, state, created_at, finished_at
+            FROM game_sessions WHERE id IN ({placeholders})
+            """,
+            ids,
+        )
+        await conn.write(f"DELETE FROM game_sessions WHERE id IN ({placeholders})", ids)
+    return len(ids)
@@ -2,22 +2,27 @@ from __future__ import annotations
 
 import re
 
-import aiosqlite
 from aiogram import F, Router
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message, InlineKeyboardButton, InlineKeyboardMarkup
 
+from ..broadcast import start_broadcast, stop_broadcast
 from ..config import Config
+from ..db import Database
 from ..keyboards import kb_admin_menu, kb_admin_back
 from ..repo import (
     add_attempts,
+    add_gift,
+    add_start_sponsor,
+    add_task_sponsor,
     delete_gift,
     delete_start_sponsor,
     delete_task_sponsor,
     get_gift,
     get_start_sponsor,
+    get_stats,
     get_task_sponsor,
     list_gifts,
     list_start_sponsors,
@@ -31,6 +36,7 @@ from ..repo import (
     upsert_user,
 )
 from ..ui import edit_or_recreate
+from ..update_executor import UpdateExecutor
 
 router = Router(name="admin")
 
@@ -58,7 +64,7 @@ def _bool_emoji(v: int) -> str:
 
 
 @router.message(Command("admin"))
-async def admin_cmd(message: Message, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_cmd(message: Message, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not message.from_user:
         return
     if not _is_admin(config, message.from_user.id):
@@ -76,7 +82,7 @@ async def admin_cmd(message: Message, bot, conn: aiosqlite.Connection, config: C
 
 
 @router.callback_query(F.data == "admin:menu")
-async def admin_menu_cb(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_menu_cb(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -94,7 +100,7 @@ async def admin_menu_cb(cb: CallbackQuery, bot, conn: aiosqlite.Connection, conf
 
 
 @router.callback_query(F.data == "admin:broadcast")
-async def admin_broadcast(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_broadcast(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -117,7 +123,7 @@ async def admin_broadcast(cb: CallbackQuery, bot, conn: aiosqlite.Connection, co
 
 
 @router.callback_query(F.data == "admin:add_start_sponsor")
-async def admin_add_start_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_add_start_sponsor(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -144,7 +150,7 @@ async def admin_add_start_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Connec
 
 
 @router.message(AdminFlow.add_start_sponsor)
-async def admin_add_start_sponsor_msg(message: Message, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_add_start_sponsor_msg(message: Message, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not message.from_user or not _is_admin(config, message.from_user.id):
         return
     parts = [p.strip() for p in (message.text or "").split("|")]
@@ -163,11 +169,14 @@ async def admin_add_start_sponsor_msg(message: Message, bot, conn: aiosqlite.Con
         return
     username = parts[3] if len(parts) >= 4 and parts[3] else None
     invite_link = parts[4] if len(parts) >= 5 and parts[4] else None
-    await conn.execute(
-        "INSERT INTO start_sponsors(title, type, channel_id, channel_username, invite_link, is_active) VALUES(?, ?, ?, ?, ?, 1)",
-        (title, type_, channel_id, username, invite_link),
+    await add_start_sponsor(
+        conn,
+        title=title,
+        type_=type_,
+        channel_id=channel_id,
+        channel_username=username,
+        invite_link=invite_link,
     )
-    await conn.commit()
     await state.clear()
     await message.answer(
         "✅ Старт-спонсор добавлен. Открой /admin для продолжения.",
@@ -180,7 +189,7 @@ async def admin_add_start_sponsor_msg(message: Message, bot, conn: aiosqlite.Con
 
 
 @router.callback_query(F.data == "admin:add_task_sponsor")
-async def admin_add_task_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_add_task_sponsor(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -207,7 +216,7 @@ async def admin_add_task_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Connect
 
 
 @router.message(AdminFlow.add_task_sponsor)
-async def admin_add_task_sponsor_msg(message: Message, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_add_task_sponsor_msg(message: Message, conn: Database, config: Config, state: FSMContext) -> None:
     if not message.from_user or not _is_admin(config, message.from_user.id):
         return
     parts = [p.strip() for p in (message.text or "").split("|")]
@@ -231,11 +240,15 @@ async def admin_add_task_sponsor_msg(message: Message, conn: aiosqlite.Connectio
         return
     username = parts[4] if len(parts) >= 5 and parts[4] else None
     invite_link = parts[5] if len(parts) >= 6 and parts[5] else None
-    await conn.execute(
-        "INSERT INTO sponsors(title, type, channel_id, bonus_attempts, channel_username, invite_link, is_active) VALUES(?, ?, ?, ?, ?, ?, 1)",
-        (title, type_, channel_id, bonus_attempts, username, invite_link),
+    await add_task_sponsor(
+        conn,
+        title=title,
+        type_=type_,
+        channel_id=channel_id,
+        channel_username=username,
+        invite_link=invite_link,
+        bonus_attempts=bonus_attempts,
     )
-    await conn.commit()
     await state.clear()
     await message.answer(
         "✅ Спонсор (задание) добавлен. Открой /admin для продолжения.",
@@ -248,7 +261,7 @@ async def admin_add_task_sponsor_msg(message: Message, conn: aiosqlite.Connectio
 
 
 @router.callback_query(F.data == "admin:add_gift")
-async def admin_add_gift(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_add_gift(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -266,7 +279,7 @@ async def admin_add_gift(cb: CallbackQuery, bot, conn: aiosqlite.Connection, con
 
 
 @router.message(AdminFlow.add_gift)
-async def admin_add_gift_msg(message: Message, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_add_gift_msg(message: Message, conn: Database, config: Config, state: FSMContext) -> None:
     if not message.from_user or not _is_admin(config, message.from_user.id):
         return
     parts = [p.strip() for p in (message.text or "").split("|")]
@@ -276,11 +289,7 @@ async def admin_add_gift_msg(message: Message, conn: aiosqlite.Connection, confi
     title = parts[0]
     price = int(parts[1])
     chance = float(parts[2])
-    await conn.execute(
-        "INSERT INTO gifts(title, price, drop_chance, is_active) VALUES(?, ?, ?, 1)",
-        (title, price, chance),
-    )
-    await conn.commit()
+    await add_gift(conn, title=title, price=price, drop_chance=chance)
     await state.clear()
     await message.answer(
         "✅ Подарок добавлен. Открой /admin для продолжения.",
@@ -293,7 +302,7 @@ async def admin_add_gift_msg(message: Message, conn: aiosqlite.Connection, confi
 
 
 @router.callback_query(F.data == "admin:list_start_sponsors")
-async def admin_list_start_sponsors(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config) -> None:
+async def admin_list_start_sponsors(cb: CallbackQuery, bot, conn: Database, config: Config) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -324,7 +333,7 @@ async def admin_list_start_sponsors(cb: CallbackQuery, bot, conn: aiosqlite.Conn
 
 
 @router.callback_query(F.data.startswith("admin:start_sponsor:"))
-async def admin_start_sponsor_detail(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_start_sponsor_detail(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -379,7 +388,7 @@ async def admin_start_sponsor_detail(cb: CallbackQuery, bot, conn: aiosqlite.Con
 
 
 @router.callback_query(F.data.startswith("admin:edit_start_sponsor:"))
-async def admin_edit_start_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_edit_start_sponsor(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -414,7 +423,7 @@ async def admin_edit_start_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Conne
 
 
 @router.callback_query(F.data.startswith("admin:toggle_start_sponsor:"))
-async def admin_toggle_start_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_toggle_start_sponsor(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -443,7 +452,7 @@ async def admin_toggle_start_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Con
 
 
 @router.callback_query(F.data.startswith("admin:delete_start_sponsor:"))
-async def admin_delete_start_sponsor_cb(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config) -> None:
+async def admin_delete_start_sponsor_cb(cb: CallbackQuery, bot, conn: Database, config: Config) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer("Удалено.", show_alert=False)
@@ -457,7 +466,7 @@ async def admin_delete_start_sponsor_cb(cb: CallbackQuery, bot, conn: aiosqlite.
 
 
 @router.callback_query(F.data == "admin:list_task_sponsors")
-async def admin_list_task_sponsors_cb(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config) -> None:
+async def admin_list_task_sponsors_cb(cb: CallbackQuery, bot, conn: Database, config: Config) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -489,7 +498,7 @@ async def admin_list_task_sponsors_cb(cb: CallbackQuery, bot, conn: aiosqlite.Co
 
 
 @router.callback_query(F.data.startswith("admin:task_sponsor:"))
-async def admin_task_sponsor_detail(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config) -> None:
+async def admin_task_sponsor_detail(cb: CallbackQuery, bot, conn: Database, config: Config) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -545,7 +554,7 @@ async def admin_task_sponsor_detail(cb: CallbackQuery, bot, conn: aiosqlite.Conn
 
 
 @router.callback_query(F.data.startswith("admin:edit_task_sponsor:"))
-async def admin_edit_task_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_edit_task_sponsor(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -580,7 +589,7 @@ async def admin_edit_task_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Connec
 
 
 @router.callback_query(F.data.startswith("admin:toggle_task_sponsor:"))
-async def admin_toggle_task_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config) -> None:
+async def admin_toggle_task_sponsor(cb: CallbackQuery, bot, conn: Database, config: Config) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -610,7 +619,7 @@ async def admin_toggle_task_sponsor(cb: CallbackQuery, bot, conn: aiosqlite.Conn
 
 
 @router.callback_query(F.data.startswith("admin:delete_task_sponsor:"))
-async def admin_delete_task_sponsor_cb(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config) -> None:
+async def admin_delete_task_sponsor_cb(cb: CallbackQuery, bot, conn: Database, config: Config) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer("Удалено.", show_alert=False)
@@ -623,7 +632,7 @@ async def admin_delete_task_sponsor_cb(cb: CallbackQuery, bot, conn: aiosqlite.C
 
 
 @router.callback_query(F.data == "admin:set_global_chance")
-async def admin_set_global_chance(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_set_global_chance(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -641,7 +650,7 @@ async def admin_set_global_chance(cb: CallbackQuery, bot, conn: aiosqlite.Connec
 
 
 @router.message(AdminFlow.set_global_chance)
-async def admin_set_global_chance_msg(message: Message, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_set_global_chance_msg(message: Message, conn: Database, config: Config, state: FSMContext) -> None:
     if not message.from_user or not _is_admin(config, message.from_user.id):
         return
     try:
@@ -663,7 +672,7 @@ async def admin_set_global_chance_msg(message: Message, conn: aiosqlite.Connecti
 
 
 @router.callback_query(F.data == "admin:set_stars_price")
-async def admin_set_stars_price(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_set_stars_price(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -685,7 +694,7 @@ async def admin_set_stars_price(cb: CallbackQuery, bot, conn: aiosqlite.Connecti
 
 
 @router.message(AdminFlow.set_stars_price)
-async def admin_set_stars_price_msg(message: Message, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_set_stars_price_msg(message: Message, conn: Database, config: Config, state: FSMContext) -> None:
     if not message.from_user or not _is_admin(config, message.from_user.id):
         return
     txt = (message.text or "").strip()
@@ -710,7 +719,7 @@ async def admin_set_stars_price_msg(message: Message, conn: aiosqlite.Connection
 
 
 @router.message(AdminFlow.edit_gift)
-async def admin_edit_gift_msg(message: Message, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_edit_gift_msg(message: Message, conn: Database, config: Config, state: FSMContext) -> None:
     from ..repo import update_gift, get_gift
 
     if not message.from_user or not _is_admin(config, message.from_user.id):
@@ -766,7 +775,7 @@ async def admin_edit_gift_msg(message: Message, conn: aiosqlite.Connection, conf
 
 
 @router.message(AdminFlow.edit_start_sponsor)
-async def admin_edit_start_sponsor_msg(message: Message, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_edit_start_sponsor_msg(message: Message, conn: Database, config: Config, state: FSMContext) -> None:
     from ..repo import update_start_sponsor, get_start_sponsor
 
     if not message.from_user or not _is_admin(config, message.from_user.id):
@@ -822,7 +831,7 @@ async def admin_edit_start_sponsor_msg(message: Message, conn: aiosqlite.Connect
 
 
 @router.message(AdminFlow.edit_task_sponsor)
-async def admin_edit_task_sponsor_msg(message: Message, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_edit_task_sponsor_msg(message: Message, conn: Database, config: Config, state: FSMContext) -> None:
     from ..repo import update_task_sponsor, get_task_sponsor
 
     if not message.from_user or not _is_admin(config, message.from_user.id):
@@ -884,7 +893,7 @@ async def admin_edit_task_sponsor_msg(message: Message, conn: aiosqlite.Connecti
 
 
 @router.callback_query(F.data == "admin:list_gifts")
-async def admin_list_gifts(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config) -> None:
+async def admin_list_gifts(cb: CallbackQuery, bot, conn: Database, config: Config) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -915,7 +924,7 @@ async def admin_list_gifts(cb: CallbackQuery, bot, conn: aiosqlite.Connection, c
 
 
 @router.callback_query(F.data.startswith("admin:gift:"))
-async def admin_gift_detail(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_gift_detail(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -960,7 +969,7 @@ async def admin_gift_detail(cb: CallbackQuery, bot, conn: aiosqlite.Connection,
 
 
 @router.callback_query(F.data.startswith("admin:edit_gift:"))
-async def admin_edit_gift(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_edit_gift(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -994,7 +1003,7 @@ async def admin_edit_gift(cb: CallbackQuery, bot, conn: aiosqlite.Connection, co
 
 
 @router.callback_query(F.data.startswith("admin:toggle_gift:"))
-async def admin_toggle_gift(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_toggle_gift(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -1022,7 +1031,7 @@ async def admin_toggle_gift(cb: CallbackQuery, bot, conn: aiosqlite.Connection,
 
 
 @router.callback_query(F.data.startswith("admin:delete_gift:"))
-async def admin_delete_gift_cb(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config) -> None:
+async def admin_delete_gift_cb(cb: CallbackQuery, bot, conn: Database, config: Config) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer("Удалено.", show_alert=False)
@@ -1035,7 +1044,7 @@ async def admin_delete_gift_cb(cb: CallbackQuery, bot, conn: aiosqlite.Connectio
 
 
 @router.callback_query(F.data == "admin:edit_user_attempts")
-async def admin_edit_user_attempts(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_edit_user_attempts(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -1053,7 +1062,7 @@ async def admin_edit_user_attempts(cb: CallbackQuery, bot, conn: aiosqlite.Conne
 
 
 @router.message(AdminFlow.edit_user_attempts)
-async def admin_edit_user_attempts_msg(message: Message, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_edit_user_attempts_msg(message: Message, conn: Database, config: Config, state: FSMContext) -> None:
     if not message.from_user or not _is_admin(config, message.from_user.id):
         return
     m = re.match(r"^\s*(\d+)\s+(-?\d+)\s*$", message.text or "")
@@ -1075,7 +1084,7 @@ async def admin_edit_user_attempts_msg(message: Message, conn: aiosqlite.Connect
 
 
 @router.callback_query(F.data == "admin:list_users")
-async def admin_list_users_cb(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config) -> None:
+async def admin_list_users_cb(cb: CallbackQuery, bot, conn: Database, config: Config) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -1104,7 +1113,7 @@ async def admin_list_users_cb(cb: CallbackQuery, bot, conn: aiosqlite.Connection
 
 
 @router.callback_query(F.data.startswith("admin:user:"))
-async def admin_user_detail(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_user_detail(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     from ..repo import get_user, get_user_attempts
 
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
@@ -1156,7 +1165,7 @@ async def admin_user_detail(cb: CallbackQuery, bot, conn: aiosqlite.Connection,
 
 
 @router.callback_query(F.data.startswith("admin:toggle_ban_user:"))
-async def admin_toggle_ban_user(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_toggle_ban_user(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     from ..repo import get_user
 
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
@@ -1176,7 +1185,7 @@ async def admin_toggle_ban_user(cb: CallbackQuery, bot, conn: aiosqlite.Connecti
 
 
 @router.callback_query(F.data.startswith("admin:edit_user:"))
-async def admin_edit_user(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_edit_user(cb: CallbackQuery, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
@@ -1202,50 +1211,32 @@ async def admin_edit_user(cb: CallbackQuery, bot, conn: aiosqlite.Connection, co
 
 
 @router.callback_query(F.data == "admin:stats")
-async def admin_stats(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config) -> None:
+async def admin_stats(
+    cb: CallbackQuery, bot, conn: Database, config: Config, executor: UpdateExecutor | None = None
+) -> None:
     if not cb.from_user or not cb.message or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer()
 
-    # простая агрегированная статистика по основным таблицам
-    cur = await conn.execute("SELECT COUNT(1) AS c FROM users")
-    users_total = int((await cur.fetchone())["c"])
-    cur = await conn.execute("SELECT COUNT(1) AS c FROM users WHERE is_banned=1")
-    users_banned = int((await cur.fetchone())["c"])
-    cur = await conn.execute("SELECT SUM(attempts) AS s FROM users")
-    attempts_sum_row = await cur.fetchone()
-    attempts_sum = int(attempts_sum_row["s"] or 0)
-
-    cur = await conn.execute("SELECT COUNT(1) AS c FROM gifts")
-    gifts_total = int((await cur.fetchone())["c"])
-    cur = await conn.execute("SELECT COUNT(1) AS c FROM gifts WHERE is_active=1")
-    gifts_active = int((await cur.fetchone())["c"])
-
-    cur = await conn.execute("SELECT COUNT(1) AS c FROM start_sponsors")
-    ss_total = int((await cur.fetchone())["c"])
-    cur = await conn.execute("SELECT COUNT(1) AS c FROM start_sponsors WHERE is_active=1")
-    ss_active = int((await cur.fetchone())["c"])
-
-    cur = await conn.execute("SELECT COUNT(1) AS c FROM sponsors")
-    ts_total = int((await cur.fetchone())["c"])
-    cur = await conn.execute("SELECT COUNT(1) AS c FROM sponsors WHERE is_active=1")
-    ts_active = int((await cur.fetchone())["c"])
-
-    cur = await conn.execute("SELECT COUNT(1) AS c FROM inventory")
-    inv_total = int((await cur.fetchone())["c"])
-    cur = await conn.execute("SELECT COUNT(1) AS c FROM inventory WHERE status='withdrawn'")
-    inv_withdrawn = int((await cur.fetchone())["c"])
+    # простая агрегированная статистика по основным таблицам (один запрос к читателю)
+    st = await get_stats(conn)
 
     text = (
         "📊 <b>Статистика бота</b>\n\n"
-        f"👥 Пользователи: <b>{users_total}</b>\n"
-        f"🚫 Забанено: <b>{users_banned}</b>\n"
-        f"🎮 Суммарно попыток: <b>{attempts_sum}</b>\n\n"
-        f"🎁 Подарки: всего <b>{gifts_total}</b>, активных <b>{gifts_active}</b>\n"
-        f"📦 Инвентарь: всего <b>{inv_total}</b>, выведено <b>{inv_withdrawn}</b>\n\n"
-        f"📢 Старт-спонсоры: всего <b>{ss_total}</b>, активных <b>{ss_active}</b>\n"
-        f"🎯 Спонсоры (задания): всего <b>{ts_total}</b>, активных <b>{ts_active}</b>\n"
+        f"👥 Пользователи: <b>{st['users_total']}</b>\n"
+        f"🚫 Забанено: <b>{st['users_banned']}</b>\n"
+        f"🎮 Суммарно попыток: <b>{st['attempts_sum']}</b>\n\n"
+        f"🎁 Подарки: всего <b>{st['gifts_total']}</b>, активных <b>{st['gifts_active']}</b>\n"
+        f"📦 Инвентарь: всего <b>{st['inv_total']}</b>, выведено <b>{st['inv_withdrawn']}</b>\n\n"
+        f"📢 Старт-спонсоры: всего <b>{st['ss_total']}</b>, активных <b>{st['ss_active']}</b>\n"
+        f"🎯 Спонсоры (задания): всего <b>{st['ts_total']}</b>, активных <b>{st['ts_active']}</b>\n"
     )
+    if executor is not None:
+        q = executor.stats()
+        text += (
+            f"\n⏳ Апдейты: в очереди <b>{q['queued']}</b>, в обработке <b>{q['running']}</b>\n"
+            f"Ожидание: среднее <b>{q['wait_avg']:.2f}</b> с, макс. <b>{q['wait_max']:.2f}</b> с\n"
+        )
     await edit_or_recreate(
         bot=bot,
         conn=conn,
@@ -1259,7 +1250,7 @@ async def admin_stats(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config
 
 
 @router.message(AdminFlow.edit_user)
-async def admin_edit_user_msg(message: Message, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_edit_user_msg(message: Message, conn: Database, config: Config, state: FSMContext) -> None:
     if not message.from_user or not _is_admin(config, message.from_user.id):
         return
     data = await state.get_data()
@@ -1287,7 +1278,7 @@ async def admin_edit_user_msg(message: Message, conn: aiosqlite.Connection, conf
 
 
 @router.message(AdminFlow.broadcast)
-async def admin_broadcast_msg(message: Message, bot, conn: aiosqlite.Connection, config: Config, state: FSMContext) -> None:
+async def admin_broadcast_msg(message: Message, bot, conn: Database, config: Config, state: FSMContext) -> None:
     if not message.from_user or not _is_admin(config, message.from_user.id):
         return
     text = (message.text or "").strip()
@@ -1295,43 +1286,29 @@ async def admin_broadcast_msg(message: Message, bot, conn: aiosqlite.Connection,
         await message.answer("Текст рассылки не может быть пустым.")
         return
 
-    # Получаем всех незабаненных пользователей
-    cur = await conn.execute(
-        "SELECT user_id FROM users WHERE is_banned=0 OR is_banned IS NULL"
-    )
-    rows = await cur.fetchall()
-    total = len(rows)
-    sent = 0
-
-    markup = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="✖ Закрыть", callback_data="admin:close_notice")]
-        ]
+    await state.clear()
+    # Рассылка идёт фоновым заданием: апдейт админа не ждёт отправки,
+    # прогресс обновляется в отдельном сообщении и переживает перезапуск
+    await start_broadcast(
+        bot,
+        conn,
+        admin_id=message.from_user.id,
+        chat_id=message.chat.id,
+        text=text,
     )
 
-    for r in rows:
-        uid = int(r["user_id"])
-        try:
-            await bot.send_message(
-                chat_id=uid,
-                text=text,
-                disable_web_page_preview=True,
-                reply_markup=markup,
-            )
-            sent += 1
-        except Exception:
-            # Игнорируем ошибки (бот заблокирован и т.п.)
-            continue
 
-    await state.clear()
-    await message.answer(
-        f"✅ Рассылка завершена. Успешно отправлено: <b>{sent}</b> из <b>{total}</b> пользователей.",
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="✖ Закрыть", callback_data="admin:close_notice")]
-            ]
-        ),
-    )
+@router.callback_query(F.data.startswith("admin:broadcast_stop:"))
+async def admin_broadcast_stop(cb: CallbackQuery, conn: Database, config: Config) -> None:
+    if not cb.from_user or not _is_admin(config, cb.from_user.id):
+        return
+    try:
+        broadcast_id = int(cb.data.split(":")[-1])
+    except Exception:
+        await cb.answer()
+        return
+    await stop_broadcast(conn, broadcast_id)
+    await cb.answer("Рассылка будет остановлена.")
 
 
 @router.callback_query(F.data == "admin:close_notice")
@@ -1345,7 +1322,7 @@ async def admin_close_notice(cb: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data.startswith("admin:withdraw_done:"))
-async def admin_withdraw_done(cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config) -> None:
+async def admin_withdraw_done(cb: CallbackQuery, bot, conn: Database, config: Config) -> None:
     if not cb.from_user or not _is_admin(config, cb.from_user.id):
         return
     await cb.answer("Статус обновлён.", show_alert=False)
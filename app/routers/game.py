@@ -1,44 +1,29 @@
 from __future__ import annotations
 
-import json
-import random
-from typing import Any
-
 import aiosqlite
 from aiogram import F, Router
 from aiogram.types import CallbackQuery
-from aiogram.types import InlineKeyboardMarkup
 
-from ..keyboards import kb_back_to_menu, kb_game_board, kb_game_controls
+from ..catalog import get_catalog
+from ..db import Database
+from ..game_sessions import load_game, save_game, start_game
+from ..game_state import CELL_COUNT, GameState
+from ..gift_sampler import get_gift_sampler
+from ..keyboards import kb_back_to_menu, kb_game_board, kb_game_screen
 from ..repo import (
-    add_attempts,
+    UserContext,
     add_inventory_item,
-    get_active_gifts,
+    consume_attempt,
     get_gift_count_active,
     get_setting_float,
-    get_ui_state,
-    get_user_attempts,
-    is_user_banned,
-    set_ui_state,
 )
 from ..ui import edit_or_recreate
+from ..user_locks import user_lock
 
 router = Router(name="game")
 
-GRID_SIZE = 6
-CELL_COUNT = GRID_SIZE * GRID_SIZE
-
-
-def _new_game_payload(cell_gifts: list[Any]) -> dict[str, Any]:
-    return {
-        "cells": [0] * CELL_COUNT,
-        "cell_gifts": cell_gifts,  # list[None | {"gift_id", "title", "emoji"}]
-        "pending_wins": [],  # list[{"gift_id": int, "title": str}]
-        "finished": False,
-    }
 
-
-def _render_text(attempts: int, pending: list[dict[str, Any]]) -> str:
+def _render_text(attempts: int, pending: list[int]) -> str:
     wins = len(pending)
     return (
         "Выиграйте подарок!\n\n"
@@ -50,74 +35,37 @@ def _render_text(attempts: int, pending: list[dict[str, Any]]) -> str:
     )
 
 
-def _pick_gift_weighted(gifts: list[aiosqlite.Row]) -> aiosqlite.Row:
-    weights = [max(0.0, float(g["drop_chance"])) for g in gifts]
-    total = sum(weights)
-    if total <= 0:
-        return random.choice(gifts)
-    r = random.random() * total
-    acc = 0.0
-    for g, w in zip(gifts, weights):
-        acc += w
-        if r <= acc:
-            return g
-    return gifts[-1]
-
-
-async def _load_game_payload(conn: aiosqlite.Connection, user_id: int) -> dict[str, Any]:
-    state = await get_ui_state(conn, user_id)
-    if not state or not state["payload_json"]:
-        # при отсутствии состояния создаём пустую доску без подарков
-        return _new_game_payload([None] * CELL_COUNT)
-    try:
-        payload = json.loads(state["payload_json"])
-        if "cells" not in payload or "pending_wins" not in payload or "cell_gifts" not in payload:
-            return _new_game_payload([None] * CELL_COUNT)
-        if not isinstance(payload["cells"], list) or len(payload["cells"]) != CELL_COUNT:
-            return _new_game_payload([None] * CELL_COUNT)
-        if not isinstance(payload["cell_gifts"], list) or len(payload["cell_gifts"]) != CELL_COUNT:
-            return _new_game_payload([None] * CELL_COUNT)
-        if "finished" not in payload:
-            payload["finished"] = False
-        return payload
-    except Exception:
-        return _new_game_payload([None] * CELL_COUNT)
-
-
-def _build_symbols(cells: list[int], cell_gifts: list[Any]) -> list[str]:
+async def _build_symbols(conn: Database, state: GameState) -> list[str]:
+    # эмодзи берём из каталога при отрисовке — в состоянии только gift_id
+    gifts_by_id = (await get_catalog(conn)).gifts_by_id
     symbols: list[str] = []
     for i in range(CELL_COUNT):
-        opened = cells[i] == 1
-        gift = cell_gifts[i]
-        if not opened:
+        if not state.is_open(i):
             symbols.append("⬜")
+            continue
+        gift_id = state.gift_at(i)
+        if gift_id is None:
+            symbols.append("❌")
         else:
-            if gift:
-                emoji = gift.get("emoji") or "🎁"
-                symbols.append(str(emoji))
-            else:
-                symbols.append("❌")
+            gift = gifts_by_id.get(gift_id)
+            symbols.append(str((gift["emoji"] if gift is not None else None) or "🎁"))
     return symbols
 
 
-async def _save_game_payload(conn: aiosqlite.Connection, user_id: int, chat_id: int, message_id: int, payload: dict[str, Any]) -> None:
-    await set_ui_state(conn, user_id, chat_id, message_id, "game:play", payload)
-
-
 @router.callback_query(F.data == "menu:play")
-async def open_game(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def open_game(cb: CallbackQuery, bot, conn: Database, user_ctx: UserContext) -> None:
     if not cb.from_user:
         return
     await cb.answer()
 
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
         )
         return
 
-    attempts = await get_user_attempts(conn, cb.from_user.id)
+    attempts = user_ctx.attempts
     if attempts <= 0:
         await edit_or_recreate(
             bot=bot,
@@ -136,25 +84,15 @@ async def open_game(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
         return
 
     # подготавливаем поле с подарками на клетках
-    gifts = await get_active_gifts(conn)
-    cell_gifts: list[Any] = [None] * CELL_COUNT
-    if gifts:
-        base_chance = await get_setting_float(conn, "game_cell_gift_chance", 0.10)
-        base_chance = max(0.0, min(1.0, base_chance))
-        for i in range(CELL_COUNT):
-            if random.random() < base_chance:
-                g = _pick_gift_weighted(gifts)
-                cell_gifts[i] = {
-                    "gift_id": int(g["id"]),
-                    "title": str(g["title"]),
-                    "emoji": g["emoji"],
-                }
-
-    payload = _new_game_payload(cell_gifts)
-    text = _render_text(attempts, payload["pending_wins"])
-    symbols = _build_symbols(payload["cells"], payload["cell_gifts"])
+    sampler = get_gift_sampler(await get_catalog(conn))
+    base_chance = await get_setting_float(conn, "game_cell_gift_chance", 0.10)
+    base_chance = max(0.0, min(1.0, base_chance))
+    state = GameState.new(sampler.board(base_chance))
+    await start_game(conn, cb.from_user.id, state)
+    text = _render_text(attempts, state.pending_wins)
+    symbols = await _build_symbols(conn, state)
     markup = kb_game_board(symbols)
-    msg_id = await edit_or_recreate(
+    await edit_or_recreate(
         bot=bot,
         conn=conn,
         user_id=cb.from_user.id,
@@ -162,9 +100,8 @@ async def open_game(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
         text=text,
         reply_markup=markup,
         screen="game:play",
-        payload=payload,
+        payload=None,
     )
-    await _save_game_payload(conn, cb.from_user.id, cb.message.chat.id, msg_id, payload)
 
 
 @router.callback_query(F.data == "game:noop")
@@ -173,19 +110,19 @@ async def game_noop(cb: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data.startswith("game:cell:"))
-async def game_cell(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def game_cell(cb: CallbackQuery, bot, conn: Database, user_ctx: UserContext) -> None:
     if not cb.from_user or not cb.message:
         return
     await cb.answer()
 
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
         )
         return
 
-    attempts = await get_user_attempts(conn, cb.from_user.id)
+    attempts = user_ctx.attempts
     if attempts <= 0:
         # if user somehow clicks old keyboard
         await edit_or_recreate(
@@ -207,59 +144,73 @@ async def game_cell(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
     if idx < 0 or idx >= CELL_COUNT:
         return
 
-    payload = await _load_game_payload(conn, cb.from_user.id)
-    if payload.get("finished"):
-        await cb.answer("Игра уже завершена. Вернитесь в меню и начните новую игру.", show_alert=True)
-        return
-    if payload["cells"][idx] == 1:
-        return
-
-    payload["cells"][idx] = 1
-    cell_gifts = payload.get("cell_gifts") or [None] * CELL_COUNT
-    cell_gift = cell_gifts[idx]
-
-    # Spend attempt per opened cell
-    await add_attempts(conn, cb.from_user.id, -1)
-    attempts = attempts - 1
-
+    # Два быстрых нажатия не должны открыть клетки по одному и тому же
+    # состоянию; списание попытки и ход коммитятся одной транзакцией.
+    # Внутри транзакции — только БД, ответы в Telegram после неё.
+    remaining: int | None = None
     won = False
     won_gift: aiosqlite.Row | None = None
-
-    if cell_gift:
-        won = True
-        payload["pending_wins"].append(
-            {"gift_id": int(cell_gift["gift_id"]), "title": str(cell_gift["title"])}
+    lose_msg = ""
+    async with user_lock(conn, cb.from_user.id), conn.transaction():
+        session_id, state = await load_game(conn, cb.from_user.id)
+        if state is None or state.finished:
+            state = None
+        elif not state.is_open(idx):
+            # Spend attempt per opened cell: проверка и списание — один UPDATE
+            remaining = await consume_attempt(conn, cb.from_user.id)
+            if remaining is not None:
+                state.open(idx)
+                cell_gift = state.gift_at(idx)
+                if cell_gift is not None:
+                    won = True
+                    state.pending_wins.append(cell_gift)
+
+                # If attempts ended -> раскрываем все клетки с подарками и сжигаем незабранные выигрыши
+                if remaining <= 0:
+                    # помечаем все клетки, где были подарки
+                    state.reveal_gifts()
+                    if state.pending_wins:
+                        state.pending_wins = []
+                        lose_msg = "\n\n<b>Поражение:</b> попытки закончились — незабранные выигрыши сгорели."
+                    state.finished = True
+
+                await save_game(conn, cb.from_user.id, session_id, state)
+
+    if state is None:
+        await cb.answer("Игра уже завершена. Вернитесь в меню и начните новую игру.", show_alert=True)
+        return
+    if remaining is None:
+        if state.is_open(idx):
+            return
+        # попытки кончились между загрузкой контекста и нажатием
+        await edit_or_recreate(
+            bot=bot,
+            conn=conn,
+            user_id=cb.from_user.id,
+            chat_id=cb.message.chat.id,
+            text="Попытки закончились. Вернись в меню.",
+            reply_markup=kb_back_to_menu(),
+            screen="game:no_attempts",
+            payload=None,
         )
+        return
+    attempts = remaining
 
-    # If attempts ended -> раскрываем все клетки с подарками и сжигаем незабранные выигрыши
-    lose_msg = ""
-    if attempts <= 0:
-        # помечаем все клетки, где были подарки
-        for i in range(CELL_COUNT):
-            if payload["cells"][i] == 0 and cell_gifts[i]:
-                payload["cells"][i] = 1
-        if payload["pending_wins"]:
-            payload["pending_wins"] = []
-            lose_msg = "\n\n<b>Поражение:</b> попытки закончились — незабранные выигрыши сгорели."
-        payload["finished"] = True
-
-    text = _render_text(max(0, attempts), payload["pending_wins"])
+    text = _render_text(max(0, attempts), state.pending_wins)
     if won and won_gift:
         text = (
             f"🎉 Ты выиграл(а) подарок: <b>{won_gift['title']}</b>\n\n"
             "Хочешь забрать или продолжить? Если продолжишь и закончатся попытки — всё сгорит.\n\n"
-            + _render_text(max(0, attempts), payload["pending_wins"])
+            + _render_text(max(0, attempts), state.pending_wins)
         )
     if lose_msg:
         text += lose_msg + "\n\nВот где прятались подарки."
 
-    symbols = _build_symbols(payload["cells"], cell_gifts)
-    board = kb_game_board(symbols)
-    controls = kb_game_controls(can_take=len(payload["pending_wins"]) > 0)
-    # Combine: board + controls rows
-    markup = InlineKeyboardMerge.merge(board, controls)
+    symbols = await _build_symbols(conn, state)
+    # board + controls rows
+    markup = kb_game_screen(symbols, can_take=len(state.pending_wins) > 0)
 
-    msg_id = await edit_or_recreate(
+    await edit_or_recreate(
         bot=bot,
         conn=conn,
         user_id=cb.from_user.id,
@@ -267,49 +218,52 @@ async def game_cell(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
         text=text,
         reply_markup=markup,
         screen="game:play",
-        payload=payload,
+        payload=None,
     )
-    await _save_game_payload(conn, cb.from_user.id, cb.message.chat.id, msg_id, payload)
 
 
 @router.callback_query(F.data == "game:take")
-async def game_take(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def game_take(cb: CallbackQuery, bot, conn: Database, user_ctx: UserContext) -> None:
     if not cb.from_user or not cb.message:
         return
     await cb.answer()
 
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
         )
         return
 
-    payload = await _load_game_payload(conn, cb.from_user.id)
-    if payload.get("finished"):
+    # Повторное нажатие «Забрать» увидит уже завершённую игру, а не те же
+    # выигрыши; инвентарь и доска коммитятся одной транзакцией.
+    claimed = False
+    async with user_lock(conn, cb.from_user.id), conn.transaction():
+        session_id, state = await load_game(conn, cb.from_user.id)
+        if state is not None and not state.finished and state.pending_wins:
+            for gift_id in state.pending_wins:
+                await add_inventory_item(conn, cb.from_user.id, gift_id)
+            state.pending_wins = []
+            state.finished = True
+            await save_game(conn, cb.from_user.id, session_id, state)
+            claimed = True
+
+    if state is None or (state.finished and not claimed):
         await cb.answer("Игра уже завершена. Вернитесь в меню и начните новую игру.", show_alert=True)
         return
-    pending = payload.get("pending_wins") or []
-    if not pending:
+    if not claimed:
         await cb.answer("Нет выигрышей для забора.", show_alert=False)
         return
 
-    for w in pending:
-        gift_id = int(w["gift_id"])
-        await add_inventory_item(conn, cb.from_user.id, gift_id)
-
-    payload["pending_wins"] = []
-    payload["finished"] = True
+    attempts = user_ctx.attempts
     text = "✅ Выигрыши добавлены в инвентарь.\n\n" + _render_text(
-        await get_user_attempts(conn, cb.from_user.id),
-        payload["pending_wins"],
+        attempts,
+        state.pending_wins,
     )
-    symbols = _build_symbols(payload["cells"], payload.get("cell_gifts") or [None] * CELL_COUNT)
-    board = kb_game_board(symbols)
-    controls = kb_game_controls(can_take=False)
-    markup = InlineKeyboardMerge.merge(board, controls)
+    symbols = await _build_symbols(conn, state)
+    markup = kb_game_screen(symbols, can_take=False)
 
-    msg_id = await edit_or_recreate(
+    await edit_or_recreate(
         bot=bot,
         conn=conn,
         user_id=cb.from_user.id,
@@ -317,20 +271,6 @@ async def game_take(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
         text=text,
         reply_markup=markup,
         screen="game:play",
-        payload=payload,
+        payload=None,
     )
-    await _save_game_payload(conn, cb.from_user.id, cb.message.chat.id, msg_id, payload)
-
-
-class InlineKeyboardMerge:
-    @staticmethod
-    def merge(*markups) -> InlineKeyboardMarkup:
-        inline_keyboard = []
-        for m in markups:
-            if not m:
-                continue
-            if isinstance(m, InlineKeyboardMarkup):
-                inline_keyboard.extend(m.inline_keyboard)
-        return InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
-
 
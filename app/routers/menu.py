@@ -5,72 +5,58 @@ import asyncio
 from aiogram import F, Router
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice, Message, PreCheckoutQuery
 
-import aiosqlite
-
-from ..keyboards import kb_back_to_menu, kb_menu, kb_task_sponsors_list
+from ..catalog import get_catalog
+from ..db import Database
+from ..game_sessions import load_game, save_game
+from ..keyboards import kb_back_to_menu, kb_menu, kb_task_sponsors
 from ..repo import (
+    UserContext,
     add_attempts,
     add_inventory_item,
     get_active_task_sponsors,
     get_setting_int,
-    get_ui_state,
     get_unrewarded_task_sponsors,
-    is_user_banned,
     mark_sponsor_bonus_granted,
     set_ui_state,
 )
-from ..ui import edit_or_recreate
+from ..ui import edit_or_recreate, render_hash
+from ..user_locks import user_lock
 
 router = Router(name="menu")
 
 
 @router.callback_query(F.data == "menu:home")
-async def menu_home(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def menu_home(cb: CallbackQuery, bot, conn: Database, user_ctx: UserContext) -> None:
     if not cb.from_user or not cb.message:
         return
     await cb.answer()
 
     # Бан пользователя
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
         )
         return
-    from ..repo import get_user_attempts, get_ui_state, set_ui_state
+    attempts = user_ctx.attempts
 
     # Если пользователь вышел в меню из игры и у него были незабранные выигрыши,
     # но игра ещё не закончилась поражением, автоматически забираем эти подарки.
-    state = await get_ui_state(conn, cb.from_user.id)
-    if state and state["screen"] == "game:play" and state["payload_json"]:
-        import json
-
-        try:
-            payload = json.loads(state["payload_json"])
-            pending = payload.get("pending_wins") or []
-            finished = payload.get("finished", False)
-        except Exception:
-            pending = []
-            finished = False
-
-        if pending and not finished:
-            for w in pending:
-                gift_id = int(w["gift_id"])
-                await add_inventory_item(conn, cb.from_user.id, gift_id)
-            # очищаем pending_wins и помечаем игру завершённой
-            payload["pending_wins"] = []
-            payload["finished"] = True
-
-            await set_ui_state(
-                conn,
-                cb.from_user.id,
-                state["chat_id"],
-                state["message_id"],
-                "game:play",
-                payload,
-            )
+    # Сессию читаем, только если пользователь пришёл с экрана игры.
+    state = user_ctx.ui_state
+    if state and state["screen"] == "game:play":
+        # под тем же замком, что и «Забрать», — выигрыши не зачислятся дважды;
+        # инвентарь и доска коммитятся одной транзакцией
+        async with user_lock(conn, cb.from_user.id), conn.transaction():
+            session_id, game = await load_game(conn, cb.from_user.id)
+            if game is not None and game.pending_wins and not game.finished:
+                for gift_id in game.pending_wins:
+                    await add_inventory_item(conn, cb.from_user.id, gift_id)
+                # очищаем pending_wins и помечаем игру завершённой
+                game.pending_wins = []
+                game.finished = True
+                await save_game(conn, cb.from_user.id, session_id, game)
 
-    attempts = await get_user_attempts(conn, cb.from_user.id)
     text = (
         f"🎮 Попыток: <b>{attempts}</b>\n\n"
         "Как получить попытки:\n"
@@ -107,6 +93,7 @@ async def menu_home(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
                 cb.message.message_id,
                 "menu:home",
                 None,
+                render_hash=render_hash(text, kb_menu()),
             )
         except Exception:
             # Если не удалось отредактировать (например, сообщение уже изменено), используем обычную логику
@@ -135,12 +122,12 @@ async def menu_home(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
 
 
 @router.callback_query(F.data == "menu:tasks")
-async def menu_tasks(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def menu_tasks(cb: CallbackQuery, bot, conn: Database, user_ctx: UserContext) -> None:
     if not cb.from_user:
         return
     await cb.answer()
 
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
@@ -177,27 +164,6 @@ async def menu_tasks(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None
         )
         return
 
-    from ..routers.start import sponsor_link
-
-    # Строим список для отображения: показываем все (каналы, боты, сайты),
-    # но если нет ни одного канала — не показываем сайты/боты вообще.
-    has_channels = any(
-        ((s["type"] or "channel").lower() if "type" in s.keys() else "channel") == "channel"
-        and int(s["channel_id"]) != 0
-        for s in sponsors
-    )
-    rows = []
-    for s in sponsors:
-        type_ = (s["type"] or "channel").lower() if "type" in s.keys() else "channel"
-        if type_ in ("bot", "link") and not has_channels:
-            continue
-        rows.append(
-            {
-                "title": str(s["title"]),
-                "link": sponsor_link(s) or "",
-            }
-        )
-
     text = "Для вас задания:\n\nПодпишитесь на каналы ниже, чтобы получить попытки."
     await edit_or_recreate(
         bot=bot,
@@ -205,15 +171,15 @@ async def menu_tasks(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None
         user_id=cb.from_user.id,
         chat_id=cb.message.chat.id,
         text=text,
-        reply_markup=kb_task_sponsors_list(rows) if rows else kb_back_to_menu(),
+        reply_markup=kb_task_sponsors(await get_catalog(conn)),
         screen="tasks:list",
         payload=None,
     )
 
 
 @router.callback_query(F.data == "tasks:check_subs")
-async def tasks_check_subs(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
-    from ..routers.start import sponsor_link, is_subscribed
+async def tasks_check_subs(cb: CallbackQuery, bot, conn: Database) -> None:
+    from ..routers.start import find_missing_channels
 
     if not cb.from_user:
         return
@@ -229,33 +195,7 @@ async def tasks_check_subs(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -
         return
 
     # Проверяем подписку только по каналам
-    missing_channels = []
-    for s in sponsors:
-        type_ = (s["type"] or "channel").lower() if "type" in s.keys() else "channel"
-        channel_id = int(s["channel_id"])
-        if type_ == "channel" and channel_id != 0:
-            ok = await is_subscribed(bot, conn, cb.from_user.id, channel_id)
-            if not ok:
-                missing_channels.append(s)
-
-    has_channels = any(
-        ((s["type"] or "channel").lower() if "type" in s.keys() else "channel") == "channel"
-        and int(s["channel_id"]) != 0
-        for s in sponsors
-    )
-
-    # Перестраиваем список показа (как в menu_tasks)
-    rows = []
-    for s in sponsors:
-        type_ = (s["type"] or "channel").lower() if "type" in s.keys() else "channel"
-        if type_ in ("bot", "link") and not has_channels:
-            continue
-        rows.append(
-            {
-                "title": str(s["title"]),
-                "link": sponsor_link(s) or "",
-            }
-        )
+    missing_channels = await find_missing_channels(bot, conn, cb.from_user.id, sponsors, fresh=True)
 
     if missing_channels:
         text = "❌ Не на все каналы есть подписка.\n\nПодпишитесь на все каналы и проверьте ещё раз."
@@ -265,22 +205,25 @@ async def tasks_check_subs(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -
             user_id=cb.from_user.id,
             chat_id=cb.message.chat.id,
             text=text,
-            reply_markup=kb_task_sponsors_list(rows) if rows else kb_back_to_menu(),
+            reply_markup=kb_task_sponsors(await get_catalog(conn)),
             screen="tasks:list",
             payload=None,
         )
         return
 
-    # Все каналы выполнены — считаем бонусы по ещё не выданным спонсорам
-    unrewarded = await get_unrewarded_task_sponsors(conn, cb.from_user.id)
-    total_bonus = 0
-    for s in unrewarded:
-        bonus = int(s["bonus_attempts"])
-        total_bonus += bonus
-        await mark_sponsor_bonus_granted(conn, cb.from_user.id, int(s["id"]), bonus)
+    # Все каналы выполнены — считаем бонусы по ещё не выданным спонсорам.
+    # Под замком: повторная проверка увидит уже выданные бонусы.
+    async with user_lock(conn, cb.from_user.id):
+        unrewarded = await get_unrewarded_task_sponsors(conn, cb.from_user.id)
+        total_bonus = 0
+        for s in unrewarded:
+            bonus = int(s["bonus_attempts"])
+            total_bonus += bonus
+            await mark_sponsor_bonus_granted(conn, cb.from_user.id, int(s["id"]), bonus)
+        if total_bonus > 0:
+            await add_attempts(conn, cb.from_user.id, total_bonus)
 
     if total_bonus > 0:
-        await add_attempts(conn, cb.from_user.id, total_bonus)
         text = (
             f"✅ Задания выполнены! Вы получили <b>{total_bonus}</b> попыток.\n\n"
             "Чтобы получить новые задания, дождитесь появления новых спонсоров."
@@ -304,12 +247,12 @@ async def tasks_check_subs(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -
 
 
 @router.callback_query(F.data == "menu:buy1")
-async def menu_buy1(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def menu_buy1(cb: CallbackQuery, bot, conn: Database, user_ctx: UserContext) -> None:
     if not cb.from_user:
         return
     await cb.answer()
 
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
@@ -339,13 +282,13 @@ async def menu_buy1(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
 
 
 @router.pre_checkout_query()
-async def pre_checkout(pre_checkout_query: PreCheckoutQuery, bot, conn: aiosqlite.Connection) -> None:
+async def pre_checkout(pre_checkout_query: PreCheckoutQuery, bot, conn: Database) -> None:
     # Здесь можно добавить дополнительные проверки, если нужно
     await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
 
 
 @router.message(F.successful_payment)
-async def successful_payment_handler(message: Message, bot, conn: aiosqlite.Connection) -> None:
+async def successful_payment_handler(message: Message, bot, conn: Database) -> None:
     sp = message.successful_payment
     if not sp:
         return
@@ -374,7 +317,7 @@ async def successful_payment_handler(message: Message, bot, conn: aiosqlite.Conn
 
 
 @router.callback_query(F.data == "menu:home_new")
-async def menu_home_new(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def menu_home_new(cb: CallbackQuery, bot, conn: Database, user_ctx: UserContext) -> None:
     """
     Специальный «Меню» после оплаты: не редактирует старое сообщение,
     а создаёт новое и переносит на него single-message UI.
@@ -383,16 +326,14 @@ async def menu_home_new(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> N
         return
     await cb.answer()
 
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
         )
         return
 
-    from ..repo import get_user_attempts
-
-    attempts = await get_user_attempts(conn, cb.from_user.id)
+    attempts = user_ctx.attempts
     text = (
         f"🎮 Попыток: <b>{attempts}</b>\n\n"
         "Как получить попытки:\n"
@@ -418,7 +359,7 @@ async def menu_home_new(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> N
 
 
 @router.callback_query(F.data == "menu:refs_stub")
-async def menu_refs(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def menu_refs(cb: CallbackQuery, bot, conn: Database) -> None:
     if not cb.from_user:
         return
     await cb.answer()
@@ -2,14 +2,15 @@ from __future__ import annotations
 
 from datetime import datetime
 
-import aiosqlite
 from aiogram import F, Router
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 
 from ..config import Config
+from ..db import Database
 from ..keyboards import kb_back_to_menu, kb_profile_menu
-from ..repo import get_inventory_item, list_inventory, set_inventory_status, is_user_banned
+from ..repo import UserContext, get_inventory_item, list_inventory, set_inventory_status
 from ..ui import edit_or_recreate
+from ..user_locks import user_lock
 
 router = Router(name="profile")
 
@@ -31,20 +32,18 @@ def _fmt_dt(ts: int | None) -> str:
 
 
 @router.callback_query(F.data == "menu:profile")
-async def open_profile(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def open_profile(cb: CallbackQuery, bot, conn: Database, user_ctx: UserContext) -> None:
     if not cb.from_user or not cb.message:
         return
     await cb.answer()
 
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
         )
         return
-    from ..repo import get_user_attempts
-
-    attempts = await get_user_attempts(conn, cb.from_user.id)
+    attempts = user_ctx.attempts
     items = await list_inventory(conn, cb.from_user.id)
     total = len(items)
     withdrawn = sum(1 for i in items if i["status"] == "withdrawn")
@@ -69,12 +68,12 @@ async def open_profile(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> No
 
 
 @router.callback_query(F.data == "profile:inventory")
-async def profile_inventory(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def profile_inventory(cb: CallbackQuery, bot, conn: Database, user_ctx: UserContext) -> None:
     if not cb.from_user or not cb.message:
         return
     await cb.answer()
 
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
@@ -129,12 +128,12 @@ async def profile_inventory(cb: CallbackQuery, bot, conn: aiosqlite.Connection)
 
 
 @router.callback_query(F.data.startswith("profile:item:"))
-async def profile_item(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def profile_item(cb: CallbackQuery, bot, conn: Database, user_ctx: UserContext) -> None:
     if not cb.from_user or not cb.message:
         return
     await cb.answer()
 
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
@@ -194,12 +193,12 @@ async def profile_item(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> No
 
 
 @router.callback_query(F.data.startswith("profile:withdraw:"))
-async def profile_withdraw(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -> None:
+async def profile_withdraw(cb: CallbackQuery, bot, conn: Database, user_ctx: UserContext) -> None:
     if not cb.from_user or not cb.message:
         return
     await cb.answer()
 
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
@@ -250,13 +249,13 @@ async def profile_withdraw(cb: CallbackQuery, bot, conn: aiosqlite.Connection) -
 
 @router.callback_query(F.data.startswith("profile:confirm_withdraw:"))
 async def profile_confirm_withdraw(
-    cb: CallbackQuery, bot, conn: aiosqlite.Connection, config: Config
+    cb: CallbackQuery, bot, conn: Database, config: Config, user_ctx: UserContext
 ) -> None:
     if not cb.from_user or not cb.message:
         return
     await cb.answer()
 
-    if await is_user_banned(conn, cb.from_user.id):
+    if user_ctx.is_banned:
         await bot.send_message(
             chat_id=cb.from_user.id,
             text="⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.",
@@ -267,13 +266,16 @@ async def profile_confirm_withdraw(
     except Exception:
         return
 
-    item = await get_inventory_item(conn, inv_id, cb.from_user.id)
-    if not item or item["status"] != "won":
-        await cb.answer("Этот подарок нельзя вывести.", show_alert=True)
-        return
+    # под замком: повторное подтверждение увидит статус withdraw_pending
+    # и не отправит вторую заявку
+    async with user_lock(conn, cb.from_user.id):
+        item = await get_inventory_item(conn, inv_id, cb.from_user.id)
+        if not item or item["status"] != "won":
+            await cb.answer("Этот подарок нельзя вывести.", show_alert=True)
+            return
 
-    # помечаем как "в ожидании вывода"
-    await set_inventory_status(conn, inv_id, "withdraw_pending", withdraw_requested=True)
+        # помечаем как "в ожидании вывода"
+        await set_inventory_status(conn, inv_id, "withdraw_pending", withdraw_requested=True)
 
     # отправляем сообщение в чат поддержки
     if config.withdraw_review_chat_id:
@@ -323,7 +325,7 @@ async def profile_confirm_withdraw(
     )
 
     # Обновляем основной UI (вернёмся к карточке подарка с новым статусом)
-    await profile_item(cb, bot, conn)
+    await profile_item(cb, bot, conn, user_ctx)
 
 
 @router.callback_query(F.data == "profile:close_notice")
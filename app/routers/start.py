@@ -2,89 +2,180 @@ from __future__ import annotations
 
 from aiogram import Bot, F, Router
 from aiogram.filters import CommandStart
-from aiogram.types import CallbackQuery, Message, ChatJoinRequest
+from aiogram.types import CallbackQuery, Message, ChatJoinRequest, ChatMemberUpdated
 
 import aiosqlite
 
 import asyncio
+import random
+import time
+from typing import Any
 
-from ..keyboards import kb_check_subscriptions, kb_menu, kb_sponsors_list, kb_start
+from ..catalog import get_catalog
+from ..db import Database
+from ..keyboards import kb_menu, kb_start, kb_start_sponsors
 from ..repo import (
+    UserContext,
     add_attempts,
-    get_active_start_sponsors,
-    get_start_message_id,
-    get_user,
+    get_channel_membership,
     has_fresh_join_request,
-    is_user_banned,
     save_join_request,
+    set_channel_membership,
+    set_sponsors_verified,
     set_start_message_id,
     set_ui_state,
     touch_user_activity,
     upsert_user,
 )
+from ..subscription_cache import subscription_cache
+from ..timeutil import now_ts
 from ..ui import edit_or_recreate
 
 router = Router(name="start")
 
 
-def sponsor_link(row: aiosqlite.Row) -> str | None:
-    if row["invite_link"]:
-        return str(row["invite_link"])
-    if row["channel_username"]:
-        u = str(row["channel_username"]).lstrip("@")
-        return f"https://t.me/{u}"
-    return None
+SUBSCRIBED_STATUSES = ("creator", "administrator", "member")
 
+# Одновременных get_chat_member на весь процесс и таймаут одной проверки (сек),
+# включая ожидание слота. Медленный канал не должен задерживать проверку остальных.
+SUB_CHECK_CONCURRENCY = 8
+SUB_CHECK_TIMEOUT = 3.0
 
-async def is_subscribed(bot: Bot, conn: aiosqlite.Connection, user_id: int, channel_id: int) -> bool:
+_sub_check_sem = asyncio.Semaphore(SUB_CHECK_CONCURRENCY)
+
+# Сколько доверяем успешной проверке старт-спонсоров (сек). Разброс ±10%,
+# чтобы проверки пользователей, подтверждённых одновременно, не истекали разом.
+SPONSORS_VERIFIED_TTL = 60 * 60
+
+
+def _verified_ttl() -> int:
+    return int(SPONSORS_VERIFIED_TTL * random.uniform(0.9, 1.1))
+
+
+# Каналы, где бот админ и получает chat_member: channel_id -> (да/нет, monotonic-срок).
+# Для них подписка берётся из channel_membership, а get_chat_member нужен только
+# один раз на пользователя (первичное заполнение). Уточняется my_chat_member.
+MEMBER_TRACKING_TTL = 60 * 60
+_member_tracking: dict[int, tuple[bool, float]] = {}
+
+
+def _status_str(status: Any) -> str:
+    return str(getattr(status, "value", status))
+
+
+async def _fetch_member_status(bot: Bot, user_id: int, channel_id: int) -> str | None:
+    """Статус из get_chat_member; None — Telegram не ответил, результат неизвестен."""
+    try:
+        # таймаут покрывает и очередь за слотом: чужие медленные каналы не
+        # растягивают проверку дольше SUB_CHECK_TIMEOUT
+        async with asyncio.timeout(SUB_CHECK_TIMEOUT):
+            async with _sub_check_sem:
+                member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
+        return _status_str(member.status)
+    except Exception:
+        return None
+
+
+async def bot_tracks_members(bot: Bot, channel_id: int) -> bool:
+    """Является ли бот админом канала (т.е. приходят ли нам chat_member)."""
+    item = _member_tracking.get(channel_id)
+    if item is not None and item[1] > time.monotonic():
+        return item[0]
+    status = await _fetch_member_status(bot, bot.id, channel_id)
+    if status is None:
+        # не знаем — опрашиваем канал как обычно, но недолго
+        _member_tracking[channel_id] = (False, time.monotonic() + SUB_CHECK_TIMEOUT * 10)
+        return False
+    tracked = status in ("administrator", "creator")
+    _member_tracking[channel_id] = (tracked, time.monotonic() + MEMBER_TRACKING_TTL)
+    return tracked
+
+
+async def is_subscribed(
+    bot: Bot, conn: Database, user_id: int, channel_id: int, *, fresh: bool = False
+) -> bool:
     """
     Проверяет, подписан ли пользователь на канал или отправил заявку на приватный канал.
-    Сначала проверяет подписчиков через get_chat_member.
-    Если не подписан, проверяет заявки на вступление через БД (join_requests).
+    Порядок: subscription_cache -> channel_membership (если бот админ канала и
+    получает chat_member) -> get_chat_member. Если не подписан, проверяет заявки
+    на вступление через БД (join_requests).
+
+    fresh=True — явная проверка по кнопке: кэш и channel_membership не читаются
+    (пользователь мог подписаться только что), статус берётся из get_chat_member,
+    а результат перезаписывает кэш.
     """
-    try:
-        # Сначала проверяем, подписан ли пользователь
-        member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-        status = member.status
-        
-        # Если пользователь подписан - это точно подписка
-        if status in ("creator", "administrator", "member"):
-            return True
-        
+    if not fresh:
+        cached = subscription_cache.get(user_id, channel_id)
+        if cached is not None:
+            return cached
+
+    tracked = await bot_tracks_members(bot, channel_id)
+    status = await get_channel_membership(conn, user_id, channel_id) if tracked and not fresh else None
+    if status is None:
+        status = await _fetch_member_status(bot, user_id, channel_id)
+        if status is None:
+            # ошибка API: отвечаем по заявкам, но не кэшируем
+            try:
+                return await has_fresh_join_request(conn, user_id, channel_id)
+            except Exception:
+                return False
+        if tracked:
+            # дальше статус будут обновлять chat_member апдейты
+            await set_channel_membership(conn, user_id, channel_id, status, now_ts())
+
+    # Если пользователь подписан - это точно подписка
+    ok = status in SUBSCRIBED_STATUSES
+    if not ok:
         # Если не подписан, проверяем заявки на вступление через БД
         # Заявки сохраняются обработчиком chat_join_request в реальном времени
-        if await has_fresh_join_request(conn, user_id, channel_id):
-            return True
-        
-        return False
-    except Exception:
-        # Если ошибка при проверке, проверяем заявку в БД как fallback
         try:
-            return await has_fresh_join_request(conn, user_id, channel_id)
+            ok = await has_fresh_join_request(conn, user_id, channel_id)
         except Exception:
-            return False
+            ok = False
+    subscription_cache.set(user_id, channel_id, ok)
+    return ok
 
 
-async def ensure_start_sponsors_subscribed(bot: Bot, conn: aiosqlite.Connection, user_id: int) -> tuple[bool, list[aiosqlite.Row], list[aiosqlite.Row]]:
+async def ensure_start_sponsors_subscribed(
+    bot: Bot, conn: Database, user_id: int, *, fresh: bool = False
+) -> tuple[bool, list[aiosqlite.Row], list[aiosqlite.Row]]:
     """
     Проверяем подписку только по каналам, но возвращаем также полный список спонсоров.
+    Успешный результат сохраняется в users.sponsors_verified_* (см. SponsorCheckMiddleware).
+    fresh — см. is_subscribed.
     :return: ok, all_sponsors, missing_channel_sponsors
     """
-    sponsors = await get_active_start_sponsors(conn)
-    missing_channels: list[aiosqlite.Row] = []
-    for s in sponsors:
-        type_ = (s["type"] or "channel").lower() if "type" in s.keys() else "channel"
-        channel_id = int(s["channel_id"])
-        # Проверку подписки реально можно сделать только для каналов
-        if type_ == "channel" and channel_id != 0:
-            ok = await is_subscribed(bot, conn, user_id, channel_id)
-            if not ok:
-                missing_channels.append(s)
-    return (len(missing_channels) == 0), sponsors, missing_channels
+    catalog = await get_catalog(conn)
+    sponsors = list(catalog.start_sponsors)
+    missing_channels = await find_missing_channels(bot, conn, user_id, sponsors, fresh=fresh)
+    ok = len(missing_channels) == 0
+    if ok and catalog.start_channel_ids:
+        await set_sponsors_verified(
+            conn, user_id, now_ts() + _verified_ttl(), catalog.start_channels_version
+        )
+    return ok, sponsors, missing_channels
+
+
+async def find_missing_channels(
+    bot: Bot, conn: Database, user_id: int, sponsors: list[aiosqlite.Row], *, fresh: bool = False
+) -> list[aiosqlite.Row]:
+    """
+    Спонсоры-каналы, на которые пользователь не подписан. Каналы проверяются
+    параллельно (см. SUB_CHECK_CONCURRENCY/SUB_CHECK_TIMEOUT), порядок
+    результата — как в sponsors. fresh — см. is_subscribed.
+    """
+    # Проверку подписки реально можно сделать только для каналов (набор
+    # каналов посчитан в снимке каталога)
+    channel_ids = (await get_catalog(conn)).sponsor_channel_ids
+    channels = [s for s in sponsors if int(s["channel_id"]) in channel_ids]
+    results = await asyncio.gather(
+        *(is_subscribed(bot, conn, user_id, int(s["channel_id"]), fresh=fresh) for s in channels)
+    )
+    return [s for s, ok in zip(channels, results) if not ok]
 
 
 @router.chat_join_request()
-async def on_join_request(event: ChatJoinRequest, bot: Bot, conn: aiosqlite.Connection) -> None:
+async def on_join_request(event: ChatJoinRequest, bot: Bot, conn: Database) -> None:
     """
     Обработчик заявок на вступление в каналы.
     Сохраняет заявку в БД для последующей проверки подписки.
@@ -96,19 +187,13 @@ async def on_join_request(event: ChatJoinRequest, bot: Bot, conn: aiosqlite.Conn
     user_id = event.from_user.id
     chat_id = event.chat.id
     
-    # Проверяем, является ли этот канал старт-спонсором
-    sponsors = await get_active_start_sponsors(conn)
-    is_start_sponsor = False
-    for s in sponsors:
-        type_ = (s["type"] or "channel").lower() if "type" in s.keys() else "channel"
-        channel_id = int(s["channel_id"])
-        if type_ == "channel" and channel_id == chat_id:
-            is_start_sponsor = True
-            break
+    # Проверяем, является ли этот канал старт-спонсором (по снимку каталога)
+    catalog = await get_catalog(conn)
     
     # Сохраняем заявку только если это старт-спонсор
-    if is_start_sponsor:
+    if chat_id in catalog.start_channel_ids:
         await save_join_request(conn, user_id, chat_id)
+        subscription_cache.set(user_id, chat_id, True)
         
         # Можно уведомить пользователя (если бот уже имеет право писать ему)
         # Обычно юзер не начинал диалог -> сообщение может не уйти. Это нормально.
@@ -120,16 +205,51 @@ async def on_join_request(event: ChatJoinRequest, bot: Bot, conn: aiosqlite.Conn
     # ВАЖНО: мы НЕ принимаем и НЕ отклоняем заявку автоматически
 
 
+@router.chat_member()
+async def on_chat_member(event: ChatMemberUpdated, conn: Database) -> None:
+    """
+    Изменение участника канала (бот должен быть админом канала).
+    Пишем статус в channel_membership и обновляем кэш подписок,
+    чтобы не ждать истечения TTL.
+    """
+    chat_id = event.chat.id
+    catalog = await get_catalog(conn)
+    if chat_id not in catalog.sponsor_channel_ids:
+        return
+    _member_tracking[chat_id] = (True, time.monotonic() + MEMBER_TRACKING_TTL)
+
+    user = event.new_chat_member.user
+    status = _status_str(event.new_chat_member.status)
+    await set_channel_membership(conn, user.id, chat_id, status, int(event.date.timestamp()))
+    if status in SUBSCRIBED_STATUSES:
+        subscription_cache.set(user.id, chat_id, True)
+    else:
+        # вышел/кикнут — но могла остаться заявка, поэтому просто перепроверим
+        subscription_cache.invalidate(user.id, chat_id)
+
+
+@router.my_chat_member()
+async def on_my_chat_member(event: ChatMemberUpdated) -> None:
+    """Бота назначили/сняли админом канала — меняется источник статусов подписки."""
+    status = _status_str(event.new_chat_member.status)
+    _member_tracking[event.chat.id] = (
+        status in ("administrator", "creator"),
+        time.monotonic() + MEMBER_TRACKING_TTL,
+    )
+
+
 @router.message(CommandStart())
-async def cmd_start(message: Message, bot: Bot, conn: aiosqlite.Connection) -> None:
+async def cmd_start(message: Message, bot: Bot, conn: Database, user_ctx: UserContext) -> None:
     u = message.from_user
     if not u:
         return
-    existing = await get_user(conn, u.id)
+    # Состояние до upsert_user: существовал ли пользователь, его бан/попытки
+    is_new = not user_ctx.exists
+    start_msg_id = user_ctx.start_message_id
     await upsert_user(conn, u.id, u.username, u.first_name, u.last_name)
 
     # Проверка бана
-    if await is_user_banned(conn, u.id):
+    if user_ctx.is_banned:
         await message.answer("⛔ Доступ к боту для вас ограничен. Обратитесь к администратору.")
         return
 
@@ -137,11 +257,10 @@ async def cmd_start(message: Message, bot: Bot, conn: aiosqlite.Connection) -> N
     await touch_user_activity(conn, u.id)
 
     # Зафиксировать первое /start как "главное" пользовательское сообщение
-    start_msg_id = await get_start_message_id(conn, u.id)
     if start_msg_id is None and (message.text or "").startswith("/start"):
         await set_start_message_id(conn, u.id, message.message_id)
 
-    if existing is None:
+    if is_new:
         # Новый пользователь — показываем экран "ты выиграл подарок"
         name = u.first_name or u.full_name or "друг"
         text = (
@@ -158,9 +277,7 @@ async def cmd_start(message: Message, bot: Bot, conn: aiosqlite.Connection) -> N
         await set_ui_state(conn, u.id, message.chat.id, msg.message_id, "start:hello_new", None)
     else:
         # Уже есть в БД — сразу меню
-        from ..repo import get_user_attempts
-
-        attempts = await get_user_attempts(conn, u.id)
+        attempts = user_ctx.attempts
         text = (
             f"🎮 Попыток: <b>{attempts}</b>\n\n"
             "Как получить попытки:\n"
@@ -180,7 +297,7 @@ async def cmd_start(message: Message, bot: Bot, conn: aiosqlite.Connection) -> N
 
 
 @router.callback_query(F.data == "start:back")
-async def start_back(cb: CallbackQuery, bot: Bot, conn: aiosqlite.Connection) -> None:
+async def start_back(cb: CallbackQuery, bot: Bot, conn: Database) -> None:
     if not cb.from_user:
         return
     await cb.answer()
@@ -201,18 +318,16 @@ async def start_back(cb: CallbackQuery, bot: Bot, conn: aiosqlite.Connection) ->
 
 
 @router.callback_query(F.data == "start:choose_gift")
-async def choose_gift(cb: CallbackQuery, bot: Bot, conn: aiosqlite.Connection) -> None:
+async def choose_gift(cb: CallbackQuery, bot: Bot, conn: Database, user_ctx: UserContext) -> None:
     # На этом этапе — упрощённо: сразу ведём к обязательной подписке.
     if not cb.from_user:
         return
     await cb.answer()
 
-    ok, sponsors, _ = await ensure_start_sponsors_subscribed(bot, conn, cb.from_user.id)
+    ok, _, _ = await ensure_start_sponsors_subscribed(bot, conn, cb.from_user.id)
     if ok:
         # уже подписан на старт-спонсоров — просто меню
-        from ..repo import get_user_attempts
-
-        attempts = await get_user_attempts(conn, cb.from_user.id)
+        attempts = user_ctx.attempts
         text = (
             f"🎮 Попыток: <b>{attempts}</b>\n\n"
             "Как получить попытки:\n"
@@ -235,23 +350,6 @@ async def choose_gift(cb: CallbackQuery, bot: Bot, conn: aiosqlite.Connection) -
 
     # не подписан — показываем задания со стартовыми спонсорами
     # Показываем и каналы, и ботов/сайты, но проверка идёт только по каналам.
-    from ..keyboards import kb_sponsors_list
-
-    has_channels = any(
-        ((s["type"] or "channel").lower() if "type" in s.keys() else "channel") == "channel"
-        and int(s["channel_id"]) != 0
-        for s in sponsors
-    )
-    rows: list[dict] = []
-    for s in sponsors:
-        type_ = (s["type"] or "channel").lower() if "type" in s.keys() else "channel"
-        # Если вообще нет каналов — сайты/боты не отображаем
-        if type_ in ("bot", "link") and not has_channels:
-            continue
-        link = sponsor_link(s) or ""
-        if link:
-            rows.append({"title": str(s["title"]), "link": link})
-
     text = "🎁 Выберите свой подарок!\n\nНиже список спонсоров. Подпишитесь на все каналы, затем нажмите «Проверить подписки»."
     await edit_or_recreate(
         bot=bot,
@@ -259,19 +357,20 @@ async def choose_gift(cb: CallbackQuery, bot: Bot, conn: aiosqlite.Connection) -
         user_id=cb.from_user.id,
         chat_id=cb.message.chat.id,
         text=text,
-        reply_markup=kb_sponsors_list(rows) if rows else kb_check_subscriptions(),
+        reply_markup=kb_start_sponsors(await get_catalog(conn)),
         screen="start:subs",
         payload=None,
     )
 
 
 @router.callback_query(F.data == "start:check_subs")
-async def check_subs(cb: CallbackQuery, bot: Bot, conn: aiosqlite.Connection) -> None:
+async def check_subs(cb: CallbackQuery, bot: Bot, conn: Database, user_ctx: UserContext) -> None:
     if not cb.from_user:
         return
     await cb.answer()
 
-    ok, sponsors, _ = await ensure_start_sponsors_subscribed(bot, conn, cb.from_user.id)
+    # пользователь только что подписался — отрицательный результат из кэша не годится
+    ok, _, _ = await ensure_start_sponsors_subscribed(bot, conn, cb.from_user.id, fresh=True)
     if ok:
         # имитация "собираем задания"
         await edit_or_recreate(
@@ -292,9 +391,7 @@ async def check_subs(cb: CallbackQuery, bot: Bot, conn: aiosqlite.Connection) ->
         )
         # выдаём 3 попытки и отправляем меню
         await add_attempts(conn, cb.from_user.id, 3)
-        from ..repo import get_user_attempts
-
-        attempts = await get_user_attempts(conn, cb.from_user.id)
+        attempts = user_ctx.attempts
         text = (
             text
             + "\n\n"
@@ -316,22 +413,6 @@ async def check_subs(cb: CallbackQuery, bot: Bot, conn: aiosqlite.Connection) ->
             payload=None,
         )
     else:
-        from ..keyboards import kb_sponsors_list
-
-        has_channels = any(
-            ((s["type"] or "channel").lower() if "type" in s.keys() else "channel") == "channel"
-            and int(s["channel_id"]) != 0
-            for s in sponsors
-        )
-        rows: list[dict] = []
-        for s in sponsors:
-            type_ = (s["type"] or "channel").lower() if "type" in s.keys() else "channel"
-            if type_ in ("bot", "link") and not has_channels:
-                continue
-            link = sponsor_link(s) or ""
-            if link:
-                rows.append({"title": str(s["title"]), "link": link})
-
         text = "❌ Не на все каналы есть подписка.\n\nПодпишись на все каналы и проверь ещё раз."
         await edit_or_recreate(
             bot=bot,
@@ -339,7 +420,7 @@ async def check_subs(cb: CallbackQuery, bot: Bot, conn: aiosqlite.Connection) ->
             user_id=cb.from_user.id,
             chat_id=cb.message.chat.id,
             text=text,
-            reply_markup=kb_sponsors_list(rows) if rows else kb_check_subscriptions(),
+            reply_markup=kb_start_sponsors(await get_catalog(conn)),
             screen="start:subs",
             payload=None,
         )
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+
+# Положительный результат живёт дольше: отписка — редкое событие, и о ней
+# обычно приходит chat_member. Отрицательный перепроверяем чаще, чтобы
+# пользователь, только что подписавшийся, не ждал долго.
+SUB_CACHE_TTL_OK = 10 * 60
+SUB_CACHE_TTL_MISS = 30
+SUB_CACHE_MAX_SIZE = 50_000
+
+
+class SubscriptionCache:
+    """
+    LRU-кэш (user_id, channel_id) -> подписан ли, с отдельными TTL для
+    положительных и отрицательных ответов.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl_ok: float = SUB_CACHE_TTL_OK,
+        ttl_miss: float = SUB_CACHE_TTL_MISS,
+        max_size: int = SUB_CACHE_MAX_SIZE,
+    ) -> None:
+        self.ttl_ok = ttl_ok
+        self.ttl_miss = ttl_miss
+        self.max_size = max_size
+        self._items: OrderedDict[tuple[int, int], tuple[bool, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, user_id: int, channel_id: int) -> bool | None:
+        key = (user_id, channel_id)
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, user_id: int, channel_id: int, value: bool) -> None:
+        key = (user_id, channel_id)
+        ttl = self.ttl_ok if value else self.ttl_miss
+        self._items[key] = (value, time.monotonic() + ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, user_id: int, channel_id: int) -> None:
+        self._items.pop((user_id, channel_id), None)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+
+subscription_cache = SubscriptionCache()
@@ -1,54 +1,137 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 from typing import Any
 
 from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from aiogram.types import InlineKeyboardMarkup
 
-import aiosqlite
-
+from .db import Database
 from .repo import get_ui_state, set_ui_state
 
 
+def render_hash(text: str, reply_markup: InlineKeyboardMarkup | None) -> int:
+    """Стабильный между перезапусками 64-битный хэш отрисованного экрана."""
+    h = hashlib.blake2b(text.encode(), digest_size=8)
+    if reply_markup is not None:
+        h.update(b"\0")
+        h.update(reply_markup.model_dump_json(exclude_none=True).encode())
+    return int.from_bytes(h.digest(), "big", signed=True)
+
+
+class _EditSlot:
+    """
+    Очередь правок одного сообщения: правит один «владелец», ждать может
+    только одна — самая свежая — отрисовка; более старую она вытесняет.
+    """
+
+    __slots__ = ("waiter", "last_hash")
+
+    def __init__(self) -> None:
+        self.waiter: asyncio.Future[bool] | None = None
+        # хэш последней отправленной в этом окне правки
+        self.last_hash: int | None = None
+
+
+# (chat_id, message_id) -> слот, пока к сообщению идёт правка
+_edit_slots: dict[tuple[int, int], _EditSlot] = {}
+
+
+async def _acquire_edit(key: tuple[int, int]) -> _EditSlot | None:
+    """
+    Ждёт очереди на правку сообщения. None — пока ждали, пришла более новая
+    отрисовка: эту отправлять не нужно.
+    """
+    slot = _edit_slots.get(key)
+    if slot is None:
+        slot = _edit_slots[key] = _EditSlot()
+        return slot
+    if slot.waiter is not None and not slot.waiter.done():
+        slot.waiter.set_result(False)
+    fut: asyncio.Future[bool] = asyncio.get_running_loop().create_future()
+    slot.waiter = fut
+    try:
+        return slot if await fut else None
+    except asyncio.CancelledError:
+        if fut.done() and not fut.cancelled() and fut.result():
+            # очередь уже передана нам — передаём дальше
+            _release_edit(key)
+        elif slot.waiter is fut:
+            slot.waiter = None
+        raise
+
+
+def _release_edit(key: tuple[int, int]) -> None:
+    slot = _edit_slots[key]
+    waiter, slot.waiter = slot.waiter, None
+    if waiter is not None and not waiter.done():
+        waiter.set_result(True)
+    else:
+        del _edit_slots[key]
+
+
 async def edit_or_recreate(
     *,
     bot: Bot,
-    conn: aiosqlite.Connection,
+    conn: Database,
     user_id: int,
     chat_id: int,
     text: str,
     reply_markup: InlineKeyboardMarkup | None,
     screen: str,
-    payload: dict[str, Any] | None = None,
+    payload: dict[str, Any] | bytes | None = None,
 ) -> int:
     """
     Ensures "single message UI": edits existing stored message if possible,
     otherwise creates a new one and persists (chat_id, message_id).
     Returns message_id of the UI message.
+
+    If the stored render hash shows the message already has this text and
+    markup, the edit is skipped without calling Telegram.
+
+    Edits to one message are coalesced: while one is in flight, only the
+    newest render waits and older waiting renders are dropped (they return
+    without touching Telegram or ui_state), so the last render wins both on
+    screen and in the persisted state.
     """
+    rendered = render_hash(text, reply_markup)
     state = await get_ui_state(conn, user_id)
     if state and int(state["chat_id"]) == int(chat_id):
         message_id = int(state["message_id"])
+        key = (int(chat_id), message_id)
+        # пока идёт правка, сохранённый хэш может быть устаревшим
+        if key not in _edit_slots and state.get("render_hash") == rendered:
+            await set_ui_state(conn, user_id, chat_id, message_id, screen, payload, render_hash=rendered)
+            return message_id
+        slot = await _acquire_edit(key)
+        if slot is None:
+            return message_id
         try:
-            await bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=message_id,
-                text=text,
-                reply_markup=reply_markup,
-                disable_web_page_preview=True,
-            )
-            await set_ui_state(conn, user_id, chat_id, message_id, screen, payload)
+            if slot.last_hash != rendered:
+                await bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=text,
+                    reply_markup=reply_markup,
+                    disable_web_page_preview=True,
+                )
+                slot.last_hash = rendered
+            await set_ui_state(conn, user_id, chat_id, message_id, screen, payload, render_hash=rendered)
             return message_id
         except TelegramBadRequest as e:
             # "message is not modified" should be treated as success.
             if "message is not modified" in str(e).lower():
-                await set_ui_state(conn, user_id, chat_id, message_id, screen, payload)
+                slot.last_hash = rendered
+                await set_ui_state(conn, user_id, chat_id, message_id, screen, payload, render_hash=rendered)
                 return message_id
             # message not found / can't be edited / etc -> fallback to recreate
         except TelegramForbiddenError:
             # bot blocked or no rights
             raise
+        finally:
+            _release_edit(key)
 
     msg = await bot.send_message(
         chat_id=chat_id,
@@ -56,7 +139,7 @@ async def edit_or_recreate(
         reply_markup=reply_markup,
         disable_web_page_preview=True,
     )
-    await set_ui_state(conn, user_id, chat_id, msg.message_id, screen, payload)
+    await set_ui_state(conn, user_id, chat_id, msg.message_id, screen, payload, render_hash=rendered)
     return msg.message_id
 
 
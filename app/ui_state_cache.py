@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any
+
+from .db import MISSING
+
+UI_STATE_CACHE_MAX_SIZE = 50_000
+
+
+class UiStateCache:
+    """
+    LRU-кэш user_id -> ui_state (dict как у строки таблицы; None — строки
+    нет) с отложенной записью. Все изменения ui_state идут через
+    repo.set_ui_state, поэтому закэшированное значение всегда актуальнее БД;
+    изменённые состояния копятся в ``_dirty`` и пишутся пачкой
+    (repo.flush_ui_state). Пока состояние не записано, оно не вытесняется.
+    """
+
+    def __init__(self, *, max_size: int = UI_STATE_CACHE_MAX_SIZE) -> None:
+        self.max_size = max_size
+        self._items: OrderedDict[int, dict[str, Any] | None] = OrderedDict()
+        self._dirty: dict[int, dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def get(self, user_id: int) -> Any:
+        """Состояние пользователя, None (строки нет) или MISSING (не в кэше)."""
+        if user_id in self._items:
+            self._items.move_to_end(user_id)
+            return self._items[user_id]
+        return self._dirty.get(user_id, MISSING)
+
+    def put(self, user_id: int, state: dict[str, Any] | None) -> None:
+        self._items[user_id] = state
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def mark_dirty(self, user_id: int, state: dict[str, Any]) -> None:
+        # апдейты одного пользователя коммитятся не по порядку отрисовки —
+        # пишем актуальное значение кэша, а не то, что было при вызове
+        current = self._items.get(user_id)
+        self._dirty[user_id] = current if current is not None else state
+
+    def drain(self) -> list[dict[str, Any]]:
+        """Забирает несохранённые состояния; их запись — на вызывающем."""
+        states = list(self._dirty.values())
+        self._dirty = {}
+        return states
+
+    def restore(self, states: list[dict[str, Any]]) -> None:
+        """Запись упала — возвращаем состояния, не затирая более новые."""
+        for state in states:
+            self._dirty.setdefault(int(state["user_id"]), state)
+
+
+ui_state_cache = UiStateCache()
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+import time
+from collections import deque
+from contextlib import suppress
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+from aiogram.utils.backoff import Backoff, BackoffConfig
+
+log = logging.getLogger(__name__)
+
+# Апдейтов в обработке одновременно (разных пользователей)
+UPDATE_CONCURRENCY = 32
+# Принятых, но ещё не обработанных апдейтов; при заполнении приём ждёт
+UPDATE_QUEUE_SIZE = 1000
+# Сколько ждать обработки очереди при остановке (сек)
+UPDATE_DRAIN_TIMEOUT = 30.0
+# Сглаживание средней задержки в очереди
+_WAIT_EWMA_ALPHA = 0.1
+
+POLLING_TIMEOUT = 30
+_POLLING_BACKOFF = BackoffConfig(min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1)
+
+
+def _update_key(update: Update) -> int:
+    """Ключ упорядочивания: пользователь, иначе чат, иначе сам апдейт (без порядка)."""
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        # тип, неизвестный aiogram: не роняем приём, диспетчер сам его пропустит
+        event = None
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    # у ключей апдейтов без пользователя/чата отдельное отрицательное пространство
+    return -(1 << 62) - update.update_id
+
+
+class UpdateExecutor:
+    """
+    Исполнитель апдейтов: разные пользователи обрабатываются параллельно
+    (не больше ``concurrency``), апдейты одного пользователя — строго по
+    очереди. Всего в очереди не больше ``queue_size`` апдейтов: submit()
+    ждёт места, и источник (polling / webhook) притормаживает.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        *,
+        concurrency: int = UPDATE_CONCURRENCY,
+        queue_size: int = UPDATE_QUEUE_SIZE,
+    ) -> None:
+        self.dp = dp
+        self.bot = bot
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.workflow_data: dict[str, Any] = {}
+        self._capacity = asyncio.Semaphore(queue_size)
+        # ключ -> апдейты, ждущие своей очереди (ключ есть, пока у него есть работа)
+        self._queues: dict[int, deque[tuple[Update, float]]] = {}
+        # ключи, готовые к обработке; ключ лежит здесь не больше одного раза
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._workers: list[asyncio.Task[None]] = []
+        self._pending = 0
+        self._running = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.wait_avg = 0.0
+        self.wait_max = 0.0
+
+    def stats(self) -> dict[str, float]:
+        """Глубина очереди и задержка до начала обработки (сек); wait_max сбрасывается."""
+        out = {
+            "queued": self._pending - self._running,
+            "running": self._running,
+            "wait_avg": self.wait_avg,
+            "wait_max": self.wait_max,
+        }
+        self.wait_max = 0.0
+        return out
+
+    def start(self, **workflow_data: Any) -> None:
+        """Запускает воркеров; workflow_data передаётся в dp.feed_update."""
+        self.workflow_data = workflow_data
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def submit(self, update: Update) -> None:
+        """Ставит апдейт в очередь; при полной очереди ждёт места."""
+        await self._capacity.acquire()
+        self._pending += 1
+        self._idle.clear()
+        key = _update_key(update)
+        queue = self._queues.get(key)
+        if queue is None:
+            self._queues[key] = deque([(update, time.monotonic())])
+            self._ready.put_nowait(key)
+        else:
+            # у пользователя уже есть работа — воркер возьмёт апдейт следом
+            queue.append((update, time.monotonic()))
+
+    async def drain(self, timeout: float = UPDATE_DRAIN_TIMEOUT) -> None:
+        """Дожидается обработки принятых апдейтов и останавливает воркеров."""
+        if self._pending:
+            log.info("Draining %s queued updates", self._pending)
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._idle.wait(), timeout)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._queues[key]
+            update, enqueued_at = queue.popleft()
+            wait = time.monotonic() - enqueued_at
+            self.wait_avg += _WAIT_EWMA_ALPHA * (wait - self.wait_avg)
+            self.wait_max = max(self.wait_max, wait)
+            self._running += 1
+            try:
+                await self._process(update)
+            finally:
+                self._running -= 1
+                self._pending -= 1
+                self._capacity.release()
+                if queue:
+                    # следующий апдейт пользователя — в конец общей очереди,
+                    # чтобы один активный пользователь не занимал воркера
+                    self._ready.put_nowait(key)
+                else:
+                    del self._queues[key]
+                if not self._pending:
+                    self._idle.set()
+
+    async def _process(self, update: Update) -> None:
+        try:
+            response = await self.dp.feed_update(self.bot, update, **self.workflow_data)
+            if isinstance(response, TelegramMethod):
+                await self.dp.silent_call_request(bot=self.bot, result=response)
+        except Exception:
+            log.exception("Update %s failed", update.update_id)
+
+
+async def run_polling(dp: Dispatcher, bot: Bot, executor: UpdateExecutor, **kwargs: Any) -> None:
+    """
+    Long polling через UpdateExecutor (вместо dp.start_polling): getUpdates
+    не запрашивается, пока очередь исполнителя полна. До SIGINT/SIGTERM,
+    затем дожидается обработки принятых апдейтов.
+    """
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data, **kwargs}
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    await dp.emit_startup(bot=bot, **workflow_data)
+    executor.start(**workflow_data)
+    poller = asyncio.create_task(_poll(dp, bot, executor))
+    try:
+        await asyncio.wait({poller, asyncio.create_task(stop.wait())}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        poller.cancel()
+        with suppress(asyncio.CancelledError):
+            await poller
+        await executor.drain()
+        try:
+            await dp.emit_shutdown(bot=bot, **workflow_data)
+        finally:
+            await bot.session.close()
+
+
+async def _poll(dp: Dispatcher, bot: Bot, executor: UpdateExecutor) -> None:
+    allowed_updates = dp.resolve_used_update_types()
+    backoff = Backoff(config=_POLLING_BACKOFF)
+    offset: int | None = None
+    me = await bot.me()
+    log.info("Run polling for bot @%s id=%d", me.username, me.id)
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset,
+                timeout=POLLING_TIMEOUT,
+                allowed_updates=allowed_updates,
+                request_timeout=POLLING_TIMEOUT + 5,
+            )
+        except (TelegramNetworkError, TelegramServerError) as e:
+            log.warning("getUpdates failed: %s; retry in %.1f s", e, backoff.next_delay)
+            await backoff.asleep()
+            continue
+        backoff.reset()
+        for update in updates:
+            await executor.submit(update)
+            offset = update.update_id + 1
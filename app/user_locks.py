@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from .db import Database
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        # держат или ждут замок; 0 — запись больше не нужна
+        self.users = 0
+
+
+class UserLocks:
+    """
+    asyncio.Lock на пользователя. Замок живёт, пока его кто-то держит или
+    ждёт, и удаляется, как только освободился — реестр не растёт с числом
+    пользователей, когда-либо нажимавших кнопку.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[int, _Entry] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def locked(self, user_id: int) -> bool:
+        entry = self._entries.get(user_id)
+        return entry is not None and entry.lock.locked()
+
+    @asynccontextmanager
+    async def hold(self, user_id: int) -> AsyncIterator[None]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            entry = self._entries[user_id] = _Entry()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._entries[user_id]
+
+
+user_locks = UserLocks()
+
+
+@asynccontextmanager
+async def user_lock(conn: Database, user_id: int) -> AsyncIterator[None]:
+    """
+    Критическая секция пользователя (ход в игре, вывод, бонус за задания).
+    Записи, сделанные внутри, коммитятся до снятия замка: иначе следующий
+    апдейт прочитал бы состояние до них.
+    """
+    async with user_locks.hold(user_id):
+        yield
+        uow = conn.current_uow
+        if uow is not None:
+            await uow.flush()
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+import signal
+from contextlib import suppress
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from .config import Config
+from .update_executor import UpdateExecutor
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Приём апдейтов через aiohttp. Запрос проверяется по секретному токену,
+    апдейт ставится в очередь UpdateExecutor, а ответ 200 уходит сразу.
+    Если очередь полна, запрос ждёт места — и Telegram сам притормаживает
+    доставку.
+    """
+
+    def __init__(self, bot: Bot, cfg: Config, executor: UpdateExecutor) -> None:
+        self.bot = bot
+        self.cfg = cfg
+        self.executor = executor
+        self._accepting = True
+        self._runner: web.AppRunner | None = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.cfg.webhook_path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        # WEBHOOK_SECRET обязателен (load_config), без него принимаем поддельные апдейты
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.cfg.webhook_secret.encode()):
+            return web.Response(status=401)
+        if not self._accepting:
+            # Telegram повторит доставку после перезапуска
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception:
+            log.warning("Malformed webhook update", exc_info=True)
+            return web.Response(status=400)
+
+        await self.executor.submit(update)
+        return web.Response()
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.cfg.webhook_host, self.cfg.webhook_port)
+        await site.start()
+        log.info(
+            "Webhook server listening on %s:%s%s",
+            self.cfg.webhook_host, self.cfg.webhook_port, self.cfg.webhook_path,
+        )
+
+    async def stop(self) -> None:
+        """Перестаёт принимать апдейты; принятые дорабатывает executor.drain()."""
+        self._accepting = False
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def run_webhook(
+    dp: Dispatcher, bot: Bot, cfg: Config, executor: UpdateExecutor, **kwargs: Any
+) -> None:
+    """
+    Аналог dp.start_polling для режима webhook: регистрирует вебхук (если
+    задан WEBHOOK_URL), слушает до SIGINT/SIGTERM, затем дожидается
+    обработки принятых апдейтов.
+    """
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data, **kwargs}
+    server = WebhookServer(bot, cfg, executor)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    await dp.emit_startup(bot=bot, **workflow_data)
+    executor.start(**workflow_data)
+    try:
+        await server.start()
+        if cfg.webhook_url:
+            await bot.set_webhook(
+                url=cfg.webhook_url.rstrip("/") + cfg.webhook_path,
+                secret_token=cfg.webhook_secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=cfg.webhook_max_connections,
+                drop_pending_updates=False,
+            )
+        await stop.wait()
+    finally:
+        await server.stop()
+        await executor.drain()
+        try:
+            await dp.emit_shutdown(bot=bot, **workflow_data)
+        finally:
+            await bot.session.close()
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from .db import Database
+from .repo import flush_ui_state, flush_user_activity
+
+log = logging.getLogger(__name__)
+
+# Как часто сбрасывать отложенные записи (активность, ui_state) в БД (сек);
+# при падении процесса теряется не больше этого интервала навигации
+WRITE_BEHIND_INTERVAL = 2.0
+
+
+async def flush_write_behind(conn: Database) -> None:
+    """Пишет все буферы отложенной записи; вызывается и при остановке бота."""
+    await flush_user_activity(conn)
+    await flush_ui_state(conn)
+
+
+async def run_write_behind_loop(conn: Database) -> None:
+    """Фоновая задача: раз в WRITE_BEHIND_INTERVAL сбрасывает буферы в БД."""
+    while True:
+        await asyncio.sleep(WRITE_BEHIND_INTERVAL)
+        try:
+            await flush_write_behind(conn)
+        except Exception:
+            log.exception("Write-behind flush failed")
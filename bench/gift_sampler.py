@@ -0,0 +1,55 @@
+"""
+Микробенчмарк GiftSampler против прежнего линейного выбора подарка.
+
+Запуск из корня репозитория: python -m bench.gift_sampler
+"""
+from __future__ import annotations
+
+import random
+import timeit
+from typing import Mapping, Sequence
+
+from app.game_state import CELL_COUNT
+from app.gift_sampler import GiftSampler
+
+
+def _legacy_pick(gifts: Sequence[Mapping]) -> Mapping:
+    # прежний game._pick_gift_weighted
+    weights = [max(0.0, float(g["drop_chance"])) for g in gifts]
+    total = sum(weights)
+    if total <= 0:
+        return random.choice(gifts)
+    r = random.random() * total
+    acc = 0.0
+    for g, w in zip(gifts, weights):
+        acc += w
+        if r <= acc:
+            return g
+    return gifts[-1]
+
+
+def _legacy_board(gifts: Sequence[Mapping], cell_chance: float) -> list[int | None]:
+    cells: list[int | None] = [None] * CELL_COUNT
+    for i in range(CELL_COUNT):
+        if random.random() < cell_chance:
+            cells[i] = int(_legacy_pick(gifts)["id"])
+    return cells
+
+
+def main() -> None:
+    for n_gifts in (5, 30, 200):
+        gifts = [{"id": i + 1, "drop_chance": random.uniform(0.1, 10)} for i in range(n_gifts)]
+        sampler = GiftSampler(gifts)
+        for chance in (0.1, 1.0):
+            n = 20_000
+            legacy = timeit.timeit(lambda: _legacy_board(gifts, chance), number=n)
+            new = timeit.timeit(lambda: sampler.board(chance), number=n)
+            print(
+                f"gifts={n_gifts:<4} chance={chance:<4} "
+                f"legacy {legacy / n * 1e6:7.1f} us/board  "
+                f"sampler {new / n * 1e6:7.1f} us/board  x{legacy / new:.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
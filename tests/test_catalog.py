@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from app.catalog import get_catalog
+from app.db import Database, init_db
+from app.repo import set_setting
+
+
+async def _open(path: Path) -> Database:
+    conn = await Database.open(str(path), readers=1)
+    await init_db(conn)
+    return conn
+
+
+class _Boom(Exception):
+    pass
+
+
+@pytest.mark.parametrize("in_transaction", [False, True], ids=["pending", "transaction"])
+def test_rolled_back_edit_is_not_published(tmp_path: Path, in_transaction: bool) -> None:
+    async def run() -> tuple[str | None, str | None]:
+        conn = await _open(tmp_path / "bot.sqlite3")
+        try:
+            await set_setting(conn, "test_key", "committed")
+            seen = None
+            with pytest.raises(_Boom):
+                async with conn.unit_of_work():
+                    if in_transaction:
+                        async with conn.transaction():
+                            await set_setting(conn, "test_key", "rolled back")
+                            seen = (await get_catalog(conn)).settings.get("test_key")
+                            raise _Boom
+                    await set_setting(conn, "test_key", "rolled back")
+                    seen = (await get_catalog(conn)).settings.get("test_key")
+                    raise _Boom
+            return seen, (await get_catalog(conn)).settings.get("test_key")
+        finally:
+            await conn.close()
+
+    seen, after = asyncio.run(run())
+    # своя единица работы видит правку, остальные после отката — нет
+    assert seen == "rolled back"
+    assert after == "committed"
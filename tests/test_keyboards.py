@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import EditMessageText
+from aiogram.types import InlineKeyboardMarkup
+
+from app.keyboards import (
+    kb_admin_menu,
+    kb_back_to_menu,
+    kb_game_board,
+    kb_game_controls,
+    kb_game_screen,
+    kb_menu,
+    kb_profile_menu,
+)
+
+BOARD = ["⬜"] * 35 + ["🎁"]
+
+# Общие (из кэша) и собираемые на клик клавиатуры
+KEYBOARDS = [
+    ("menu", kb_menu),
+    ("back_to_menu", kb_back_to_menu),
+    ("profile", kb_profile_menu),
+    ("admin", kb_admin_menu),
+    ("game_controls", lambda: kb_game_controls(True)),
+    ("game_board", lambda: kb_game_board(BOARD)),
+    ("game_screen", lambda: kb_game_screen(BOARD, can_take=True)),
+]
+
+
+def _sent_reply_markup(markup: InlineKeyboardMarkup) -> str:
+    """reply_markup ровно в том виде, в каком aiohttp-сессия отправит его в Telegram."""
+    bot = Bot("1:test")
+    method = EditMessageText(chat_id=1, message_id=1, text="t", reply_markup=markup)
+    form = AiohttpSession().build_form_data(bot, method)
+    for options, _, value in form._fields:
+        if options["name"] == "reply_markup":
+            return value
+    raise AssertionError("reply_markup is missing from the form")
+
+
+@pytest.mark.parametrize("name, build", KEYBOARDS, ids=[name for name, _ in KEYBOARDS])
+def test_edit_message_reply_markup_has_no_nulls(name: str, build) -> None:
+    sent = _sent_reply_markup(build())
+    assert "null" not in sent, sent
+    rows = json.loads(sent)["inline_keyboard"]
+    assert rows and all(isinstance(row, list) and row for row in rows)
+
+
+def test_game_screen_matches_validated_markup() -> None:
+    # разметка без валидации (model_construct) уходит так же, как обычная
+    screen = kb_game_screen(BOARD, can_take=True)
+    validated = InlineKeyboardMarkup(
+        inline_keyboard=[list(row) for row in kb_game_board(BOARD).inline_keyboard]
+        + [list(row) for row in kb_game_controls(True).inline_keyboard]
+    )
+    assert _sent_reply_markup(screen) == _sent_reply_markup(validated)
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from app.db import SCHEMA_VERSION, Database, get_schema_version, init_db
+
+# Запросы горячего пути (как в app/repo.py) -> индекс, который они должны использовать
+HOT_PATH_QUERIES = [
+    (
+        "SELECT i.*, g.title FROM inventory i JOIN gifts g ON g.id=i.gift_id "
+        "WHERE i.user_id=? ORDER BY i.id DESC",
+        (1,),
+        "idx_inventory_user",
+    ),
+    ("SELECT 1 FROM inventory WHERE user_id=? LIMIT 1", (1,), "idx_inventory_user"),
+    ("SELECT 1 FROM inventory WHERE gift_id=? LIMIT 1", (1,), "idx_inventory_gift"),
+    (
+        "SELECT user_id FROM user_reminders WHERE next_reminder_ts IS NOT NULL AND next_reminder_ts <= ?",
+        (0,),
+        "idx_user_reminders_next",
+    ),
+    ("SELECT * FROM withdraw_requests WHERE status=?", ("pending",), "idx_withdraw_requests_status"),
+    ("SELECT * FROM users ORDER BY created_at DESC LIMIT ? OFFSET ?", (50, 0), "idx_users_created_at"),
+    ("SELECT * FROM broadcasts WHERE status='running' ORDER BY id", (), "idx_broadcasts_status"),
+    (
+        "SELECT id, state, finished_at FROM game_sessions WHERE user_id=? ORDER BY id DESC LIMIT 1",
+        (1,),
+        "idx_game_sessions_user_finished",
+    ),
+    (
+        "SELECT id FROM game_sessions WHERE finished_at IS NOT NULL AND finished_at < ? "
+        "ORDER BY finished_at LIMIT ?",
+        (0, 100),
+        "idx_game_sessions_finished",
+    ),
+]
+
+
+async def _open(path: Path) -> Database:
+    conn = await Database.open(str(path), readers=1)
+    await init_db(conn)
+    return conn
+
+
+async def _plan(conn: Database, sql: str, params: tuple) -> str:
+    cur = await conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+    return " | ".join(str(row["detail"]) for row in await cur.fetchall())
+
+
+@pytest.mark.parametrize("sql, params, index", HOT_PATH_QUERIES)
+def test_hot_path_query_uses_index(tmp_path: Path, sql: str, params: tuple, index: str) -> None:
+    async def run() -> str:
+        conn = await _open(tmp_path / "bot.sqlite3")
+        try:
+            return await _plan(conn, sql, params)
+        finally:
+            await conn.close()
+
+    plan = asyncio.run(run())
+    assert f"USING INDEX {index}" in plan or f"USING COVERING INDEX {index}" in plan, plan
+
+
+def test_init_db_sets_user_version_and_is_idempotent(tmp_path: Path) -> None:
+    async def run() -> tuple[int, int]:
+        path = tmp_path / "bot.sqlite3"
+        conn = await _open(path)
+        first = await get_schema_version(conn)
+        await conn.close()
+        # повторный старт: БД уже актуальна, миграции не применяются повторно
+        conn = await _open(path)
+        second = await get_schema_version(conn)
+        await conn.close()
+        return first, second
+
+    assert asyncio.run(run()) == (SCHEMA_VERSION, SCHEMA_VERSION)
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from app.update_executor import UpdateExecutor, _update_key
+
+
+def _unknown_update(update_id: int) -> Update:
+    # тип апдейта, которого нет в этой версии aiogram
+    return Update.model_validate({"update_id": update_id, "future_event": {"id": 1}})
+
+
+def test_unknown_update_type_gets_per_update_key() -> None:
+    assert _update_key(_unknown_update(7)) != _update_key(_unknown_update(8))
+
+
+def test_unknown_update_type_reaches_dispatcher() -> None:
+    async def run() -> list[int]:
+        fed: list[int] = []
+        dp = Dispatcher()
+
+        async def feed_update(bot: Bot, update: Update, **kwargs) -> None:
+            fed.append(update.update_id)
+
+        dp.feed_update = feed_update  # type: ignore[method-assign]
+        executor = UpdateExecutor(dp, Bot("1:test"), concurrency=2, queue_size=4)
+        executor.start()
+        await executor.submit(_unknown_update(1))
+        await executor.drain(timeout=1.0)
+        return fed
+
+    assert asyncio.run(run()) == [1]